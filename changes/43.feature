@@ -0,0 +1 @@
+Support paginated (`cursor` and `limit`) and streamed (newline-delimited JSON) directory listings in `/folder/file/list` so that large directories can be browsed completely
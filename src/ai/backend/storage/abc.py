@@ -1,12 +1,23 @@
 from __future__ import annotations
 
+import asyncio
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePath, PurePosixPath
-from typing import Any, AsyncIterator, Final, FrozenSet, Mapping, Sequence
+from typing import (
+    Any,
+    AsyncIterator,
+    Final,
+    FrozenSet,
+    Mapping,
+    Optional,
+    Sequence,
+)
 from uuid import UUID
 
 from ai.backend.common.types import BinarySize, HardwareMetadata
 
+from .clone import CloneCheckpoint, CloneProgress
 from .exception import InvalidSubpathError, VFolderNotFoundError
 from .types import (
     DirEntry,
@@ -14,7 +25,9 @@ from .types import (
     FSUsage,
     VFolderCreationOptions,
     VFolderUsage,
+    VFolderUsageResult,
 )
+from .walker import DEFAULT_WALK_CONCURRENCY, DEFAULT_WALK_THREADS
 
 # Available capabilities of a volume implementation
 CAP_VFOLDER: Final = "vfolder"
@@ -23,6 +36,8 @@ CAP_METRIC: Final = "metric"
 CAP_QUOTA: Final = "quota"
 CAP_FAST_SCAN: Final = "fast-scan"
 
+DEFAULT_USAGE_BATCH_CONCURRENCY: Final = 16
+
 
 class AbstractVolume(metaclass=ABCMeta):
     def __init__(
@@ -37,11 +52,35 @@ class AbstractVolume(metaclass=ABCMeta):
         self.mount_path = mount_path
         self.fsprefix = fsprefix or PurePath(".")
         self.config = options or {}
+        # the number of threads to walk directory trees in parallel
+        self.scan_concurrency = int(
+            self.config.get("scan_concurrency", DEFAULT_WALK_CONCURRENCY),
+        )
+        # shared by all directory tree walks on this volume
+        self.walk_executor = ThreadPoolExecutor(
+            max_workers=int(self.config.get("scan_threads", DEFAULT_WALK_THREADS)),
+            thread_name_prefix="TreeWalker",
+        )
+        # the number of vfolders to query concurrently in a batch usage query
+        self.usage_batch_concurrency = int(
+            self.config.get(
+                "usage_batch_concurrency",
+                DEFAULT_USAGE_BATCH_CONCURRENCY,
+            ),
+        )
 
     async def init(self) -> None:
         pass
 
     async def shutdown(self) -> None:
+        # Let the running walks finish in the background.
+        self.walk_executor.shutdown(wait=False)
+
+    def invalidate_usage(self, vfid: UUID) -> None:
+        """
+        Notify that the contents of the given vfolder have been changed
+        by the storage proxy so that any cached usage should be refreshed.
+        """
         pass
 
     def mangle_vfpath(self, vfid: UUID) -> Path:
@@ -98,11 +137,16 @@ class AbstractVolume(metaclass=ABCMeta):
         dst_volume: AbstractVolume,
         dst_vfid: UUID,
         options: VFolderCreationOptions = None,
+        *,
+        progress: CloneProgress = None,
     ) -> None:
         """
         Create a new vfolder on the destination volume with
         ``exist_ok=True`` option and copy all contents of the source
         vfolder into it, preserving file permissions and timestamps.
+        If the destination has the contents copied by a previous clone
+        which has failed, the clone is resumed from there.
+        The given progress object is updated while copying.
         """
         pass
 
@@ -111,12 +155,16 @@ class AbstractVolume(metaclass=ABCMeta):
         self,
         src_vfpath: Path,
         dst_vfpath: Path,
+        *,
+        checkpoint: CloneCheckpoint = None,
     ) -> None:
         """
         The actual backend-specific implementation of copying
         files from a directory to another in an efficient way.
         The source and destination are in the same filesystem namespace
         but they may be on different physical media.
+        If the checkpoint is given, the implementation should skip the files
+        already copied and record the progress to it, if possible.
         """
         pass
 
@@ -160,10 +208,74 @@ class AbstractVolume(metaclass=ABCMeta):
     async def get_used_bytes(self, vfid: UUID) -> BinarySize:
         pass
 
+    async def _query_usage(
+        self,
+        vfid: UUID,
+        *,
+        with_quota: bool,
+    ) -> VFolderUsageResult:
+        try:
+            usage = await self.get_usage(vfid)
+            quota = None
+            if with_quota:
+                try:
+                    quota = await self.get_quota(vfid)
+                except NotImplementedError:
+                    pass
+        except Exception as e:
+            return VFolderUsageResult(vfid, error=repr(e))
+        return VFolderUsageResult(vfid, usage=usage, quota=quota)
+
+    async def get_usage_batch(
+        self,
+        vfids: Sequence[UUID],
+        *,
+        with_quota: bool = False,
+    ) -> AsyncIterator[VFolderUsageResult]:
+        """
+        Query the usage (and the quota) of the given vfolders, yielding the
+        results in the order of completion.
+
+        This default implementation queries up to ``usage_batch_concurrency``
+        vfolders at once.  Backends which can get the usage of many vfolders
+        with a single probe should override it.
+        """
+        sema = asyncio.Semaphore(self.usage_batch_concurrency)
+
+        async def _query(vfid: UUID) -> VFolderUsageResult:
+            async with sema:
+                return await self._query_usage(vfid, with_quota=with_quota)
+
+        tasks = [asyncio.create_task(_query(vfid)) for vfid in dict.fromkeys(vfids)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     # ------ vfolder operations -------
 
     @abstractmethod
-    def scandir(self, vfid: UUID, relpath: PurePosixPath) -> AsyncIterator[DirEntry]:
+    def scandir(
+        self,
+        vfid: UUID,
+        relpath: PurePosixPath,
+        *,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[DirEntry]:
+        """
+        Iterate over the entries of the given directory whose names come
+        after ``after`` if specified.
+
+        With ``limit``, the first ``limit`` entries in the order of their
+        names are yielded, so that the listing can be resumed by passing the
+        name of the last entry as ``after`` without skipping or repeating
+        entries even when the directory is modified meanwhile.  Otherwise,
+        all entries are yielded in the order returned by the filesystem.
+        """
         pass
 
     @abstractmethod
@@ -215,7 +327,7 @@ class AbstractVolume(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    async def prepare_upload(self, vfid: UUID) -> str:
+    async def prepare_upload(self, vfid: UUID, size: Optional[int] = None) -> str:
         """
         Prepare an upload session by creating a dedicated temporary directory.
         Returns a unique session identifier.
@@ -241,6 +353,19 @@ class AbstractVolume(metaclass=ABCMeta):
     ) -> AsyncIterator[bytes]:
         pass
 
+    async def get_local_file_path(
+        self,
+        vfid: UUID,
+        relpath: PurePosixPath,
+    ) -> Optional[Path]:
+        """
+        Return the path of the given regular file which can be opened
+        directly by the storage proxy process (e.g., to serve it with
+        ``sendfile()``), or None if the file can be read only via
+        :meth:`read_file()`.
+        """
+        return None
+
     @abstractmethod
     async def delete_files(
         self,
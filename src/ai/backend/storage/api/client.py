@@ -3,33 +3,72 @@ Client-facing API
 """
 
 import asyncio
+import enum
+import functools
 import json
 import logging
 import os
+import re
+import secrets
+import shutil
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Final, Mapping, MutableMapping, cast
+from typing import (
+    Any,
+    AsyncIterator,
+    Final,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    cast,
+)
 
 import aiohttp_cors
-import janus
 import trafaret as t
-import zipstream
 from aiohttp import hdrs, web
+from aiohttp.http_writer import StreamWriter
+from aiotools import aclosing
 
 from ai.backend.common import validators as tx
-from ai.backend.common.files import AsyncFileWriter
 from ai.backend.common.logging import BraceStyleAdapter
 
+from .. import fastcopy, metrics
 from ..abc import AbstractVolume
+from ..archive import (
+    DEFAULT_ARCHIVE_THREADS,
+    ArchiveError,
+    ArchiveMember,
+    TarStreamWriter,
+    TarZstdStreamWriter,
+    ZipStreamWriter,
+    inspect_archive_members,
+    list_archive_members,
+)
 from ..context import Context
 from ..exception import InvalidAPIParameters
-from ..types import SENTINEL
+from ..upload import (
+    UploadFileWriter,
+    UploadSessionStore,
+    preallocate,
+    release_preallocation,
+)
 from ..utils import CheckParamSource, check_params
+from ..walker import DEFAULT_WALK_CONCURRENCY
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
 DEFAULT_CHUNK_SIZE: Final = 256 * 1024  # 256 KiB
-DEFAULT_INFLIGHT_CHUNKS: Final = 8
+
+TUS_HEADERS: Final = (
+    "Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, "
+    "Upload-Concat, Location, Content-Type"
+)
+TUS_EXTENSIONS: Final = "concatenation"
+# The ID of a partial upload, which carries its length.
+TUS_PART_ID_PATTERN: Final = r"^[0-9a-f]{16}-(\d+)$"
 
 
 download_token_data_iv = t.Dict(
@@ -71,6 +110,10 @@ async def download(request: web.Request) -> web.StreamResponse:
                     inner_iv=download_token_data_iv,
                 ),
                 t.Key("archive", default=False): t.ToBool,
+                t.Key("archive_format", default=ArchiveFormat.ZIP.value): t.Enum(
+                    *(f.value for f in ArchiveFormat),
+                )
+                >> ArchiveFormat,
                 t.Key("no_cache", default=False): t.ToBool,
             },
         ),
@@ -100,7 +143,17 @@ async def download(request: web.Request) -> web.StreamResponse:
             if not file_path.is_file():
                 if params["archive"]:
                     # Download directory as an archive when archive param is set.
-                    return await download_directory_as_archive(request, file_path)
+                    return await download_directory_as_archive(
+                        request,
+                        file_path,
+                        archive_format=params["archive_format"],
+                        scan_concurrency=volume.scan_concurrency,
+                        walk_executor=volume.walk_executor,
+                        archive_executor=request.app["archive_executor"],
+                        archive_threads=ctx.local_config["storage-proxy"][
+                            "archive-threads"
+                        ],
+                    )
                 else:
                     raise InvalidAPIParameters("The file is not a regular file.")
             if request.method == "HEAD":
@@ -131,59 +184,60 @@ async def download(request: web.Request) -> web.StreamResponse:
     return web.FileResponse(file_path, headers=cast(Mapping[str, str], headers))
 
 
+class ArchiveFormat(str, enum.Enum):
+    ZIP = "zip"
+    TAR = "tar"
+    TAR_ZSTD = "tar.zst"
+
+
+ARCHIVE_CONTENT_TYPES: Final[Mapping[ArchiveFormat, str]] = {
+    ArchiveFormat.ZIP: "application/zip",
+    ArchiveFormat.TAR: "application/x-tar",
+    ArchiveFormat.TAR_ZSTD: "application/zstd",
+}
+
+
+def _create_archive_executor(archive_threads: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=archive_threads,
+        thread_name_prefix="ArchiveWriter",
+    )
+
+
 async def download_directory_as_archive(
     request: web.Request,
     file_path: Path,
-    zip_filename: str = None,
+    archive_filename: str = None,
+    *,
+    archive_format: ArchiveFormat = ArchiveFormat.ZIP,
+    scan_concurrency: int = DEFAULT_WALK_CONCURRENCY,
+    walk_executor: ThreadPoolExecutor = None,
+    archive_executor: ThreadPoolExecutor = None,
+    archive_threads: int = DEFAULT_ARCHIVE_THREADS,
 ) -> web.StreamResponse:
     """
-    Serve a directory as a zip archive on the fly.
-    """
+    Serve a directory as an archive on the fly.
 
-    def _iter2aiter(iter):
-        """Iterable to async iterable"""
-
-        def _consume(loop, iter, q):
-            for item in iter:
-                q.put(item)
-            q.put(SENTINEL)
-
-        async def _aiter():
-            loop = asyncio.get_running_loop()
-            q = janus.Queue(maxsize=DEFAULT_INFLIGHT_CHUNKS)
-            try:
-                fut = loop.run_in_executor(None, lambda: _consume(loop, iter, q.sync_q))
-                while True:
-                    item = await q.async_q.get()
-                    if item is SENTINEL:
-                        break
-                    yield item
-                    q.async_q.task_done()
-                await fut
-            finally:
-                q.close()
-                await q.wait_closed()
-
-        return _aiter()
-
-    if zip_filename is None:
-        zip_filename = file_path.name + ".zip"
-    zf = zipstream.ZipFile(compression=zipstream.ZIP_DEFLATED)
-    async for root, dirs, files in _iter2aiter(os.walk(file_path)):
-        for file in files:
-            zf.write(Path(root) / file, Path(root).relative_to(file_path) / file)
-        if len(dirs) == 0 and len(files) == 0:
-            # Include an empty directory in the archive as well.
-            zf.write(root, Path(root).relative_to(file_path))
+    The files are inspected and compressed using ``archive_executor``, which
+    is shared by the concurrent downloads to bound the number of threads.
+    If not given, a new one with ``archive_threads`` threads is used.
+    """
+    if archive_filename is None:
+        archive_filename = f"{file_path.name}.{archive_format.value}"
+    relpaths = await list_archive_members(
+        file_path,
+        scan_concurrency=scan_concurrency,
+        walk_executor=walk_executor,
+    )
     ascii_filename = (
-        zip_filename.encode("ascii", errors="ignore")
+        archive_filename.encode("ascii", errors="ignore")
         .decode("ascii")
         .replace('"', r"\"")
     )
-    encoded_filename = urllib.parse.quote(zip_filename, encoding="utf-8")
+    encoded_filename = urllib.parse.quote(archive_filename, encoding="utf-8")
     response = web.StreamResponse(
         headers={
-            hdrs.CONTENT_TYPE: "application/zip",
+            hdrs.CONTENT_TYPE: ARCHIVE_CONTENT_TYPES[archive_format],
             hdrs.CONTENT_DISPOSITION: " ".join(
                 [
                     "attachment;" f'filename="{ascii_filename}";',  # RFC-2616 sec2.2
@@ -192,12 +246,113 @@ async def download_directory_as_archive(
             ),
         },
     )
-    await response.prepare(request)
-    async for chunk in _iter2aiter(zf):
-        await response.write(chunk)
+    if archive_executor is None:
+        executor = _create_archive_executor(archive_threads)
+    else:
+        executor = archive_executor
+    try:
+        members = await inspect_archive_members(
+            file_path,
+            relpaths,
+            executor,
+            compress=(archive_format == ArchiveFormat.ZIP),
+        )
+        chunks: AsyncIterator[bytes]
+        if archive_format == ArchiveFormat.TAR:
+            tar_writer = TarStreamWriter(members)
+            response.content_length = tar_writer.content_length
+            await response.prepare(request)
+            for part in tar_writer.iter_parts():
+                if isinstance(part, bytes):
+                    await response.write(part)
+                else:
+                    await _send_file_body(request, response, part)
+            await response.write_eof()
+            return response
+        elif archive_format == ArchiveFormat.TAR_ZSTD:
+            chunks = TarZstdStreamWriter(members, threads=archive_threads).iter_chunks()
+        else:
+            zip_writer = ZipStreamWriter(
+                members,
+                executor,
+                max_inflight_blocks=archive_threads * 2,
+            )
+            content_length = zip_writer.content_length
+            if content_length is not None:
+                response.content_length = content_length
+            chunks = zip_writer.iter_chunks()
+        await response.prepare(request)
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await response.write(chunk)
+    finally:
+        if executor is not archive_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
     return response
 
 
+def _can_sendfile(response: web.StreamResponse, writer: Any) -> bool:
+    """
+    Check if the file contents may be written to the transport directly,
+    bypassing the response writer.  It relies on the byte accounting of the
+    aiohttp 3.8 payload writer; otherwise the contents are written in chunks
+    through :meth:`StreamResponse.write()`.
+    """
+    if response.compression or response.chunked:
+        return False
+    return isinstance(writer, StreamWriter) and all(
+        hasattr(writer, attr_name) for attr_name in ("output_size", "length")
+    )
+
+
+async def _send_file_body(
+    request: web.Request,
+    response: web.StreamResponse,
+    member: ArchiveMember,
+) -> None:
+    """
+    Send the content of an archive member using ``sendfile()`` if possible,
+    with the exact size recorded in the archive.
+    """
+    loop = asyncio.get_running_loop()
+    transport = request.transport
+    assert transport is not None
+    writer = request.writer
+    f = await loop.run_in_executor(None, lambda: open(member.path, "rb"))
+    try:
+        sent = 0
+        if _can_sendfile(response, writer):
+            assert isinstance(writer, StreamWriter)
+            # Flush the data buffered by the response writer before writing
+            # to the transport directly, and keep its byte accounting.
+            await writer.drain()
+            try:
+                sent = await loop.sendfile(transport, f, 0, member.size)
+            except NotImplementedError:
+                # e.g., uvloop does not support sendfile() yet.
+                pass
+            writer.output_size += sent
+            if writer.length is not None:
+                writer.length -= sent
+        while sent < member.size:
+            chunk = await loop.run_in_executor(
+                None,
+                f.read,
+                min(DEFAULT_CHUNK_SIZE, member.size - sent),
+            )
+            if not chunk:
+                break
+            await response.write(chunk)
+            sent += len(chunk)
+    finally:
+        await loop.run_in_executor(None, f.close)
+    if sent != member.size:
+        # The response cannot be completed consistently with Content-Length.
+        raise ArchiveError(
+            f"The file has been truncated while archiving: {member.relpath}",
+        )
+
+
 async def tus_check_session(request: web.Request) -> web.Response:
     """
     Check the availability of an upload session.
@@ -212,13 +367,19 @@ async def tus_check_session(request: web.Request) -> web.Response:
                     secret=secret,
                     inner_iv=upload_token_data_iv,
                 ),
+                t.Key("part", default=None): t.Null | t.Regexp(TUS_PART_ID_PATTERN),
             },
         ),
         read_from=CheckParamSource.QUERY,
     ) as params:
         token_data = params["token"]
         async with ctx.get_volume(token_data["volume"]) as volume:
-            headers = await prepare_tus_session_headers(request, token_data, volume)
+            headers = await prepare_tus_session_headers(
+                request,
+                token_data,
+                volume,
+                part=params["part"],
+            )
     return web.Response(headers=headers)
 
 
@@ -236,41 +397,231 @@ async def tus_upload_part(request: web.Request) -> web.Response:
                     secret=secret,
                     inner_iv=upload_token_data_iv,
                 ),
+                t.Key("part", default=None): t.Null | t.Regexp(TUS_PART_ID_PATTERN),
             },
         ),
         read_from=CheckParamSource.QUERY,
     ) as params:
         token_data = params["token"]
         async with ctx.get_volume(token_data["volume"]) as volume:
-            headers = await prepare_tus_session_headers(request, token_data, volume)
-            vfpath = volume.mangle_vfpath(token_data["vfid"])
-            upload_temp_path = vfpath / ".upload" / token_data["session"]
-
-            async with AsyncFileWriter(
-                target_filename=upload_temp_path,
-                access_mode="ab",
-                max_chunks=DEFAULT_INFLIGHT_CHUNKS,
-            ) as writer:
-                while not request.content.at_eof():
-                    chunk = await request.content.read(DEFAULT_CHUNK_SIZE)
-                    await writer.write(chunk)
-
-            current_size = Path(upload_temp_path).stat().st_size
-            if current_size >= int(token_data["size"]):
-                target_path = vfpath / token_data["relpath"]
-                upload_temp_path.rename(target_path)
-                try:
-                    loop = asyncio.get_running_loop()
-                    await loop.run_in_executor(
-                        None,
-                        lambda: upload_temp_path.parent.rmdir(),
+            headers = await prepare_tus_session_headers(
+                request,
+                token_data,
+                volume,
+                part=params["part"],
+            )
+            upload_temp_path = _get_upload_path(volume, token_data, params["part"])
+
+            upload_length = int(headers["Upload-Length"])
+            loop = asyncio.get_running_loop()
+            storage_config = ctx.local_config["storage-proxy"]
+            writer = UploadFileWriter(
+                upload_temp_path,
+                buffer_size=storage_config["upload-buffer-size"],
+                max_inflight=storage_config["upload-inflight-buffers"],
+                direct_io=storage_config["upload-direct-io"],
+            )
+            opened = False
+            try:
+                async with writer:
+                    opened = True
+                    # The cached offset may be outdated if another worker has
+                    # served the previous request of the session.
+                    client_offset = request.headers.get("Upload-Offset")
+                    current_offset = str(writer.offset)
+                    if client_offset is not None and client_offset != current_offset:
+                        headers["Upload-Offset"] = current_offset
+                        raise web.HTTPConflict(headers=headers)
+                    if writer.offset == 0:
+                        # Reserve the disk space upon the first write only, so
+                        # that the session files replaced by the partial
+                        # uploads do not hold it.  It reduces the
+                        # fragmentation of large uploads.
+                        await loop.run_in_executor(
+                            None,
+                            preallocate,
+                            upload_temp_path,
+                            upload_length,
+                        )
+                    while not request.content.at_eof():
+                        chunk = await request.content.read(DEFAULT_CHUNK_SIZE)
+                        await writer.write(chunk)
+                        metrics.streamed_bytes.inc(len(chunk), op="upload")
+            finally:
+                if opened:
+                    # Record what has been written even if the client has
+                    # disconnected in the middle.
+                    await asyncio.shield(
+                        ctx.upload_sessions.update(
+                            upload_temp_path,
+                            writer.offset,
+                            upload_length,
+                        ),
                     )
-                except OSError:
-                    pass
+
+            volume.invalidate_usage(token_data["vfid"])
+            current_size = writer.offset
+            # The partial uploads are completed by the final upload.
+            if params["part"] is None and current_size >= upload_length:
+                await _complete_upload(
+                    ctx.upload_sessions,
+                    volume,
+                    token_data,
+                    upload_temp_path,
+                )
             headers["Upload-Offset"] = str(current_size)
     return web.Response(status=204, headers=headers)
 
 
+async def tus_create_upload(request: web.Request) -> web.Response:
+    """
+    Create a partial upload of the session or concatenate the partial uploads
+    into the final upload, as defined in the concatenation extension of tus.
+
+    The clients may upload the parts of a large file in parallel as the
+    partial uploads and then finish the session with the final upload.
+    """
+    ctx: Context = request.app["ctx"]
+    secret = ctx.local_config["storage-proxy"]["secret"]
+    async with check_params(
+        request,
+        t.Dict(
+            {
+                t.Key("token"): tx.JsonWebToken(
+                    secret=secret,
+                    inner_iv=upload_token_data_iv,
+                ),
+            },
+        ),
+        read_from=CheckParamSource.QUERY,
+    ) as params:
+        token_data = params["token"]
+        raw_token = request.query["token"]
+        upload_concat = request.headers.get("Upload-Concat", "")
+        async with ctx.get_volume(token_data["volume"]) as volume:
+            headers = await prepare_tus_session_headers(request, token_data, volume)
+            if upload_concat == "partial":
+                try:
+                    part_length = int(request.headers["Upload-Length"])
+                except (KeyError, ValueError):
+                    raise InvalidAPIParameters(
+                        msg="Upload-Length is required for a partial upload",
+                    )
+                if not (0 <= part_length <= int(token_data["size"])):
+                    raise InvalidAPIParameters(
+                        msg="Upload-Length exceeds the size of the upload session",
+                    )
+                part = f"{secrets.token_hex(8)}-{part_length}"
+                part_path = _get_upload_path(volume, token_data, part)
+
+                def _create_part() -> None:
+                    part_path.parent.mkdir(exist_ok=True)
+                    part_path.touch()
+                    # The data is uploaded into the partial uploads, which
+                    # reserve the disk space by themselves upon their writes.
+                    try:
+                        release_preallocation(_get_upload_path(volume, token_data))
+                    except FileNotFoundError:
+                        pass
+
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, _create_part)
+                await ctx.upload_sessions.update(part_path, 0, part_length)
+                headers = await prepare_tus_session_headers(
+                    request,
+                    token_data,
+                    volume,
+                    part=part,
+                )
+                query = urllib.parse.urlencode({"token": raw_token, "part": part})
+                headers["Location"] = f"{request.path}?{query}"
+                return web.Response(status=201, headers=headers)
+            if upload_concat.startswith("final;"):
+                parts = _parse_partial_uploads(upload_concat, raw_token)
+                await _concat_partial_uploads(
+                    ctx.upload_sessions,
+                    volume,
+                    token_data,
+                    parts,
+                )
+                headers["Upload-Offset"] = str(token_data["size"])
+                headers["Upload-Concat"] = upload_concat
+                query = urllib.parse.urlencode({"token": raw_token})
+                headers["Location"] = f"{request.path}?{query}"
+                return web.Response(status=201, headers=headers)
+            raise InvalidAPIParameters(
+                msg="Only the partial and final uploads can be created "
+                "as the upload session is created via the manager API",
+            )
+
+
+def _parse_partial_uploads(upload_concat: str, raw_token: str) -> List[str]:
+    parts = []
+    for url in upload_concat[len("final;") :].split():
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        if query.get("token") != [raw_token]:
+            raise InvalidAPIParameters(
+                msg="The partial uploads should belong to the same upload session",
+            )
+        part = query.get("part", [""])[0]
+        if re.match(TUS_PART_ID_PATTERN, part) is None:
+            raise InvalidAPIParameters(msg=f"Invalid partial upload URL: {url}")
+        parts.append(part)
+    if not parts:
+        raise InvalidAPIParameters(msg="No partial uploads to concatenate")
+    return parts
+
+
+async def _concat_partial_uploads(
+    upload_sessions: UploadSessionStore,
+    volume: AbstractVolume,
+    token_data: Mapping[str, Any],
+    parts: Sequence[str],
+) -> None:
+    part_paths = [_get_upload_path(volume, token_data, part) for part in parts]
+
+    def _get_part_sizes() -> List[int]:
+        # Check the actual sizes as the cached offsets may be outdated.
+        sizes = []
+        for part, part_path in zip(parts, part_paths):
+            try:
+                sizes.append(part_path.stat().st_size)
+            except FileNotFoundError:
+                raise InvalidAPIParameters(msg=f"No such partial upload: {part}")
+        return sizes
+
+    loop = asyncio.get_running_loop()
+    part_sizes = await loop.run_in_executor(None, _get_part_sizes)
+    for part, part_size in zip(parts, part_sizes):
+        if part_size != _get_part_length(part):
+            raise InvalidAPIParameters(
+                msg=f"The partial upload is not completed: {part}",
+            )
+    total_size = sum(part_sizes)
+    if total_size != int(token_data["size"]):
+        raise InvalidAPIParameters(
+            msg="The total length of the partial uploads does not match "
+            "the size of the upload session",
+        )
+    upload_temp_path = _get_upload_path(volume, token_data)
+    # Assemble the file inside the kernel or by sharing the data blocks
+    # where possible, instead of reading and writing all the data again.
+    used_strategies = await loop.run_in_executor(
+        None,
+        functools.partial(fastcopy.concat_files, part_paths, upload_temp_path),
+    )
+    log.debug(
+        "concatenated {} partial uploads of session {} ({})",
+        len(part_paths),
+        token_data["session"],
+        ", ".join(f"{k.value}: {v}" for k, v in used_strategies.items()),
+    )
+    volume.invalidate_usage(token_data["vfid"])
+    for part_path in part_paths:
+        await upload_sessions.forget(part_path)
+    await _complete_upload(upload_sessions, volume, token_data, upload_temp_path)
+
+
 async def tus_options(request: web.Request) -> web.Response:
     """
     Let clients discover the supported features of our tus.io server-side implementation.
@@ -278,15 +629,12 @@ async def tus_options(request: web.Request) -> web.Response:
     ctx: Context = request.app["ctx"]
     headers = {}
     headers["Access-Control-Allow-Origin"] = "*"
-    headers[
-        "Access-Control-Allow-Headers"
-    ] = "Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, Content-Type"
-    headers[
-        "Access-Control-Expose-Headers"
-    ] = "Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, Content-Type"
+    headers["Access-Control-Allow-Headers"] = TUS_HEADERS
+    headers["Access-Control-Expose-Headers"] = TUS_HEADERS
     headers["Access-Control-Allow-Methods"] = "*"
     headers["Tus-Resumable"] = "1.0.0"
     headers["Tus-Version"] = "1.0.0"
+    headers["Tus-Extension"] = TUS_EXTENSIONS
     headers["Tus-Max-Size"] = str(
         int(ctx.local_config["storage-proxy"]["max-upload-size"]),
     )
@@ -294,14 +642,68 @@ async def tus_options(request: web.Request) -> web.Response:
     return web.Response(headers=headers)
 
 
+def _get_upload_path(
+    volume: AbstractVolume,
+    token_data: Mapping[str, Any],
+    part: Optional[str] = None,
+) -> Path:
+    vfpath = volume.mangle_vfpath(token_data["vfid"])
+    upload_temp_path = vfpath / ".upload" / token_data["session"]
+    if part is not None:
+        return upload_temp_path.with_name(f"{token_data['session']}.parts") / part
+    return upload_temp_path
+
+
+def _get_part_length(part: str) -> int:
+    match = re.match(TUS_PART_ID_PATTERN, part)
+    assert match is not None
+    return int(match.group(1))
+
+
+async def _complete_upload(
+    upload_sessions: UploadSessionStore,
+    volume: AbstractVolume,
+    token_data: Mapping[str, Any],
+    upload_temp_path: Path,
+) -> None:
+    vfpath = volume.mangle_vfpath(token_data["vfid"])
+    target_path = vfpath / token_data["relpath"]
+    parts_path = upload_temp_path.with_name(f"{token_data['session']}.parts")
+
+    def _finish() -> None:
+        # Flush the data written by the upload requests at once.
+        fd = os.open(upload_temp_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        upload_temp_path.rename(target_path)
+        shutil.rmtree(parts_path, ignore_errors=True)
+        try:
+            upload_temp_path.parent.rmdir()
+        except OSError:
+            pass
+
+    await upload_sessions.forget(upload_temp_path)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _finish)
+
+
 async def prepare_tus_session_headers(
     request: web.Request,
     token_data: Mapping[str, Any],
     volume: AbstractVolume,
+    *,
+    part: Optional[str] = None,
 ) -> MutableMapping[str, str]:
-    vfpath = volume.mangle_vfpath(token_data["vfid"])
-    upload_temp_path = vfpath / ".upload" / token_data["session"]
-    if not Path(upload_temp_path).exists():
+    ctx: Context = request.app["ctx"]
+    upload_temp_path = _get_upload_path(volume, token_data, part)
+    if part is not None:
+        upload_length = _get_part_length(part)
+    else:
+        upload_length = int(token_data["size"])
+    state = await ctx.upload_sessions.get(upload_temp_path, upload_length)
+    if state is None:
         raise web.HTTPNotFound(
             body=json.dumps(
                 {
@@ -313,23 +715,38 @@ async def prepare_tus_session_headers(
         )
     headers = {}
     headers["Access-Control-Allow-Origin"] = "*"
-    headers[
-        "Access-Control-Allow-Headers"
-    ] = "Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, Content-Type"
-    headers[
-        "Access-Control-Expose-Headers"
-    ] = "Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, Content-Type"
+    headers["Access-Control-Allow-Headers"] = TUS_HEADERS
+    headers["Access-Control-Expose-Headers"] = TUS_HEADERS
     headers["Access-Control-Allow-Methods"] = "*"
     headers["Cache-Control"] = "no-store"
     headers["Tus-Resumable"] = "1.0.0"
-    headers["Upload-Offset"] = str(Path(upload_temp_path).stat().st_size)
-    headers["Upload-Length"] = str(token_data["size"])
+    headers["Upload-Offset"] = str(state.offset)
+    headers["Upload-Length"] = str(state.length)
+    if part is not None:
+        headers["Upload-Concat"] = "partial"
     return headers
 
 
+async def _shutdown_archive_executor(app: web.Application) -> None:
+    app["archive_executor"].shutdown(wait=False, cancel_futures=True)
+
+
 async def init_client_app(ctx: Context) -> web.Application:
-    app = web.Application()
+    app = web.Application(
+        middlewares=[
+            metrics.build_metrics_middleware(
+                "client",
+                streamed_routes={"/download": "download"},
+            ),
+        ],
+    )
     app["ctx"] = ctx
+    # shared by all archive downloads to bound the compression threads
+    app["archive_executor"] = _create_archive_executor(
+        ctx.local_config["storage-proxy"]["archive-threads"],
+    )
+    app.on_response_prepare.append(metrics.count_prepared_response)
+    app.on_cleanup.append(_shutdown_archive_executor)
     cors_options = {
         "*": aiohttp_cors.ResourceOptions(
             allow_credentials=True,
@@ -345,4 +762,5 @@ async def init_client_app(ctx: Context) -> web.Application:
     r.add_route("OPTIONS", tus_options)
     r.add_route("HEAD", tus_check_session)
     r.add_route("PATCH", tus_upload_part)
+    r.add_route("POST", tus_create_upload)
     return app
@@ -2,31 +2,57 @@
 Manager-facing API
 """
 
+import asyncio
 import json
 import logging
 from contextlib import contextmanager as ctxmgr
 from datetime import datetime
 from pathlib import Path
-from typing import Awaitable, Callable, Iterator, List
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Final,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+)
 from uuid import UUID
 
 import attr
 import jwt
 import trafaret as t
 from aiohttp import hdrs, web
+from aiotools import aclosing
 
 from ai.backend.common import validators as tx
 from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.storage.exception import ExecutionError
 
 from ..abc import AbstractVolume
+from ..clone import CloneProgress
 from ..context import Context
 from ..exception import InvalidSubpathError, VFolderNotFoundError
-from ..types import VFolderCreationOptions
+from ..metrics import (
+    build_metrics_middleware,
+    count_prepared_response,
+    render_metrics,
+)
+from ..types import (
+    DirEntry,
+    VFolderCreationOptions,
+    VFolderUsage,
+    VFolderUsageResult,
+)
 from ..utils import check_params, log_manager_api_entry
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
+LIST_FILES_STREAM_CHUNK_SIZE: Final = 64 * 1024
+MAX_USAGE_BATCH_SIZE: Final = 1000
+
 
 @web.middleware
 async def token_auth_middleware(
@@ -157,6 +183,12 @@ async def delete_vfolder(request: web.Request) -> web.Response:
 
 
 async def clone_vfolder(request: web.Request) -> web.Response:
+    """
+    Clone a vfolder in the background and return the task ID to query
+    the progress, or clone it synchronously if ``wait`` is set.
+    Cloning again to the same destination vfolder after a failure
+    resumes the clone from the files copied before.
+    """
     async with check_params(
         request,
         t.Dict(
@@ -167,19 +199,59 @@ async def clone_vfolder(request: web.Request) -> web.Response:
                 t.Key("dst_vfid"): tx.UUID(),
                 t.Key("options", default=None): t.Null
                 | VFolderCreationOptions.as_trafaret(),
+                t.Key("wait", default=False): t.ToBool,
             },
         ),
     ) as params:
         await log_manager_api_entry(log, "clone_vfolder", params)
         ctx: Context = request.app["ctx"]
-        async with ctx.get_volume(params["src_volume"]) as src_volume:
-            async with ctx.get_volume(params["dst_volume"]) as dst_volume:
-                await src_volume.clone_vfolder(
-                    params["src_vfid"],
-                    dst_volume,
-                    params["dst_vfid"],
-                )
-        return web.Response(status=204)
+
+        async def _clone(progress: CloneProgress = None) -> None:
+            async with ctx.get_volume(params["src_volume"]) as src_volume:
+                async with ctx.get_volume(params["dst_volume"]) as dst_volume:
+                    await src_volume.clone_vfolder(
+                        params["src_vfid"],
+                        dst_volume,
+                        params["dst_vfid"],
+                        params["options"],
+                        progress=progress,
+                    )
+
+        if params["wait"]:
+            await _clone()
+            return web.Response(status=204)
+        progress = ctx.clone_tasks.start(_clone)
+        return web.json_response(
+            {
+                "task_id": str(progress.task_id),
+            },
+            status=202,
+        )
+
+
+async def get_clone_progress(request: web.Request) -> web.Response:
+    async with check_params(
+        request,
+        t.Dict(
+            {
+                t.Key("task_id"): tx.UUID(),
+            },
+        ),
+    ) as params:
+        await log_manager_api_entry(log, "get_clone_progress", params)
+        ctx: Context = request.app["ctx"]
+        progress = await ctx.clone_tasks.get_progress(params["task_id"])
+        if progress is None:
+            raise web.HTTPNotFound(
+                body=json.dumps(
+                    {
+                        "msg": "No such clone task",
+                        "task_id": str(params["task_id"]),
+                    },
+                ),
+                content_type="application/json",
+            )
+        return web.json_response(progress.to_json())
 
 
 async def get_vfolder_mount(request: web.Request) -> web.Response:
@@ -266,28 +338,61 @@ async def fetch_file(request: web.Request) -> web.StreamResponse:
     ) as params:
         await log_manager_api_entry(log, "fetch_file", params)
         ctx: Context = request.app["ctx"]
-        response = web.StreamResponse(status=200)
-        response.headers[hdrs.CONTENT_TYPE] = "application/octet-stream"
         try:
-            prepared = False
             async with ctx.get_volume(params["volume"]) as volume:
                 with handle_fs_errors(volume, params["vfid"]):
-                    async for chunk in volume.read_file(
+                    file_path = await volume.get_local_file_path(
                         params["vfid"],
                         params["relpath"],
+                    )
+                    if file_path is not None and not await _has_gzip_sibling(
+                        file_path,
                     ):
-                        if not chunk:
-                            return response
-                        if not prepared:
-                            await response.prepare(request)
-                            prepared = True
-                        await response.write(chunk)
+                        # Let aiohttp use sendfile() and handle the Range and
+                        # If-Range headers so that the manager can fetch the
+                        # newly appended part of log files only.
+                        return web.FileResponse(
+                            file_path,
+                            headers={
+                                hdrs.CONTENT_TYPE: "application/octet-stream",
+                            },
+                        )
+                    return await _stream_file(request, volume, params)
         except FileNotFoundError:
-            response = web.Response(status=404, reason="Log data not found")
-        finally:
-            if prepared:
-                await response.write_eof()
-            return response
+            return web.Response(status=404, reason="Log data not found")
+
+
+async def _has_gzip_sibling(file_path: Path) -> bool:
+    # FileResponse serves "<name>.gz" instead if it exists and the client
+    # accepts gzip, which is not what we want for arbitrary user files.
+    loop = asyncio.get_running_loop()
+    gzip_path = file_path.with_name(file_path.name + ".gz")
+    return await loop.run_in_executor(None, gzip_path.exists)
+
+
+async def _stream_file(
+    request: web.Request,
+    volume: AbstractVolume,
+    params: Mapping[str, Any],
+) -> web.StreamResponse:
+    response = web.StreamResponse(status=200)
+    response.headers[hdrs.CONTENT_TYPE] = "application/octet-stream"
+    prepared = False
+    try:
+        async for chunk in volume.read_file(
+            params["vfid"],
+            params["relpath"],
+        ):
+            if not chunk:
+                return response
+            if not prepared:
+                await response.prepare(request)
+                prepared = True
+            await response.write(chunk)
+    finally:
+        if prepared:
+            await response.write_eof()
+    return response
 
 
 async def get_metadata(request: web.Request) -> web.Response:
@@ -348,6 +453,26 @@ async def get_vfolder_fs_usage(request: web.Request) -> web.Response:
             )
 
 
+def _usage_to_dict(usage: VFolderUsage) -> Mapping[str, Any]:
+    return {
+        "file_count": usage.file_count,
+        "used_bytes": usage.used_bytes,
+        "updated_at": (
+            None if usage.updated_at is None else usage.updated_at.isoformat()
+        ),
+    }
+
+
+def _usage_result_to_dict(result: VFolderUsageResult) -> Mapping[str, Any]:
+    if result.usage is None:
+        return {"vfid": str(result.vfid), "error": result.error}
+    return {
+        "vfid": str(result.vfid),
+        **_usage_to_dict(result.usage),
+        "quota": None if result.quota is None else int(result.quota),
+    }
+
+
 async def get_vfolder_usage(request: web.Request) -> web.Response:
     async with check_params(
         request,
@@ -363,12 +488,7 @@ async def get_vfolder_usage(request: web.Request) -> web.Response:
             ctx: Context = request.app["ctx"]
             async with ctx.get_volume(params["volume"]) as volume:
                 usage = await volume.get_usage(params["vfid"])
-                return web.json_response(
-                    {
-                        "file_count": usage.file_count,
-                        "used_bytes": usage.used_bytes,
-                    },
-                )
+                return web.json_response(_usage_to_dict(usage))
         except ExecutionError:
             return web.Response(
                 status=500,
@@ -376,6 +496,46 @@ async def get_vfolder_usage(request: web.Request) -> web.Response:
             )
 
 
+async def get_vfolder_usage_batch(request: web.Request) -> web.StreamResponse:
+    """
+    Query the usage (and the quota) of many vfolders in the same volume,
+    streaming the results as newline-delimited JSON objects in the order of
+    completion.  A failed query is reported as an object with the "error" key.
+    """
+    async with check_params(
+        request,
+        t.Dict(
+            {
+                t.Key("volume"): t.String(),
+                t.Key("vfids"): t.List(
+                    tx.UUID(),
+                    min_length=1,
+                    max_length=MAX_USAGE_BATCH_SIZE,
+                ),
+                t.Key("with_quota", default=False): t.ToBool,
+            },
+        ),
+    ) as params:
+        await log_manager_api_entry(log, "get_vfolder_usage_batch", params)
+        ctx: Context = request.app["ctx"]
+        async with ctx.get_volume(params["volume"]) as volume:
+            response = web.StreamResponse(status=200)
+            response.content_type = "application/x-ndjson"
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+            async with aclosing(
+                volume.get_usage_batch(
+                    params["vfids"],
+                    with_quota=params["with_quota"],
+                ),
+            ) as results:
+                async for result in results:
+                    line = json.dumps(_usage_result_to_dict(result)).encode() + b"\n"
+                    await response.write(line)
+            await response.write_eof()
+            return response
+
+
 async def get_quota(request: web.Request) -> web.Response:
     async with check_params(
         request,
@@ -437,7 +597,33 @@ async def mkdir(request: web.Request) -> web.Response:
         return web.Response(status=204)
 
 
-async def list_files(request: web.Request) -> web.Response:
+def _dir_entry_to_dict(item: DirEntry) -> Mapping[str, Any]:
+    return {
+        "name": item.name,
+        "type": item.type.name,
+        "stat": {
+            "mode": item.stat.mode,
+            "size": item.stat.size,
+            "created": item.stat.created.isoformat(),
+            "modified": item.stat.modified.isoformat(),
+        },
+        "symlink_target": item.symlink_target,
+    }
+
+
+async def list_files(request: web.Request) -> web.StreamResponse:
+    """
+    List the entries of a directory.
+
+    The entries are returned page by page in the order of their names: if
+    there are more entries than ``limit`` (default: the ``scandir-limit``
+    config), the response has ``next_cursor`` to be passed as ``cursor`` to
+    fetch the next page.  The cursor is the name of the last entry, so the
+    following pages neither skip nor repeat the entries even when the
+    directory is modified meanwhile.
+    With ``stream``, the entries are sent as newline-delimited JSON objects
+    as soon as they are scanned, without the default limit.
+    """
     async with check_params(
         request,
         t.Dict(
@@ -445,37 +631,92 @@ async def list_files(request: web.Request) -> web.Response:
                 t.Key("volume"): t.String(),
                 t.Key("vfid"): tx.UUID(),
                 t.Key("relpath"): tx.PurePath(relative_only=True),
+                t.Key("cursor", default=None): t.Null | t.String(),
+                t.Key("limit", default=None): t.Null | t.ToInt[1:],
+                t.Key("stream", default=False): t.ToBool,
             },
         ),
     ) as params:
         await log_manager_api_entry(log, "list_files", params)
         ctx: Context = request.app["ctx"]
+        limit = params["limit"]
+        if limit is None and not params["stream"]:
+            limit = ctx.local_config["storage-proxy"]["scandir-limit"] or None
         async with ctx.get_volume(params["volume"]) as volume:
+            if params["stream"]:
+                return await _stream_dir_entries(
+                    request,
+                    volume,
+                    params["vfid"],
+                    volume.scandir(
+                        params["vfid"],
+                        params["relpath"],
+                        after=params["cursor"],
+                        limit=limit,
+                    ),
+                )
             with handle_fs_errors(volume, params["vfid"]):
                 items = [
-                    {
-                        "name": item.name,
-                        "type": item.type.name,
-                        "stat": {
-                            "mode": item.stat.mode,
-                            "size": item.stat.size,
-                            "created": item.stat.created.isoformat(),
-                            "modified": item.stat.modified.isoformat(),
-                        },
-                        "symlink_target": item.symlink_target,
-                    }
+                    _dir_entry_to_dict(item)
                     async for item in volume.scandir(
                         params["vfid"],
                         params["relpath"],
+                        after=params["cursor"],
+                        # fetch one more entry to check if there is the next page
+                        limit=None if limit is None else limit + 1,
                     )
                 ]
+        next_cursor = None
+        if limit is not None and len(items) > limit:
+            del items[limit:]
+            next_cursor = items[-1]["name"]
         return web.json_response(
             {
                 "items": items,
+                "next_cursor": next_cursor,
             },
         )
 
 
+async def _stream_dir_entries(
+    request: web.Request,
+    volume: AbstractVolume,
+    vfid: UUID,
+    entries: AsyncIterator[DirEntry],
+) -> web.StreamResponse:
+    async with aclosing(entries):
+        # Get the first entry before sending the headers so that
+        # errors such as a missing directory are reported as usual.
+        with handle_fs_errors(volume, vfid):
+            try:
+                first_entry: Optional[DirEntry] = await entries.__anext__()
+            except StopAsyncIteration:
+                first_entry = None
+        response = web.StreamResponse(status=200)
+        response.content_type = "application/x-ndjson"
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        if first_entry is None:
+            await response.write_eof()
+            return response
+        line = json.dumps(_dir_entry_to_dict(first_entry)).encode() + b"\n"
+        await response.write(line)
+        buf: List[bytes] = []
+        buf_size = 0
+        async for item in entries:
+            line = json.dumps(_dir_entry_to_dict(item)).encode() + b"\n"
+            buf.append(line)
+            buf_size += len(line)
+            if buf_size >= LIST_FILES_STREAM_CHUNK_SIZE:
+                await response.write(b"".join(buf))
+                buf.clear()
+                buf_size = 0
+        if buf:
+            await response.write(b"".join(buf))
+        await response.write_eof()
+        return response
+
+
 async def rename_file(request: web.Request) -> web.Response:
     async with check_params(
         request,
@@ -575,7 +816,10 @@ async def create_upload_session(request: web.Request) -> web.Response:
         await log_manager_api_entry(log, "create_upload_session", params)
         ctx: Context = request.app["ctx"]
         async with ctx.get_volume(params["volume"]) as volume:
-            session_id = await volume.prepare_upload(params["vfid"])
+            session_id = await volume.prepare_upload(
+                params["vfid"],
+                size=params["size"],
+            )
         token_data = {
             "op": "upload",
             "volume": params["volume"],
@@ -626,19 +870,40 @@ async def delete_files(request: web.Request) -> web.Response:
         )
 
 
+async def get_metrics(request: web.Request) -> web.Response:
+    """
+    Export the runtime metrics of all worker processes in the Prometheus
+    text format.  The scrapers should send the storage auth token header
+    like the other manager API clients.
+    """
+    ctx: Context = request.app["ctx"]
+    return web.Response(
+        text=render_metrics(await ctx.metrics.collect()),
+        content_type="text/plain",
+        charset="utf-8",
+        headers={"X-Content-Type-Options": "nosniff"},
+    )
+
+
 async def init_manager_app(ctx: Context) -> web.Application:
     app = web.Application(
         middlewares=[
+            build_metrics_middleware(
+                "manager",
+                streamed_routes={"/folder/file/fetch": "fetch_file"},
+            ),
             token_auth_middleware,
         ],
     )
     app["ctx"] = ctx
+    app.on_response_prepare.append(count_prepared_response)
     app.router.add_route("GET", "/", get_status)
     app.router.add_route("GET", "/volumes", get_volumes)
     app.router.add_route("GET", "/volume/hwinfo", get_hwinfo)
     app.router.add_route("POST", "/folder/create", create_vfolder)
     app.router.add_route("POST", "/folder/delete", delete_vfolder)
     app.router.add_route("POST", "/folder/clone", clone_vfolder)
+    app.router.add_route("GET", "/folder/clone/progress", get_clone_progress)
     app.router.add_route("GET", "/folder/mount", get_vfolder_mount)
     app.router.add_route("GET", "/volume/performance-metric", get_performance_metric)
     app.router.add_route("GET", "/folder/metadata", get_metadata)
@@ -646,6 +911,7 @@ async def init_manager_app(ctx: Context) -> web.Application:
     app.router.add_route("GET", "/volume/quota", get_quota)
     app.router.add_route("PATCH", "/volume/quota", set_quota)
     app.router.add_route("GET", "/folder/usage", get_vfolder_usage)
+    app.router.add_route("POST", "/folder/usage/batch", get_vfolder_usage_batch)
     app.router.add_route("GET", "/folder/fs-usage", get_vfolder_fs_usage)
     app.router.add_route("POST", "/folder/file/mkdir", mkdir)
     app.router.add_route("POST", "/folder/file/list", list_files)
@@ -655,4 +921,5 @@ async def init_manager_app(ctx: Context) -> web.Application:
     app.router.add_route("POST", "/folder/file/download", create_download_session)
     app.router.add_route("POST", "/folder/file/upload", create_upload_session)
     app.router.add_route("POST", "/folder/file/delete", delete_files)
+    app.router.add_route("GET", "/metrics", get_metrics)
     return app
@@ -0,0 +1,25 @@
+from .base import (
+    DEFAULT_ARCHIVE_THREADS,
+    ArchiveError,
+    ArchiveMember,
+    CompressionMethod,
+    choose_compression_method,
+    inspect_archive_members,
+    list_archive_members,
+)
+from .tar import TarStreamWriter, TarZstdStreamWriter
+from .zip import ZipStreamWriter, crc32_combine
+
+__all__ = (
+    "DEFAULT_ARCHIVE_THREADS",
+    "ArchiveError",
+    "ArchiveMember",
+    "CompressionMethod",
+    "TarStreamWriter",
+    "TarZstdStreamWriter",
+    "ZipStreamWriter",
+    "choose_compression_method",
+    "crc32_combine",
+    "inspect_archive_members",
+    "list_archive_members",
+)
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import itertools
+import os
+import stat
+import zlib
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Final, FrozenSet, Iterator, List, Sequence
+
+import attr
+
+from ..exception import StorageProxyError
+from ..walker import DEFAULT_WALK_CONCURRENCY, TreeWalker
+
+DEFAULT_ARCHIVE_THREADS: Final = 4
+INSPECT_BATCH_SIZE: Final = 256
+ENTROPY_SAMPLE_SIZE: Final = 64 * 1024
+# Store a file as-is if a sample of it does not shrink below this ratio.
+STORE_RATIO_THRESHOLD: Final = 0.9
+
+# The file extensions of the formats which are compressed already.
+COMPRESSED_EXTENSIONS: Final[FrozenSet[str]] = frozenset(
+    {
+        # archives and compressed streams
+        ".7z",
+        ".bz2",
+        ".gz",
+        ".lz4",
+        ".lzma",
+        ".rar",
+        ".tbz2",
+        ".tgz",
+        ".txz",
+        ".xz",
+        ".zip",
+        ".zst",
+        # packages and zip-based containers
+        ".apk",
+        ".docx",
+        ".egg",
+        ".jar",
+        ".npz",
+        ".pptx",
+        ".whl",
+        ".xlsx",
+        # images
+        ".avif",
+        ".gif",
+        ".heic",
+        ".jpeg",
+        ".jpg",
+        ".png",
+        ".webp",
+        # audio and video
+        ".aac",
+        ".avi",
+        ".flac",
+        ".m4a",
+        ".m4v",
+        ".mkv",
+        ".mov",
+        ".mp3",
+        ".mp4",
+        ".ogg",
+        ".opus",
+        ".webm",
+    },
+)
+
+
+class ArchiveError(StorageProxyError):
+    pass
+
+
+class CompressionMethod(enum.IntEnum):
+    # The values are the compression method IDs of the zip format.
+    STORE = 0
+    DEFLATE = 8
+
+
+@attr.s(auto_attribs=True, slots=True)
+class ArchiveMember:
+    path: Path
+    relpath: PurePosixPath
+    is_dir: bool
+    size: int
+    mtime: float
+    mode: int
+    method: CompressionMethod = CompressionMethod.STORE
+
+
+async def list_archive_members(
+    root: Path,
+    *,
+    scan_concurrency: int = DEFAULT_WALK_CONCURRENCY,
+    walk_executor: ThreadPoolExecutor = None,
+) -> List[PurePosixPath]:
+    """
+    Return the sorted relative paths of the files and the empty directories
+    under the given directory.
+    """
+    walker = TreeWalker(
+        root,
+        concurrency=scan_concurrency,
+        executor=walk_executor,
+    )
+    # the relative paths found by each worker
+    relpaths: List[List[PurePosixPath]] = [[] for _ in range(walker.concurrency)]
+
+    def _collect(
+        worker_idx: int,
+        relpath: PurePosixPath,
+        entries: Iterator[os.DirEntry],
+    ) -> None:
+        num_entries = 0
+        for entry in entries:
+            num_entries += 1
+            if not entry.is_dir():
+                relpaths[worker_idx].append(relpath / entry.name)
+        if num_entries == 0 and relpath != PurePosixPath("."):
+            # Include an empty directory in the archive as well.
+            relpaths[worker_idx].append(relpath)
+
+    await walker.arun(_collect)
+    return sorted(itertools.chain.from_iterable(relpaths))
+
+
+def choose_compression_method(path: Path, size: int) -> CompressionMethod:
+    """
+    Decide whether to compress the given file or not, based on its extension
+    and how well a sample of its content is compressed.
+    """
+    if size == 0 or path.suffix.lower() in COMPRESSED_EXTENSIONS:
+        return CompressionMethod.STORE
+    with open(path, "rb") as f:
+        sample = f.read(ENTROPY_SAMPLE_SIZE)
+    if len(zlib.compress(sample, 1)) > len(sample) * STORE_RATIO_THRESHOLD:
+        return CompressionMethod.STORE
+    return CompressionMethod.DEFLATE
+
+
+def _inspect_members(
+    root: Path,
+    relpaths: Sequence[PurePosixPath],
+    compress: bool,
+) -> List[ArchiveMember]:
+    members = []
+    for relpath in relpaths:
+        path = root / relpath
+        st = path.stat()
+        is_dir = stat.S_ISDIR(st.st_mode)
+        size = 0 if is_dir else st.st_size
+        method = CompressionMethod.STORE
+        if compress and not is_dir:
+            method = choose_compression_method(path, size)
+        members.append(
+            ArchiveMember(
+                path=path,
+                relpath=relpath,
+                is_dir=is_dir,
+                size=size,
+                mtime=st.st_mtime,
+                mode=st.st_mode,
+                method=method,
+            ),
+        )
+    return members
+
+
+async def inspect_archive_members(
+    root: Path,
+    relpaths: Sequence[PurePosixPath],
+    executor: Executor,
+    *,
+    compress: bool = True,
+) -> List[ArchiveMember]:
+    """
+    Stat the given files and choose their compression methods in parallel
+    using the executor, preserving the order.
+    """
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                executor,
+                _inspect_members,
+                root,
+                relpaths[idx : idx + INSPECT_BATCH_SIZE],
+                compress,
+            )
+            for idx in range(0, len(relpaths), INSPECT_BATCH_SIZE)
+        ],
+    )
+    return [*itertools.chain.from_iterable(results)]
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import stat
+import tarfile
+from typing import (
+    AsyncIterator,
+    Callable,
+    Final,
+    Iterator,
+    List,
+    Sequence,
+    Union,
+)
+
+import zstandard
+from aiotools import aclosing
+
+from ..utils import aiter_batches_from_thread
+from .base import ArchiveError, ArchiveMember
+
+DEFAULT_ZSTD_LEVEL: Final = 3
+READ_CHUNK_SIZE: Final = 1024 * 1024
+OUTPUT_CHUNK_SIZE: Final = 256 * 1024
+
+BLOCK_SIZE: Final = tarfile.BLOCKSIZE
+END_OF_ARCHIVE: Final = tarfile.NUL * (BLOCK_SIZE * 2)
+
+
+def _tar_header(member: ArchiveMember) -> bytes:
+    info = tarfile.TarInfo(member.relpath.as_posix())
+    info.type = tarfile.DIRTYPE if member.is_dir else tarfile.REGTYPE
+    info.mode = stat.S_IMODE(member.mode)
+    info.size = member.size
+    info.mtime = int(member.mtime)
+    # The pax format handles long and non-ASCII names and large files.
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="strict")
+
+
+def _padding(size: int) -> bytes:
+    remainder = size % BLOCK_SIZE
+    if remainder == 0:
+        return b""
+    return tarfile.NUL * (BLOCK_SIZE - remainder)
+
+
+class TarStreamWriter:
+    """
+    Generates an uncompressed POSIX (pax) tar archive of the given members.
+
+    As the layout of a tar archive depends only on the file metadata, its
+    size is known in advance and the file contents can be sent as-is
+    (e.g., using ``sendfile()``) between the headers and paddings.
+    """
+
+    def __init__(self, members: Sequence[ArchiveMember]) -> None:
+        self.members = members
+
+    @property
+    def content_length(self) -> int:
+        total = len(END_OF_ARCHIVE)
+        for member in self.members:
+            total += len(_tar_header(member)) + member.size + len(_padding(member.size))
+        return total
+
+    def iter_parts(self) -> Iterator[Union[bytes, ArchiveMember]]:
+        """
+        Iterate over the archive as the chunks of bytes to send and the
+        members whose contents should be sent at the position.
+        """
+        for member in self.members:
+            yield _tar_header(member)
+            if member.size > 0:
+                yield member
+                yield _padding(member.size)
+        yield END_OF_ARCHIVE
+
+
+class TarZstdStreamWriter:
+    """
+    Generates a zstd-compressed POSIX (pax) tar archive of the given members.
+    The archive is built and compressed in a separate thread while zstd
+    itself uses ``threads`` worker threads to compress in parallel.
+    """
+
+    def __init__(
+        self,
+        members: Sequence[ArchiveMember],
+        *,
+        threads: int,
+        level: int = DEFAULT_ZSTD_LEVEL,
+    ) -> None:
+        self.members = members
+        self.threads = threads
+        self.level = level
+
+    def _produce(self, emit: Callable[[List[bytes]], None]) -> None:
+        compressor = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+        cobj = compressor.compressobj()
+        output: List[bytes] = []
+        output_size = 0
+
+        def _write(data: bytes) -> None:
+            nonlocal output_size
+            compressed = cobj.compress(data)
+            if compressed:
+                output.append(compressed)
+                output_size += len(compressed)
+            if output_size >= OUTPUT_CHUNK_SIZE:
+                emit(output[:])
+                output.clear()
+                output_size = 0
+
+        for part in TarStreamWriter(self.members).iter_parts():
+            if isinstance(part, bytes):
+                _write(part)
+                continue
+            member = part
+            remaining = member.size
+            # Read exactly the size written in the header.
+            with open(member.path, "rb") as f:
+                while remaining > 0:
+                    data = f.read(min(READ_CHUNK_SIZE, remaining))
+                    if not data:
+                        raise ArchiveError(
+                            f"The file has been truncated while archiving: {member.relpath}",
+                        )
+                    remaining -= len(data)
+                    _write(data)
+        output.append(cobj.flush())
+        emit(output)
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        async with aclosing(aiter_batches_from_thread(self._produce)) as batches:
+            async for batch in batches:
+                yield b"".join(batch)
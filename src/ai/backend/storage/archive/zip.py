@@ -0,0 +1,470 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import functools
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import Executor
+from typing import AsyncIterator, Deque, Final, List, Optional, Sequence, Tuple
+
+import attr
+
+from .base import ArchiveError, ArchiveMember, CompressionMethod
+
+DEFAULT_BLOCK_SIZE: Final = 1024 * 1024
+DEFAULT_COMPRESS_LEVEL: Final = 6
+DEFLATE_WINDOW_SIZE: Final = 32 * 1024
+OUTPUT_CHUNK_SIZE: Final = 256 * 1024
+
+ZIP64_LIMIT: Final = (1 << 32) - 1
+ZIP_FILECOUNT_LIMIT: Final = (1 << 16) - 1
+
+FLAG_DATA_DESCRIPTOR: Final = 0x08
+FLAG_UTF8: Final = 0x800
+SYSTEM_UNIX: Final = 3
+VERSION_DEFAULT: Final = 20
+VERSION_ZIP64: Final = 45
+
+_local_header_struct: Final = struct.Struct("<4sHHHHHIIIHH")
+_central_dir_struct: Final = struct.Struct("<4sBBBBHHHHIIIHHHHHII")
+_data_descriptor_struct: Final = struct.Struct("<4sIII")
+_data_descriptor64_struct: Final = struct.Struct("<4sIQQ")
+_end_of_central_dir_struct: Final = struct.Struct("<4sHHHHIIH")
+_end_of_central_dir64_struct: Final = struct.Struct("<4sQHHIIQQQQ")
+_end_of_central_dir64_locator_struct: Final = struct.Struct("<4sIQI")
+
+
+# ------ CRC-32 combination (a port of crc32_combine() in zlib) -------
+
+
+def _gf2_matrix_times(mat: Sequence[int], vec: int) -> int:
+    total = 0
+    idx = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[idx]
+        vec >>= 1
+        idx += 1
+    return total
+
+
+def _gf2_matrix_mult(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    # the operator applying b and then a
+    return [_gf2_matrix_times(a, col) for col in b]
+
+
+@functools.lru_cache(maxsize=64)
+def _crc32_shift_operator(length: int) -> Tuple[int, ...]:
+    # the operator for a single zero bit
+    op = [0xEDB88320] + [1 << idx for idx in range(31)]
+    # the operator for a single zero byte
+    for _ in range(3):
+        op = _gf2_matrix_mult(op, op)
+    result = [1 << idx for idx in range(32)]
+    while length:
+        if length & 1:
+            result = _gf2_matrix_mult(op, result)
+        length >>= 1
+        if length:
+            op = _gf2_matrix_mult(op, op)
+    return tuple(result)
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    Return the CRC-32 of the concatenation of two byte sequences,
+    given their CRC-32 values and the length of the second one.
+    """
+    if length2 == 0:
+        return crc1
+    return _gf2_matrix_times(_crc32_shift_operator(length2), crc1) ^ crc2
+
+
+# ------ zip format structures -------
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_date, dos_time
+
+
+def _arcname(member: ArchiveMember) -> bytes:
+    name = member.relpath.as_posix()
+    if member.is_dir:
+        name += "/"
+    return name.encode("utf-8")
+
+
+def _is_zip64(member: ArchiveMember) -> bool:
+    if member.method == CompressionMethod.STORE:
+        return member.size >= ZIP64_LIMIT
+    # DEFLATE may enlarge the data a little if not compressible.
+    return member.size * 1.05 >= ZIP64_LIMIT
+
+
+def _local_header(member: ArchiveMember) -> bytes:
+    name = _arcname(member)
+    dos_date, dos_time = _dos_datetime(member.mtime)
+    flags = FLAG_UTF8
+    extra = b""
+    version = VERSION_DEFAULT
+    size_field = 0
+    if not member.is_dir:
+        # The CRC and the sizes are written in the data descriptor.
+        flags |= FLAG_DATA_DESCRIPTOR
+        if _is_zip64(member):
+            version = VERSION_ZIP64
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            size_field = ZIP64_LIMIT
+    return (
+        _local_header_struct.pack(
+            b"PK\x03\x04",
+            version,
+            flags,
+            member.method,
+            dos_time,
+            dos_date,
+            0,
+            size_field,
+            size_field,
+            len(name),
+            len(extra),
+        )
+        + name
+        + extra
+    )
+
+
+def _data_descriptor(member: ArchiveMember, crc: int, compressed_size: int) -> bytes:
+    if _is_zip64(member):
+        return _data_descriptor64_struct.pack(
+            b"PK\x07\x08",
+            crc,
+            compressed_size,
+            member.size,
+        )
+    return _data_descriptor_struct.pack(
+        b"PK\x07\x08",
+        crc,
+        compressed_size,
+        member.size,
+    )
+
+
+def _central_dir_header(
+    member: ArchiveMember,
+    offset: int,
+    crc: int,
+    compressed_size: int,
+) -> bytes:
+    name = _arcname(member)
+    dos_date, dos_time = _dos_datetime(member.mtime)
+    flags = FLAG_UTF8
+    if not member.is_dir:
+        flags |= FLAG_DATA_DESCRIPTOR
+    zip64_fields = []
+    size_field = member.size
+    compressed_size_field = compressed_size
+    offset_field = offset
+    if member.size >= ZIP64_LIMIT:
+        zip64_fields.append(member.size)
+        size_field = ZIP64_LIMIT
+    if compressed_size >= ZIP64_LIMIT:
+        zip64_fields.append(compressed_size)
+        compressed_size_field = ZIP64_LIMIT
+    if offset >= ZIP64_LIMIT:
+        zip64_fields.append(offset)
+        offset_field = ZIP64_LIMIT
+    extra = b""
+    if zip64_fields:
+        extra = struct.pack(
+            f"<HH{len(zip64_fields)}Q",
+            0x0001,
+            8 * len(zip64_fields),
+            *zip64_fields,
+        )
+    version = VERSION_ZIP64 if zip64_fields or _is_zip64(member) else VERSION_DEFAULT
+    external_attr = (member.mode & 0xFFFF) << 16
+    if member.is_dir:
+        external_attr |= 0x10  # the MS-DOS directory flag
+    return (
+        _central_dir_struct.pack(
+            b"PK\x01\x02",
+            version,
+            SYSTEM_UNIX,
+            version,
+            0,
+            flags,
+            member.method,
+            dos_time,
+            dos_date,
+            crc,
+            compressed_size_field,
+            size_field,
+            len(name),
+            len(extra),
+            0,
+            0,
+            0,
+            external_attr,
+            offset_field,
+        )
+        + name
+        + extra
+    )
+
+
+def _end_of_central_dir(count: int, cd_offset: int, cd_size: int) -> bytes:
+    buf = []
+    if (
+        count >= ZIP_FILECOUNT_LIMIT
+        or cd_offset >= ZIP64_LIMIT
+        or cd_size >= ZIP64_LIMIT
+    ):
+        buf.append(
+            _end_of_central_dir64_struct.pack(
+                b"PK\x06\x06",
+                _end_of_central_dir64_struct.size - 12,
+                VERSION_ZIP64,
+                VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                cd_size,
+                cd_offset,
+            ),
+        )
+        buf.append(
+            _end_of_central_dir64_locator_struct.pack(
+                b"PK\x06\x07",
+                0,
+                cd_offset + cd_size,
+                1,
+            ),
+        )
+    buf.append(
+        _end_of_central_dir_struct.pack(
+            b"PK\x05\x06",
+            0,
+            0,
+            min(count, ZIP_FILECOUNT_LIMIT),
+            min(count, ZIP_FILECOUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT),
+            min(cd_offset, ZIP64_LIMIT),
+            0,
+        ),
+    )
+    return b"".join(buf)
+
+
+# ------ the block processing in worker threads -------
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class _Block:
+    member: ArchiveMember
+    offset: int
+    length: int
+    is_first: bool
+    is_last: bool
+
+
+def _pread_exact(fd: int, length: int, offset: int) -> bytes:
+    buf = []
+    while length > 0:
+        data = os.pread(fd, length, offset)
+        if not data:
+            break
+        buf.append(data)
+        length -= len(data)
+        offset += len(data)
+    return b"".join(buf)
+
+
+def _process_block(block: _Block, compress_level: int) -> Tuple[bytes, int]:
+    member = block.member
+    fd = os.open(member.path, os.O_RDONLY)
+    try:
+        data = _pread_exact(fd, block.length, block.offset)
+        if len(data) != block.length:
+            raise ArchiveError(
+                f"The file has been truncated while archiving: {member.relpath}",
+            )
+        crc = zlib.crc32(data)
+        if member.method == CompressionMethod.STORE:
+            return data, crc
+        # Compress each block as an independent raw deflate stream that starts
+        # at a byte boundary, priming it with the preceding window of the file
+        # so that back-references across the block boundary are kept.
+        if block.offset > 0:
+            window_size = min(DEFLATE_WINDOW_SIZE, block.offset)
+            compressor = zlib.compressobj(
+                compress_level,
+                zlib.DEFLATED,
+                -zlib.MAX_WBITS,
+                zdict=_pread_exact(fd, window_size, block.offset - window_size),
+            )
+        else:
+            compressor = zlib.compressobj(
+                compress_level,
+                zlib.DEFLATED,
+                -zlib.MAX_WBITS,
+            )
+        flush_mode = zlib.Z_FINISH if block.is_last else zlib.Z_SYNC_FLUSH
+        return compressor.compress(data) + compressor.flush(flush_mode), crc
+    finally:
+        os.close(fd)
+
+
+class ZipStreamWriter:
+    """
+    Generates a zip archive of the given members as a stream, compressing
+    the files in parallel using the given executor.
+
+    Each file is split into fixed-size blocks which are read and compressed
+    independently in the worker threads (like pigz), so that a single large
+    file also benefits from multiple cores.  The results are emitted in the
+    order of members and blocks, with up to ``max_inflight_blocks`` blocks
+    being processed ahead.
+
+    The sizes and the CRC of each file are written in the data descriptor
+    following its data, as they are not known before compression.
+    """
+
+    def __init__(
+        self,
+        members: Sequence[ArchiveMember],
+        executor: Executor,
+        *,
+        max_inflight_blocks: int,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        compress_level: int = DEFAULT_COMPRESS_LEVEL,
+    ) -> None:
+        self.members = members
+        self.executor = executor
+        self.max_inflight_blocks = max_inflight_blocks
+        self.block_size = block_size
+        self.compress_level = compress_level
+
+    @property
+    def content_length(self) -> Optional[int]:
+        """
+        The exact size of the archive if all members are stored as-is,
+        or None if it is not known before compression.
+        """
+        offset = 0
+        cd_size = 0
+        for member in self.members:
+            if member.method != CompressionMethod.STORE:
+                return None
+            member_size = len(_local_header(member)) + member.size
+            if not member.is_dir:
+                member_size += len(_data_descriptor(member, 0, member.size))
+            cd_size += len(_central_dir_header(member, offset, 0, member.size))
+            offset += member_size
+        return (
+            offset
+            + cd_size
+            + len(_end_of_central_dir(len(self.members), offset, cd_size))
+        )
+
+    def _iter_blocks(self):
+        for member in self.members:
+            if member.is_dir or member.size == 0:
+                yield _Block(member, 0, 0, True, True)
+                continue
+            for offset in range(0, member.size, self.block_size):
+                length = min(self.block_size, member.size - offset)
+                yield _Block(
+                    member,
+                    offset,
+                    length,
+                    offset == 0,
+                    offset + length == member.size,
+                )
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        pending: Deque[
+            Tuple[_Block, asyncio.Future[Tuple[bytes, int]]]
+        ] = collections.deque()
+        central_dir: List[bytes] = []
+        output: List[bytes] = []
+        offset = 0
+        member_offset = 0
+        member_crc = 0
+        member_compressed_size = 0
+
+        async def _complete_oldest() -> None:
+            nonlocal offset, member_offset, member_crc, member_compressed_size
+            block, fut = pending.popleft()
+            data, crc = await fut
+            member = block.member
+            if block.is_first:
+                header = _local_header(member)
+                output.append(header)
+                member_offset = offset
+                member_crc = 0
+                member_compressed_size = 0
+                offset += len(header)
+            output.append(data)
+            offset += len(data)
+            member_crc = crc32_combine(member_crc, crc, block.length)
+            member_compressed_size += len(data)
+            if block.is_last:
+                if not member.is_dir:
+                    descriptor = _data_descriptor(
+                        member,
+                        member_crc,
+                        member_compressed_size,
+                    )
+                    output.append(descriptor)
+                    offset += len(descriptor)
+                central_dir.append(
+                    _central_dir_header(
+                        member,
+                        member_offset,
+                        member_crc,
+                        member_compressed_size,
+                    ),
+                )
+
+        try:
+            for block in self._iter_blocks():
+                fut: asyncio.Future[Tuple[bytes, int]]
+                if block.length == 0:
+                    fut = loop.create_future()
+                    fut.set_result((b"", 0))
+                else:
+                    fut = loop.run_in_executor(
+                        self.executor,
+                        _process_block,
+                        block,
+                        self.compress_level,
+                    )
+                pending.append((block, fut))
+                while len(pending) >= self.max_inflight_blocks or (
+                    pending and pending[0][1].done()
+                ):
+                    await _complete_oldest()
+                    if sum(map(len, output)) >= OUTPUT_CHUNK_SIZE:
+                        yield b"".join(output)
+                        output.clear()
+            while pending:
+                await _complete_oldest()
+            cd_offset = offset
+            cd_size = sum(map(len, central_dir))
+            output.extend(central_dir)
+            output.append(_end_of_central_dir(len(central_dir), cd_offset, cd_size))
+            yield b"".join(output)
+        finally:
+            for _, fut in pending:
+                fut.cancel()
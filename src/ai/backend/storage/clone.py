@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path, PurePosixPath
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Final,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+from uuid import UUID
+
+import attr
+
+from ai.backend.common.logging import BraceStyleAdapter
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+# The directory at the root of the destination volume to keep the checkpoint
+# manifests until the clones complete, outside the vfolders.
+CLONE_MANIFEST_DIR: Final = ".clone-manifests"
+MANIFEST_FLUSH_SIZE: Final = 256
+MANIFEST_FLUSH_INTERVAL: Final = 1.0  # seconds
+PROGRESS_REPORT_INTERVAL: Final = 1.0  # seconds
+PROGRESS_RETENTION: Final = 86400.0  # seconds
+
+
+class CloneStatus(str, enum.Enum):
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@attr.s(auto_attribs=True, slots=True)
+class CloneProgress:
+    task_id: UUID
+    status: CloneStatus = CloneStatus.RUNNING
+    # The totals are estimated from the source vfolder usage, if available.
+    total_files: Optional[int] = None
+    total_bytes: Optional[int] = None
+    copied_files: int = 0
+    copied_bytes: int = 0
+    # the files which have been copied before resuming
+    skipped_files: int = 0
+    skipped_bytes: int = 0
+    # the number of files copied using each copy strategy (e.g., reflink)
+    copy_strategies: Dict[str, int] = attr.Factory(dict)
+    error: Optional[str] = None
+    started_at: float = attr.Factory(time.time)
+    updated_at: float = attr.Factory(time.time)
+
+    def to_json(self) -> Mapping[str, Any]:
+        return {
+            **attr.asdict(self),
+            "task_id": str(self.task_id),
+            "status": self.status.value,
+        }
+
+    @classmethod
+    def from_json(cls, data: Mapping[str, Any]) -> CloneProgress:
+        fields: Dict[str, Any] = {
+            **data,
+            "task_id": UUID(data["task_id"]),
+            "status": CloneStatus(data["status"]),
+        }
+        return cls(**fields)
+
+
+def get_clone_manifest_path(mount_path: Path, vfid: UUID) -> Path:
+    """
+    Return the path of the checkpoint manifest for cloning into the given
+    vfolder.  It is kept on the destination volume so that the clone can be
+    resumed after restarts by any storage proxy sharing the volume.
+    """
+    return mount_path / CLONE_MANIFEST_DIR / f"{vfid.hex}.jsonl"
+
+
+class CloneCheckpoint:
+    """
+    Tracks the progress of copying a directory tree and records the files
+    that have been completely copied in a manifest file, so that a failed or
+    interrupted copy can be resumed without copying them again.
+
+    The methods are called from multiple copying threads.
+    """
+
+    def __init__(self, manifest_path: Path, progress: CloneProgress) -> None:
+        self.manifest_path = manifest_path
+        self.progress = progress
+        self._lock = threading.Lock()
+        # relpath -> (size, mtime_ns) of the source files copied before
+        self._copied: Dict[str, Tuple[int, int]] = {}
+        self._pending: List[str] = []
+        self._last_flush = time.monotonic()
+
+    def load(self) -> None:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # may be a partially written line upon a crash
+                        continue
+                    self._copied[record["path"]] = (record["size"], record["mtime_ns"])
+        except FileNotFoundError:
+            pass
+        if self._copied:
+            log.info(
+                "resuming the copy recorded in {} with {} files copied before",
+                self.manifest_path,
+                len(self._copied),
+            )
+
+    def is_copied(
+        self,
+        relpath: PurePosixPath,
+        src_stat: os.stat_result,
+        dst_path: Path,
+    ) -> bool:
+        """
+        Check if the file has been copied before and it is identical to
+        the source by comparing the size and the modification time.
+        """
+        record = self._copied.get(str(relpath))
+        if record is None:
+            return False
+        if record != (src_stat.st_size, src_stat.st_mtime_ns):
+            return False
+        try:
+            dst_stat = dst_path.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            return False
+        return (dst_stat.st_size, dst_stat.st_mtime_ns) == record
+
+    def mark_copied(
+        self,
+        relpath: PurePosixPath,
+        src_stat: os.stat_result,
+        *,
+        skipped: bool = False,
+        strategy: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            if skipped:
+                self.progress.skipped_files += 1
+                self.progress.skipped_bytes += src_stat.st_size
+                return
+            self.progress.copied_files += 1
+            self.progress.copied_bytes += src_stat.st_size
+            if strategy is not None:
+                strategies = self.progress.copy_strategies
+                strategies[strategy] = strategies.get(strategy, 0) + 1
+            self._pending.append(
+                json.dumps(
+                    {
+                        "path": str(relpath),
+                        "size": src_stat.st_size,
+                        "mtime_ns": src_stat.st_mtime_ns,
+                    },
+                ),
+            )
+            if (
+                len(self._pending) >= MANIFEST_FLUSH_SIZE
+                or time.monotonic() - self._last_flush >= MANIFEST_FLUSH_INTERVAL
+            ):
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(self._pending) + "\n")
+            self._pending.clear()
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def remove(self) -> None:
+        with self._lock:
+            self._pending.clear()
+            self.manifest_path.unlink(missing_ok=True)
+
+
+class CloneTaskManager:
+    """
+    Runs vfolder clones as background tasks and reports their progress.
+
+    As any worker process of the storage proxy may receive the progress
+    queries, the progress is periodically written to a state directory
+    shared by the worker processes.
+    """
+
+    def __init__(self, state_dir: Path) -> None:
+        self.state_dir = state_dir
+        self._tasks: Dict[UUID, asyncio.Task] = {}
+
+    def _state_path(self, task_id: UUID) -> Path:
+        return self.state_dir / f"clone-{task_id}.json"
+
+    def _write_progress(self, progress: CloneProgress) -> None:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self._state_path(progress.task_id)
+        temp_path = path.with_name(f".{path.name}.tmp")
+        temp_path.write_text(json.dumps(progress.to_json()))
+        temp_path.rename(path)
+
+    def _read_progress(self, task_id: UUID) -> Optional[CloneProgress]:
+        try:
+            data = json.loads(self._state_path(task_id).read_text())
+        except FileNotFoundError:
+            return None
+        return CloneProgress.from_json(data)
+
+    def _prune_states(self) -> None:
+        now = time.time()
+        for path in self.state_dir.glob("clone-*.json"):
+            try:
+                if now - path.stat().st_mtime > PROGRESS_RETENTION:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def get_progress(self, task_id: UUID) -> Optional[CloneProgress]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._read_progress, task_id)
+
+    def start(
+        self,
+        clone_func: Callable[[CloneProgress], Awaitable[None]],
+    ) -> CloneProgress:
+        """
+        Start a background task running the given function, which should
+        update the given progress object while copying.
+        """
+        progress = CloneProgress(task_id=uuid.uuid4())
+        task = asyncio.create_task(self._run(clone_func, progress))
+        self._tasks[progress.task_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(progress.task_id, None))
+        return progress
+
+    async def _run(
+        self,
+        clone_func: Callable[[CloneProgress], Awaitable[None]],
+        progress: CloneProgress,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+
+        async def _report_periodically() -> None:
+            while True:
+                progress.updated_at = time.time()
+                await loop.run_in_executor(None, self._write_progress, progress)
+                await asyncio.sleep(PROGRESS_REPORT_INTERVAL)
+
+        report_task = asyncio.create_task(_report_periodically())
+        try:
+            await clone_func(progress)
+            progress.status = CloneStatus.DONE
+        except asyncio.CancelledError:
+            progress.status = CloneStatus.CANCELLED
+            raise
+        except Exception as e:
+            log.exception("clone task {} has failed", progress.task_id)
+            progress.status = CloneStatus.FAILED
+            progress.error = repr(e)
+        finally:
+            report_task.cancel()
+            await asyncio.gather(report_task, return_exceptions=True)
+            progress.updated_at = time.time()
+            await asyncio.shield(
+                loop.run_in_executor(None, self._write_progress, progress),
+            )
+            await asyncio.shield(loop.run_in_executor(None, self._prune_states))
+
+    async def aclose(self) -> None:
+        # The unfinished clones can be resumed later by cloning again.
+        tasks = [*self._tasks.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
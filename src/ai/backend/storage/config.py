@@ -28,8 +28,13 @@ local_config_iv = (
                     t.Key("event-loop", default="asyncio"): t.Enum("asyncio", "uvloop"),
                     t.Key("scandir-limit", default=1000): t.Int[0:],
                     t.Key("max-upload-size", default="100g"): tx.BinarySize,
+                    t.Key("upload-buffer-size", default="4m"): tx.BinarySize,
+                    t.Key("upload-inflight-buffers", default=4): t.Int[1:],
+                    t.Key("upload-direct-io", default=False): t.ToBool,
+                    t.Key("archive-threads", default=4): t.Int[1:],
                     t.Key("secret"): t.String,  # used to generate JWT tokens
                     t.Key("session-expire"): tx.TimeDuration,
+                    t.Key("upload-reaper-interval", default="1h"): tx.TimeDuration,
                     t.Key("user", default=None): tx.UserID(
                         default_uid=_file_perm.st_uid,
                     ),
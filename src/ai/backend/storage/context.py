@@ -1,19 +1,28 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import os
 from contextlib import asynccontextmanager as actxmgr
 from pathlib import Path, PurePosixPath
-from typing import Any, AsyncIterator, Mapping, Type
+from typing import Any, AsyncIterator, Dict, Mapping, Type
 
 from ai.backend.common.etcd import AsyncEtcd
+from ai.backend.common.logging import BraceStyleAdapter
 
 from .abc import AbstractVolume
+from .clone import CloneTaskManager
 from .exception import InvalidVolumeError
+from .metrics import MetricsExporter, set_request_backend
 from .netapp import NetAppVolume
 from .purestorage import FlashBladeVolume
 from .types import VolumeInfo
+from .upload import UploadSessionStore
 from .vfs import BaseVolume
 from .xfs import XfsVolume
 
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
 BACKENDS: Mapping[str, Type[AbstractVolume]] = {
     "purestorage": FlashBladeVolume,
     "vfs": BaseVolume,
@@ -24,11 +33,26 @@ BACKENDS: Mapping[str, Type[AbstractVolume]] = {
 
 class Context:
 
-    __slots__ = ("pid", "etcd", "local_config")
+    __slots__ = (
+        "pid",
+        "etcd",
+        "local_config",
+        "clone_tasks",
+        "upload_sessions",
+        "metrics",
+        "_volumes",
+        "_volume_lock",
+    )
 
     pid: int
     etcd: AsyncEtcd
     local_config: Mapping[str, Any]
+    clone_tasks: CloneTaskManager
+    upload_sessions: UploadSessionStore
+    metrics: MetricsExporter
+
+    _volumes: Dict[str, AbstractVolume]
+    _volume_lock: asyncio.Lock
 
     def __init__(
         self,
@@ -39,6 +63,18 @@ class Context:
         self.pid = pid
         self.etcd = etcd
         self.local_config = local_config
+        # shared by the worker processes forked from the same main process
+        self.clone_tasks = CloneTaskManager(
+            Path(f"/tmp/backend.ai/ipc/storage-proxy-tasks-{os.getppid()}"),
+        )
+        self.upload_sessions = UploadSessionStore(
+            Path(f"/tmp/backend.ai/ipc/storage-proxy-uploads-{os.getppid()}"),
+        )
+        self.metrics = MetricsExporter(
+            Path(f"/tmp/backend.ai/ipc/storage-proxy-metrics-{os.getppid()}"),
+        )
+        self._volumes = {}
+        self._volume_lock = asyncio.Lock()
 
     def list_volumes(self) -> Mapping[str, VolumeInfo]:
         return {
@@ -46,21 +82,57 @@ class Context:
             for name, info in self.local_config["volume"].items()
         }
 
-    @actxmgr
-    async def get_volume(self, name: str) -> AsyncIterator[AbstractVolume]:
-        try:
-            volume_config = self.local_config["volume"][name]
-        except KeyError:
-            raise InvalidVolumeError(name)
+    async def init_volumes(self) -> None:
+        """
+        Instantiate and initialize all configured volumes so that they are
+        reused by the API handlers throughout the lifetime of the worker.
+        A volume which fails to initialize is retried upon its first use.
+        """
+        for name in self.local_config["volume"].keys():
+            try:
+                await self._get_or_open_volume(name)
+            except Exception:
+                log.exception("failed to initialize the volume {!r}", name)
+
+    async def shutdown_volumes(self) -> None:
+        async with self._volume_lock:
+            volumes = [*self._volumes.items()]
+            self._volumes.clear()
+        for name, volume in volumes:
+            try:
+                await volume.shutdown()
+            except Exception:
+                log.exception("failed to shutdown the volume {!r}", name)
+
+    def _create_volume(self, volume_config: Mapping[str, Any]) -> AbstractVolume:
         volume_cls: Type[AbstractVolume] = BACKENDS[volume_config["backend"]]
-        volume_obj = volume_cls(
+        return volume_cls(
             local_config=self.local_config,
             mount_path=Path(volume_config["path"]),
             fsprefix=PurePosixPath(volume_config["fsprefix"]),
             options=volume_config["options"] or {},
         )
-        await volume_obj.init()
+
+    async def _get_or_open_volume(self, name: str) -> AbstractVolume:
         try:
-            yield volume_obj
-        finally:
-            await volume_obj.shutdown()
+            volume_config = self.local_config["volume"][name]
+        except KeyError:
+            raise InvalidVolumeError(name)
+        volume_obj = self._volumes.get(name)
+        if volume_obj is not None:
+            return volume_obj
+        async with self._volume_lock:
+            # Re-check as another coroutine may have opened it meanwhile.
+            volume_obj = self._volumes.get(name)
+            if volume_obj is not None:
+                return volume_obj
+            volume_obj = self._create_volume(volume_config)
+            await volume_obj.init()
+            self._volumes[name] = volume_obj
+        return volume_obj
+
+    @actxmgr
+    async def get_volume(self, name: str) -> AsyncIterator[AbstractVolume]:
+        volume_obj = await self._get_or_open_volume(name)
+        set_request_backend(self.local_config["volume"][name]["backend"])
+        yield volume_obj
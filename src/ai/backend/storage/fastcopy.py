@@ -0,0 +1,352 @@
+"""
+A file copy engine which avoids copying the data through the userspace.
+
+It tries the following strategies in order and falls back to the next one
+when the current one is not supported by the filesystems:
+
+* ``ioctl(FICLONE)``: shares the data blocks (reflink) on copy-on-write
+  filesystems such as XFS with ``reflink=1`` and btrfs, making the copy
+  near-instant without consuming extra space.
+* ``copy_file_range()``: copies the data inside the kernel, which may be
+  offloaded to the storage (e.g., NFS 4.2 server-side copies).
+* ``sendfile()``: copies the data inside the kernel.
+* buffered read/write
+
+:func:`concat_files()` assembles a file from multiple files in the same way,
+cloning the data blocks with ``ioctl(FICLONERANGE)`` where the offsets are
+aligned to the filesystem blocks.
+"""
+
+from __future__ import annotations
+
+import enum
+import errno
+import os
+import shutil
+import struct
+import sys
+from collections import Counter
+from typing import Final, Sequence, Set, Tuple, Union
+
+if sys.platform == "linux":
+    import fcntl
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE: Final = 0x40049409
+# _IOW(0x94, 13, struct file_clone_range) from linux/fs.h
+FICLONERANGE: Final = 0x4020940D
+COPY_CHUNK_SIZE: Final = 64 * 1024 * 1024
+BUFFERED_CHUNK_SIZE: Final = 1024 * 1024
+
+# The errors which mean that the strategy is not available for the given
+# pair of files, rather than an I/O failure.
+_UNSUPPORTED_ERRNOS: Final = frozenset(
+    {
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTSUP,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        errno.EPERM,
+        errno.EXDEV,
+    },
+)
+
+
+class CopyStrategy(str, enum.Enum):
+    REFLINK = "reflink"
+    COPY_FILE_RANGE = "copy_file_range"
+    SENDFILE = "sendfile"
+    BUFFERED = "buffered"
+
+
+ALL_STRATEGIES: Final[Sequence[CopyStrategy]] = tuple(CopyStrategy)
+
+# (strategy, src device, dst device) known to be unsupported, to avoid
+# repeating the failing system calls for every file in a tree.
+_unsupported: Set[Tuple[CopyStrategy, int, int]] = set()
+
+
+class _NotSupported(Exception):
+    pass
+
+
+def _check_unsupported(e: OSError, copied: int) -> None:
+    # Fall back to the next strategy only if nothing has been written yet.
+    if copied == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+        raise _NotSupported from e
+
+
+def _reflink(src_fd: int, dst_fd: int, size: int) -> bool:
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as e:
+        _check_unsupported(e, 0)
+        raise
+    return True
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    copied = 0
+    while True:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+        except OSError as e:
+            _check_unsupported(e, copied)
+            raise
+        if n == 0:
+            # Some pseudo filesystems report zero-length files.
+            return copied > 0 or size == 0
+        copied += n
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> bool:
+    copied = 0
+    while True:
+        try:
+            n = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
+        except OSError as e:
+            _check_unsupported(e, copied)
+            raise
+        if n == 0:
+            return copied > 0 or size == 0
+        copied += n
+
+
+def _buffered(src_fd: int, dst_fd: int, size: int) -> bool:
+    buf = bytearray(BUFFERED_CHUNK_SIZE)
+    with memoryview(buf) as view:
+        while True:
+            n = os.readv(src_fd, [buf])
+            if n == 0:
+                return True
+            written = 0
+            while written < n:
+                written += os.write(dst_fd, view[written:n])
+
+
+_COPY_FUNCS: Final = {
+    CopyStrategy.REFLINK: _reflink,
+    CopyStrategy.COPY_FILE_RANGE: _copy_file_range,
+    CopyStrategy.SENDFILE: _sendfile,
+    CopyStrategy.BUFFERED: _buffered,
+}
+
+
+def copy_file_data(
+    src_fd: int,
+    dst_fd: int,
+    *,
+    strategies: Sequence[CopyStrategy] = ALL_STRATEGIES,
+) -> CopyStrategy:
+    """
+    Copy the whole content of the source file to the destination file,
+    which should be empty, and return the strategy that has been used.
+    Both file offsets should be at the beginning.
+    """
+    src_stat = os.fstat(src_fd)
+    dst_stat = os.fstat(dst_fd)
+    for strategy in strategies:
+        if strategy != CopyStrategy.BUFFERED:
+            if sys.platform != "linux":
+                continue
+            key = (strategy, src_stat.st_dev, dst_stat.st_dev)
+            if key in _unsupported:
+                continue
+            try:
+                if _COPY_FUNCS[strategy](src_fd, dst_fd, src_stat.st_size):
+                    return strategy
+            except _NotSupported:
+                _unsupported.add(key)
+            continue
+        _COPY_FUNCS[strategy](src_fd, dst_fd, src_stat.st_size)
+        return strategy
+    raise ValueError("No applicable copy strategy is given")
+
+
+def copy_file(
+    src: Union[str, os.PathLike],
+    dst: Union[str, os.PathLike],
+    *,
+    strategies: Sequence[CopyStrategy] = ALL_STRATEGIES,
+) -> CopyStrategy:
+    """
+    Copy the file content like :func:`shutil.copyfile()` using the fastest
+    available strategy and return it.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        return copy_file_data(fsrc.fileno(), fdst.fileno(), strategies=strategies)
+
+
+def copy2(
+    src: Union[str, os.PathLike],
+    dst: Union[str, os.PathLike],
+    *,
+    strategies: Sequence[CopyStrategy] = ALL_STRATEGIES,
+) -> CopyStrategy:
+    """
+    Copy the file content and metadata like :func:`shutil.copy2()` using
+    the fastest available strategy and return it.
+    """
+    strategy = copy_file(src, dst, strategies=strategies)
+    shutil.copystat(src, dst)
+    return strategy
+
+
+def _reflink_range(src_fd: int, dst_fd: int, dst_offset: int, size: int) -> bool:
+    if size == 0 or dst_offset % os.fstat(dst_fd).st_blksize != 0:
+        # The cloned range should start at a block boundary.
+        return False
+    try:
+        fcntl.ioctl(
+            dst_fd,
+            FICLONERANGE,
+            struct.pack("qQQQ", src_fd, 0, size, dst_offset),
+        )
+    except OSError as e:
+        if e.errno == errno.EINVAL:
+            # unaligned offsets of this file, which do not imply
+            # that the filesystem does not support reflinks
+            return False
+        _check_unsupported(e, 0)
+        raise
+    return True
+
+
+def _copy_file_range_at(
+    src_fd: int,
+    dst_fd: int,
+    dst_offset: int,
+    size: int,
+) -> bool:
+    copied = 0
+    while copied < size:
+        try:
+            n = os.copy_file_range(
+                src_fd,
+                dst_fd,
+                min(size - copied, COPY_CHUNK_SIZE),
+                copied,
+                dst_offset + copied,
+            )
+        except OSError as e:
+            _check_unsupported(e, copied)
+            raise
+        if n == 0:
+            return copied > 0
+        copied += n
+    return True
+
+
+def _sendfile_at(src_fd: int, dst_fd: int, dst_offset: int, size: int) -> bool:
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    copied = 0
+    while copied < size:
+        try:
+            n = os.sendfile(dst_fd, src_fd, copied, min(size - copied, COPY_CHUNK_SIZE))
+        except OSError as e:
+            _check_unsupported(e, copied)
+            raise
+        if n == 0:
+            return copied > 0
+        copied += n
+    return True
+
+
+def _buffered_at(src_fd: int, dst_fd: int, dst_offset: int, size: int) -> bool:
+    copied = 0
+    while copied < size:
+        data = os.pread(src_fd, min(size - copied, BUFFERED_CHUNK_SIZE), copied)
+        if not data:
+            break
+        with memoryview(data) as view:
+            written = 0
+            while written < len(data):
+                written += os.pwrite(
+                    dst_fd,
+                    view[written:],
+                    dst_offset + copied + written,
+                )
+        copied += len(data)
+    return True
+
+
+_COPY_AT_FUNCS: Final = {
+    CopyStrategy.REFLINK: _reflink_range,
+    CopyStrategy.COPY_FILE_RANGE: _copy_file_range_at,
+    CopyStrategy.SENDFILE: _sendfile_at,
+    CopyStrategy.BUFFERED: _buffered_at,
+}
+
+
+def copy_file_data_at(
+    src_fd: int,
+    dst_fd: int,
+    dst_offset: int,
+    *,
+    strategies: Sequence[CopyStrategy] = ALL_STRATEGIES,
+) -> CopyStrategy:
+    """
+    Copy the whole content of the source file into the destination file at
+    the given offset and return the strategy that has been used.
+    The file offsets are not used except by ``sendfile()``.
+    """
+    src_stat = os.fstat(src_fd)
+    dst_stat = os.fstat(dst_fd)
+    for strategy in strategies:
+        if strategy != CopyStrategy.BUFFERED:
+            if sys.platform != "linux":
+                continue
+            key = (strategy, src_stat.st_dev, dst_stat.st_dev)
+            if key in _unsupported:
+                continue
+            try:
+                if _COPY_AT_FUNCS[strategy](
+                    src_fd,
+                    dst_fd,
+                    dst_offset,
+                    src_stat.st_size,
+                ):
+                    return strategy
+            except _NotSupported:
+                _unsupported.add(key)
+            continue
+        _COPY_AT_FUNCS[strategy](src_fd, dst_fd, dst_offset, src_stat.st_size)
+        return strategy
+    raise ValueError("No applicable copy strategy is given")
+
+
+def concat_files(
+    srcs: Sequence[Union[str, os.PathLike]],
+    dst: Union[str, os.PathLike],
+    *,
+    strategies: Sequence[CopyStrategy] = ALL_STRATEGIES,
+) -> Counter[CopyStrategy]:
+    """
+    Write the contents of the source files one after another to the
+    destination file using the fastest available strategies, and return
+    the number of source files copied by each strategy.
+
+    The destination file is not truncated before writing, keeping the blocks
+    preallocated for it, but only after all sources are copied.
+    """
+    used: Counter[CopyStrategy] = Counter()
+    dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        dst_offset = 0
+        for src in srcs:
+            with open(src, "rb") as fsrc:
+                used[
+                    copy_file_data_at(
+                        fsrc.fileno(),
+                        dst_fd,
+                        dst_offset,
+                        strategies=strategies,
+                    )
+                ] += 1
+                dst_offset += os.fstat(fsrc.fileno()).st_size
+        os.ftruncate(dst_fd, dst_offset)
+    finally:
+        os.close(dst_fd)
+    return used
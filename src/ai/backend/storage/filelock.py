@@ -1,50 +1,270 @@
+from __future__ import annotations
+
 import asyncio
 import fcntl
 import logging
+import threading
 import time
+import weakref
 from pathlib import Path
+from typing import IO, Any, Callable, Dict, Mapping, MutableMapping, Optional
+
+import attr
 
 from ai.backend.common.logging import BraceStyleAdapter
 
+from . import metrics
+
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
 
+@attr.s(auto_attribs=True, slots=True)
+class FileLockStats:
+    acquired: int = 0
+    timeouts: int = 0
+    # the total and max seconds spent waiting for and holding the lock
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    hold_seconds: float = 0.0
+    max_hold_seconds: float = 0.0
+
+
+# The per-path locks to serialize the waiters in the same process in the FIFO
+# order, so that only one of them waits for the file lock at a time.
+_local_locks: MutableMapping[str, asyncio.Lock] = weakref.WeakValueDictionary()
+_lock_stats: Dict[str, FileLockStats] = {}
+# The waiters abandoned upon timeouts, which are still blocked in flock().
+_abandoned_waiters: Dict[str, _FlockWaiter] = {}
+
+
+def get_lock_stats() -> Mapping[str, FileLockStats]:
+    """
+    Return the statistics of the file locks acquired in this process by path.
+    """
+    return _lock_stats
+
+
+class _FlockWaiter:
+    """
+    Waits for an exclusive ``flock()`` in a dedicated thread without polling.
+
+    As a blocking ``flock()`` call cannot be interrupted, a waiter abandoned
+    upon timeout or cancellation keeps waiting so that the next acquirer in
+    the same process resumes it instead of starting another thread.  This
+    keeps at most one blocked thread per lock file.  If nobody resumes it,
+    it releases the lock by itself as soon as it gets the lock.
+    """
+
+    def __init__(self, path: Path, mode: str) -> None:
+        self.path = path
+        self.mode = mode
+        self.fp: Optional[IO[Any]] = None
+        self._state_lock = threading.Lock()
+        self._started = False
+        self._finished = False
+        self._acquired = False
+        self._abandoned = False
+        self._notify: Optional[Callable[[Optional[BaseException]], None]] = None
+
+    def wait(self, loop: asyncio.AbstractEventLoop) -> Optional[asyncio.Future]:
+        """
+        Start or resume waiting for the lock.  Returns None if the waiter has
+        already finished after being abandoned.
+        """
+        fut = loop.create_future()
+
+        def _set_result(error: Optional[BaseException]) -> None:
+            if fut.done():
+                return
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(None)
+
+        def _notify(error: Optional[BaseException]) -> None:
+            try:
+                loop.call_soon_threadsafe(_set_result, error)
+            except RuntimeError:
+                # The event loop has been closed.
+                pass
+
+        with self._state_lock:
+            if self._finished:
+                return None
+            self._abandoned = False
+            self._notify = _notify
+            if self._started:
+                return fut
+            self._started = True
+        threading.Thread(
+            target=self._wait,
+            name=f"FileLock({self.path})",
+            daemon=True,
+        ).start()
+        return fut
+
+    def _wait(self) -> None:
+        fp: Optional[IO[Any]] = None
+        error: Optional[BaseException] = None
+        try:
+            fp = open(self.path, self.mode)
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        except BaseException as e:
+            if fp is not None:
+                fp.close()
+            error = e
+        with self._state_lock:
+            notify = self._notify
+            if error is not None or self._abandoned:
+                self._finished = True
+                if error is None:
+                    assert fp is not None
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+                    fp.close()
+                    return
+            else:
+                self.fp = fp
+                self._acquired = True
+        if notify is not None:
+            notify(error)
+
+    def abandon(self) -> bool:
+        """
+        Give up waiting for the lock.  Returns True if the lock has been
+        acquired already, which then should be released by the caller.
+        """
+        with self._state_lock:
+            if self._acquired:
+                return True
+            self._abandoned = True
+            self._notify = None
+            return False
+
+
+async def _wait_for_task(task: asyncio.Task, timeout: Optional[float]) -> bool:
+    """
+    Wait for the task until the timeout, cancelling it on timeout.
+    Returns False if the task has not completed.
+    """
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if task in done:
+        task.result()
+        return True
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        return False
+    # completed just before the cancellation
+    return True
+
+
 class FileLock:
-    default_timeout: int = 3  # not allow infinite timeout for safety
+    """
+    An exclusive lock on a file, shared among the processes on the same host.
+
+    The waiters in the same process acquire the lock in the FIFO order
+    without polling; only the first of them waits for ``flock()`` in a
+    dedicated thread so that the executor threads are not tied up.
+    """
+
+    default_timeout: float = 3  # not allow infinite timeout for safety
     locked: bool = False
 
-    def __init__(self, path: Path, *, mode: str = "rb", timeout: int = None):
+    def __init__(
+        self,
+        path: Path,
+        *,
+        mode: str = "rb",
+        timeout: Optional[float] = None,
+    ) -> None:
         self._path = path
         self._mode = mode
         self._timeout = timeout if timeout is not None else self.default_timeout
+        self._fp: Optional[IO[Any]] = None
+        key = str(path)
+        local_lock = _local_locks.get(key)
+        if local_lock is None:
+            local_lock = asyncio.Lock()
+            _local_locks[key] = local_lock
+        self._local_lock = local_lock
+        self._stats = _lock_stats.setdefault(key, FileLockStats())
+        self._acquired_at = 0.0
 
-    async def __aenter__(self):
-        def _lock():
-            start_time = time.perf_counter()
-            self._fp = open(self._path, self._mode)
-            while True:
-                try:
-                    fcntl.flock(self._fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    self.locked = True
-                    log.debug("file lock acquired: {}", self._path)
-                    return self._fp
-                except BlockingIOError:
-                    # Failed to get file lock. Waiting until timeout ...
-                    if time.perf_counter() - start_time > self._timeout:
-                        raise TimeoutError(f"failed to lock file: {self._path}")
-                time.sleep(0.1)
+    def _raise_timeout(self) -> None:
+        self._stats.timeouts += 1
+        metrics.file_lock_timeouts.inc(path=str(self._path))
+        raise TimeoutError(f"failed to lock file: {self._path}")
 
+    async def __aenter__(self) -> FileLock:
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _lock)
+        start_time = time.perf_counter()
+        deadline = start_time + self._timeout
+        acquire_task = asyncio.create_task(self._local_lock.acquire())
+        try:
+            if not await _wait_for_task(acquire_task, self._timeout):
+                self._raise_timeout()
+        except asyncio.CancelledError:
+            if not acquire_task.done():
+                acquire_task.cancel()
+            elif not acquire_task.cancelled() and acquire_task.exception() is None:
+                self._local_lock.release()
+            raise
+        try:
+            key = str(self._path)
+            flock_fut: Optional[asyncio.Future] = None
+            waiter = _abandoned_waiters.pop(key, None)
+            if waiter is not None and waiter.mode == self._mode:
+                flock_fut = waiter.wait(loop)
+            if waiter is None or flock_fut is None:
+                waiter = _FlockWaiter(self._path, self._mode)
+                flock_fut = waiter.wait(loop)
+                assert flock_fut is not None
+            try:
+                remaining = max(0.0, deadline - time.perf_counter())
+                done, _ = await asyncio.wait({flock_fut}, timeout=remaining)
+            except asyncio.CancelledError:
+                if waiter.abandon():
+                    self._close(waiter.fp)
+                else:
+                    _abandoned_waiters[key] = waiter
+                raise
+            if not done and not waiter.abandon():
+                _abandoned_waiters[key] = waiter
+                self._raise_timeout()
+            # Raises the error of open() and flock() if any.
+            if flock_fut.done():
+                flock_fut.result()
+            self._fp = waiter.fp
+        except BaseException:
+            self._local_lock.release()
+            raise
+        self.locked = True
+        self._acquired_at = time.perf_counter()
+        wait_time = self._acquired_at - start_time
+        self._stats.acquired += 1
+        self._stats.wait_seconds += wait_time
+        self._stats.max_wait_seconds = max(self._stats.max_wait_seconds, wait_time)
+        metrics.file_lock_wait_duration.observe(wait_time, path=str(self._path))
+        log.debug("file lock acquired: {} (waited {:.3f}s)", self._path, wait_time)
+        return self
 
-    async def __aexit__(self, *args):
-        def _unlock():
-            if self.locked:
-                fcntl.flock(self._fp, fcntl.LOCK_UN)
-                self.locked = False
-                log.debug("file lock released: {}", self._path)
-            self._fp.close()
-            self.f_fp = None
+    @staticmethod
+    def _close(fp: Optional[IO[Any]]) -> None:
+        if fp is not None:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+            fp.close()
 
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _unlock)
+    async def __aexit__(self, *args) -> None:
+        if not self.locked:
+            return
+        # Unlocking never blocks.
+        self._close(self._fp)
+        self._fp = None
+        self.locked = False
+        self._local_lock.release()
+        hold_time = time.perf_counter() - self._acquired_at
+        self._stats.hold_seconds += hold_time
+        self._stats.max_hold_seconds = max(self._stats.max_hold_seconds, hold_time)
+        metrics.file_lock_hold_duration.observe(hold_time, path=str(self._path))
+        log.debug("file lock released: {} (held {:.3f}s)", self._path, hold_time)
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import string
+import time
+from pathlib import Path
+from typing import Dict, Final, Iterator, List, Optional, Tuple
+
+import attr
+
+from ai.backend.common.logging import BraceStyleAdapter
+
+from . import metrics
+from .context import Context
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+UPLOAD_REAPER_BATCH_SIZE: Final = 64  # vfolders
+UPLOAD_REAPER_BATCH_INTERVAL: Final = 1.0  # seconds
+
+_HEX_DIGITS: Final = frozenset(string.hexdigits.lower())
+
+
+@attr.s(auto_attribs=True, slots=True)
+class UploadReaperStats:
+    reclaimed_sessions: int = 0
+    reclaimed_bytes: int = 0
+    scanned_vfolders: int = 0
+    completed_scans: int = 0
+    last_scan_duration: float = 0.0  # seconds
+
+
+def _is_hex(name: str, length: int) -> bool:
+    return len(name) == length and _HEX_DIGITS.issuperset(name)
+
+
+def iter_vfolder_paths(mount_path: Path) -> Iterator[Path]:
+    """
+    Iterate over the vfolder directories of a volume lazily, following the
+    layout of :meth:`AbstractVolume.mangle_vfpath()`.
+    """
+    # the lengths of the hex-encoded names at each level
+    name_lengths = [2, 2, 28]
+
+    def _walk(path: Path, depth: int) -> Iterator[Path]:
+        if depth == len(name_lengths):
+            yield path
+            return
+        try:
+            with os.scandir(path) as scanner:
+                names = sorted(
+                    entry.name
+                    for entry in scanner
+                    if _is_hex(entry.name, name_lengths[depth])
+                    and entry.is_dir(follow_symlinks=False)
+                )
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return
+        for name in names:
+            yield from _walk(path / name, depth + 1)
+
+    return _walk(mount_path, 0)
+
+
+def _get_disk_usage(path: Path) -> int:
+    # Count the allocated blocks, including the preallocated ones.
+    try:
+        if path.is_dir() and not path.is_symlink():
+            with os.scandir(path) as scanner:
+                return sum(_get_disk_usage(Path(entry.path)) for entry in scanner)
+        return path.lstat().st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+def _get_last_modified(path: Path) -> float:
+    try:
+        mtime = path.lstat().st_mtime
+        if path.is_dir() and not path.is_symlink():
+            with os.scandir(path) as scanner:
+                for entry in scanner:
+                    mtime = max(mtime, _get_last_modified(Path(entry.path)))
+        return mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def reap_upload_sessions(vfpath: Path, expire_before: float) -> Tuple[int, int]:
+    """
+    Delete the upload sessions in the given vfolder which have not been
+    written since ``expire_before``.  The session file and its partial
+    uploads are grouped by the session ID.
+
+    Returns the number of deleted sessions and the reclaimed bytes.
+    """
+    upload_base_path = vfpath / ".upload"
+    sessions: Dict[str, List[Path]] = {}
+    try:
+        with os.scandir(upload_base_path) as scanner:
+            for entry in scanner:
+                # "<session>" and "<session>.parts"
+                session_id = entry.name.split(".", 1)[0]
+                sessions.setdefault(session_id, []).append(Path(entry.path))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0, 0
+    reclaimed_sessions = 0
+    reclaimed_bytes = 0
+    for session_id, paths in sessions.items():
+        if max(_get_last_modified(path) for path in paths) >= expire_before:
+            continue
+        for path in paths:
+            reclaimed_bytes += _get_disk_usage(path)
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        reclaimed_sessions += 1
+        log.debug("reclaimed an abandoned upload session: {}", session_id)
+    if reclaimed_sessions == len(sessions):
+        try:
+            upload_base_path.rmdir()
+        except OSError:
+            pass
+    return reclaimed_sessions, reclaimed_bytes
+
+
+class UploadReaper:
+    """
+    Periodically deletes the abandoned upload sessions of all volumes,
+    whose tokens have expired without completing the uploads.
+
+    The vfolders are scanned in small batches with pauses in between to
+    limit the metadata load on the volumes.
+    """
+
+    def __init__(
+        self,
+        ctx: Context,
+        *,
+        batch_size: int = UPLOAD_REAPER_BATCH_SIZE,
+        batch_interval: float = UPLOAD_REAPER_BATCH_INTERVAL,
+    ) -> None:
+        self.ctx = ctx
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        storage_config = ctx.local_config["storage-proxy"]
+        self.session_expire = storage_config["session-expire"].total_seconds()
+        self.scan_interval = storage_config["upload-reaper-interval"].total_seconds()
+        self.stats: Dict[str, UploadReaperStats] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def collect_metrics(self) -> None:
+        for volume_name, stats in self.stats.items():
+            metrics.reclaimed_upload_sessions.set(
+                stats.reclaimed_sessions,
+                volume=volume_name,
+            )
+            metrics.reclaimed_upload_bytes.set(
+                stats.reclaimed_bytes,
+                volume=volume_name,
+            )
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            for volume_name in self.ctx.local_config["volume"].keys():
+                try:
+                    await self.reap_volume(volume_name)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception(
+                        "failed to reclaim the upload sessions of the volume {!r}",
+                        volume_name,
+                    )
+            # the offset states of the abandoned sessions kept on local disk
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None,
+                self.ctx.upload_sessions.reap_states,
+                time.time() - self.session_expire,
+            )
+            await asyncio.sleep(self.scan_interval)
+
+    async def reap_volume(self, volume_name: str) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self.stats.setdefault(volume_name, UploadReaperStats())
+        started_at = time.monotonic()
+        async with self.ctx.get_volume(volume_name) as volume:
+            vfolder_paths = iter_vfolder_paths(volume.mount_path)
+        while True:
+            batch = await loop.run_in_executor(
+                None,
+                lambda: [*itertools.islice(vfolder_paths, self.batch_size)],
+            )
+            if not batch:
+                break
+            # The tokens issued before this are all expired.
+            expire_before = time.time() - self.session_expire
+            for vfpath in batch:
+                num_sessions, num_bytes = await loop.run_in_executor(
+                    None,
+                    reap_upload_sessions,
+                    vfpath,
+                    expire_before,
+                )
+                stats.reclaimed_sessions += num_sessions
+                stats.reclaimed_bytes += num_bytes
+            stats.scanned_vfolders += len(batch)
+            await asyncio.sleep(self.batch_interval)
+        stats.completed_scans += 1
+        stats.last_scan_duration = time.monotonic() - started_at
+        log.debug(
+            "scanned the upload sessions of the volume {!r} "
+            "(reclaimed sessions: {}, reclaimed bytes: {})",
+            volume_name,
+            stats.reclaimed_sessions,
+            stats.reclaimed_bytes,
+        )
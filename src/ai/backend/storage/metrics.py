@@ -0,0 +1,510 @@
+"""
+Runtime metrics of the storage proxy in the Prometheus text format.
+
+Each worker process keeps its own metrics and periodically dumps them into
+a state directory shared by the workers, so that the ``/metrics`` endpoint
+served by any worker reports the sum over all workers.  The counters and
+histograms of the terminated workers are kept in the sum so that they do not
+go backwards when the workers are restarted.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager as ctxmgr
+from pathlib import Path
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Final,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from aiohttp import web
+
+from ai.backend.common.logging import BraceStyleAdapter
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+METRICS_FLUSH_INTERVAL: Final = 5.0  # seconds
+DEFAULT_LATENCY_BUCKETS: Final = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Metric:
+    type: str = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # the values, or the lists of the bucket counts of histograms, by labels
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Mapping[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> Mapping[str, Any]:
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labelnames": self.labelnames,
+            "samples": [[[*key], value] for key, value in self._values.items()],
+        }
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Set the total counted elsewhere, e.g., by a collector.
+        """
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        # the non-cumulative bucket counts including +Inf, the sum and the count
+        values = self._values.get(key)
+        if values is None:
+            values = [0.0] * (len(self.buckets) + 3)
+            self._values[key] = values
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def snapshot(self) -> Mapping[str, Any]:
+        return {**super().snapshot(), "buckets": self.buckets}
+
+
+api_requests = Counter(
+    "backendai_storage_api_requests_total",
+    "The number of the handled API requests.",
+    ("app", "method", "route", "status"),
+)
+api_request_duration = Histogram(
+    "backendai_storage_api_request_duration_seconds",
+    "The time taken to handle the API requests.",
+    ("app", "route", "backend"),
+)
+streamed_bytes = Counter(
+    "backendai_storage_streamed_bytes_total",
+    "The number of bytes sent by the downloads and received by the uploads.",
+    ("op",),
+)
+subprocesses = Counter(
+    "backendai_storage_subprocesses_total",
+    "The number of the executed subprocesses.",
+    ("command",),
+)
+running_subprocesses = Gauge(
+    "backendai_storage_subprocesses_running",
+    "The number of the running subprocesses.",
+    ("command",),
+)
+default_executor_queue_depth = Gauge(
+    "backendai_storage_default_executor_queue_depth",
+    "The number of the jobs waiting for the default executor threads.",
+)
+reclaimed_upload_sessions = Counter(
+    "backendai_storage_reclaimed_upload_sessions_total",
+    "The number of the deleted abandoned upload sessions.",
+    ("volume",),
+)
+reclaimed_upload_bytes = Counter(
+    "backendai_storage_reclaimed_upload_bytes_total",
+    "The number of bytes reclaimed by deleting abandoned upload sessions.",
+    ("volume",),
+)
+file_lock_wait_duration = Histogram(
+    "backendai_storage_file_lock_wait_seconds",
+    "The time taken to acquire the file locks shared by the processes.",
+    ("path",),
+)
+file_lock_hold_duration = Histogram(
+    "backendai_storage_file_lock_hold_seconds",
+    "The time the file locks shared by the processes have been held.",
+    ("path",),
+)
+file_lock_timeouts = Counter(
+    "backendai_storage_file_lock_timeouts_total",
+    "The number of the file lock acquisitions which have timed out.",
+    ("path",),
+)
+
+ALL_METRICS: Final[Sequence[Metric]] = (
+    api_requests,
+    api_request_duration,
+    streamed_bytes,
+    subprocesses,
+    running_subprocesses,
+    default_executor_queue_depth,
+    reclaimed_upload_sessions,
+    reclaimed_upload_bytes,
+    file_lock_wait_duration,
+    file_lock_hold_duration,
+    file_lock_timeouts,
+)
+
+_request_labels: contextvars.ContextVar[
+    Optional[MutableMapping[str, str]]
+] = contextvars.ContextVar("_request_labels", default=None)
+
+
+def set_request_backend(backend: str) -> None:
+    """
+    Label the metrics of the current API request with the volume backend.
+    """
+    labels = _request_labels.get()
+    if labels is not None:
+        labels["backend"] = backend
+
+
+@ctxmgr
+def track_subprocess(command: str) -> Iterator[None]:
+    subprocesses.inc(command=command)
+    running_subprocesses.inc(command=command)
+    try:
+        yield
+    finally:
+        running_subprocesses.dec(command=command)
+
+
+def get_command_name(cmd: Sequence[Union[str, bytes, os.PathLike]]) -> str:
+    for arg in cmd:
+        name = os.path.basename(os.fsdecode(arg))
+        if name != "sudo":
+            return name
+    return ""
+
+
+def build_metrics_middleware(
+    app_name: str,
+    streamed_routes: Mapping[str, str] = {},
+) -> Callable[..., Awaitable[web.StreamResponse]]:
+    """
+    Create a middleware which counts the requests and measures their latency,
+    which includes streaming the response bodies written by the handlers.
+
+    ``streamed_routes`` maps the routes whose response bodies should be
+    counted by :data:`streamed_bytes` to the operation names.
+    """
+
+    @web.middleware
+    async def metrics_middleware(
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        labels = {"backend": ""}
+        token = _request_labels.set(labels)
+        started_at = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            op = streamed_routes.get(route)
+            if op is not None and request.method != "HEAD":
+                if response.prepared:
+                    # Finish the response streamed by the handler, as the
+                    # server would do right after returning, to count it.
+                    await response.write_eof()
+                if response.body_length:
+                    streamed_bytes.inc(
+                        response.content_length or response.body_length,
+                        op=op,
+                    )
+                else:
+                    # to be counted by count_prepared_response() when sent
+                    request["metrics.streamed_op"] = op
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            _request_labels.reset(token)
+            api_requests.inc(
+                app=app_name,
+                method=request.method,
+                route=route,
+                status=str(status),
+            )
+            api_request_duration.observe(
+                time.perf_counter() - started_at,
+                app=app_name,
+                route=route,
+                backend=labels["backend"],
+            )
+
+    return metrics_middleware
+
+
+async def count_prepared_response(
+    request: web.Request,
+    response: web.StreamResponse,
+) -> None:
+    """
+    Count the body of the responses sent after the handlers return, such as
+    :class:`web.FileResponse`, which knows its length when prepared.
+    """
+    op = request.get("metrics.streamed_op")
+    if op is not None and response.content_length is not None:
+        streamed_bytes.inc(response.content_length, op=op)
+
+
+def _drop_gauges(
+    snapshot: Mapping[str, Mapping[str, Any]],
+) -> Mapping[str, Mapping[str, Any]]:
+    # The gauges of the terminated workers are no longer meaningful.
+    return {
+        name: metric for name, metric in snapshot.items() if metric["type"] != "gauge"
+    }
+
+
+def merge_snapshots(
+    snapshots: Sequence[Mapping[str, Mapping[str, Any]]],
+) -> Mapping[str, Mapping[str, Any]]:
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for key, value in metric["samples"]:
+                key = tuple(key)
+                prev = target["samples"].get(key)
+                if prev is None:
+                    target["samples"][key] = value
+                elif isinstance(value, list):
+                    target["samples"][key] = [a + b for a, b in zip(prev, value)]
+                else:
+                    target["samples"][key] = prev + value
+    return merged
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def render_metrics(metrics: Mapping[str, Mapping[str, Any]]) -> str:
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["samples"].items()):
+            labels = [*zip(metric["labelnames"], key)]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0.0
+            bounds = [*map(repr, metric["buckets"]), "+Inf"]
+            for bound, count in zip(bounds, value[:-2]):
+                cumulative += count
+                bucket_labels = _format_labels([*labels, ("le", bound)])
+                lines.append(
+                    f"{name}_bucket{bucket_labels} {_format_value(cumulative)}",
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {repr(value[-2])}")
+            lines.append(
+                f"{name}_count{_format_labels(labels)} {_format_value(value[-1])}",
+            )
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Shares the metrics of this worker process with the other workers via
+    the state directory and collects the metrics of all workers.
+    """
+
+    def __init__(self, state_dir: Path) -> None:
+        self.state_dir = state_dir
+        self._collectors: List[Callable[[], None]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def state_path(self) -> Path:
+        return self.state_dir / f"metrics-{os.getpid()}.json"
+
+    def _get_retired_path(self) -> Path:
+        return self.state_dir / f"metrics-retired-{os.getpid()}-{time.time_ns()}.json"
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """
+        Register a function to update the metrics before taking snapshots.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Mapping[str, Mapping[str, Any]]:
+        loop = asyncio.get_running_loop()
+        executor = getattr(loop, "_default_executor", None)
+        work_queue = getattr(executor, "_work_queue", None)
+        default_executor_queue_depth.set(
+            work_queue.qsize() if work_queue is not None else 0,
+        )
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                log.exception("failed to collect metrics")
+        return {metric.name: metric.snapshot() for metric in ALL_METRICS}
+
+    def _write_snapshot(self, snapshot: Mapping[str, Any]) -> None:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self.state_path.with_name(f".{self.state_path.name}.tmp")
+        temp_path.write_text(json.dumps(snapshot))
+        temp_path.rename(self.state_path)
+
+    def _retire_snapshot(self, snapshot: Optional[Mapping[str, Any]] = None) -> None:
+        """
+        Keep the final counters and histograms of this worker, or of the
+        terminated worker which had the same PID, in a separate file.
+        """
+        if snapshot is None:
+            try:
+                snapshot = json.loads(self.state_path.read_text())
+            except (FileNotFoundError, ValueError):
+                return
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        retired_path = self._get_retired_path()
+        temp_path = retired_path.with_name(f".{retired_path.name}.tmp")
+        temp_path.write_text(json.dumps(_drop_gauges(snapshot)))
+        temp_path.rename(retired_path)
+        try:
+            self.state_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _read_snapshots(self) -> List[Mapping[str, Any]]:
+        snapshots = []
+        for path in self.state_dir.glob("metrics-*.json"):
+            worker_id = path.stem[len("metrics-") :]
+            is_alive = False
+            if worker_id.isdigit():
+                pid = int(worker_id)
+                if pid == os.getpid():
+                    continue
+                try:
+                    os.kill(pid, 0)
+                    is_alive = True
+                except ProcessLookupError:
+                    # a terminated worker without retiring its snapshot
+                    pass
+                except PermissionError:
+                    is_alive = True
+            try:
+                snapshot = json.loads(path.read_text())
+            except (FileNotFoundError, ValueError):
+                continue
+            snapshots.append(snapshot if is_alive else _drop_gauges(snapshot))
+        return snapshots
+
+    async def collect(self) -> Mapping[str, Mapping[str, Any]]:
+        """
+        Return the sum of the metrics of all workers.
+        """
+        loop = asyncio.get_running_loop()
+        snapshots = await loop.run_in_executor(None, self._read_snapshots)
+        return merge_snapshots([self.snapshot(), *snapshots])
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._retire_snapshot)
+        except OSError:
+            log.exception("failed to retire the metrics of the previous worker")
+        while True:
+            try:
+                await loop.run_in_executor(None, self._write_snapshot, self.snapshot())
+            except OSError:
+                log.exception("failed to write the metrics")
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+
+    def start(self) -> None:
+        self._flush_task = asyncio.create_task(self._flush())
+
+    async def aclose(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._retire_snapshot, self.snapshot())
+        except OSError:
+            log.exception("failed to write the metrics")
@@ -6,18 +6,21 @@ import json
 import os
 import time
 from pathlib import Path, PurePosixPath
-from typing import FrozenSet
+from typing import Any, FrozenSet, Iterator, Mapping, Tuple
 from uuid import UUID
 
 import aiofiles
 
 from ai.backend.common.types import BinarySize, HardwareMetadata
 
+from .. import metrics
 from ..abc import CAP_METRIC, CAP_VFHOST_QUOTA, CAP_VFOLDER, AbstractVolume
+from ..clone import CloneProgress
 from ..exception import ExecutionError, StorageProxyError, VFolderCreationError
 from ..types import FSPerfMetric, FSUsage, VFolderCreationOptions, VFolderUsage
 from ..vfs import BaseVolume
-from .netappclient import NetAppClient
+from ..walker import TreeWalker
+from .netappclient import DEFAULT_CACHE_TTL, NetAppClient
 from .quotamanager import QuotaManager
 
 
@@ -42,6 +45,7 @@ class NetAppVolume(BaseVolume):
         self.netapp_xcp_hostname = self.config["netapp_xcp_hostname"]
         self.netapp_xcp_catalog_path = self.config["netapp_xcp_catalog_path"]
         self.netapp_xcp_container_name = self.config["netapp_xcp_container_name"]
+        cache_ttl = float(self.config.get("netapp_cache_ttl", DEFAULT_CACHE_TTL))
 
         self.netapp_client = NetAppClient(
             str(self.endpoint),
@@ -49,6 +53,7 @@ class NetAppVolume(BaseVolume):
             self.netapp_password,
             str(self.netapp_svm),
             self.netapp_volume_name,
+            cache_ttl=cache_ttl,
         )
 
         self.quota_manager = QuotaManager(
@@ -57,6 +62,7 @@ class NetAppVolume(BaseVolume):
             password=self.netapp_password,
             svm=str(self.netapp_svm),
             volume_name=self.netapp_volume_name,
+            cache_ttl=cache_ttl,
         )
 
         # assign qtree info after netapp_client and quotamanager are initiated
@@ -76,20 +82,25 @@ class NetAppVolume(BaseVolume):
     async def get_capabilities(self) -> FrozenSet[str]:
         return frozenset([CAP_VFOLDER, CAP_VFHOST_QUOTA, CAP_METRIC])
 
-    async def get_hwinfo(self) -> HardwareMetadata:
-        raw_metadata = await self.netapp_client.get_metadata()
+    async def _get_default_qtree_quota(self) -> Mapping[str, Any]:
         qtree_info = await self.get_default_qtree_by_volume_id(self.netapp_volume_uuid)
         self.netapp_qtree_name = qtree_info["name"]
-        quota = await self.quota_manager.get_quota_by_qtree_name(self.netapp_qtree_name)
+        return await self.quota_manager.get_quota_by_qtree_name(self.netapp_qtree_name)
+
+    async def get_hwinfo(self) -> HardwareMetadata:
+        raw_metadata, quota = await asyncio.gather(
+            self.netapp_client.get_metadata(),
+            self._get_default_qtree_quota(),
+        )
         # add quota in hwinfo
         metadata = {"quota": json.dumps(quota), **raw_metadata}
         return {"status": "healthy", "status_info": None, "metadata": {**metadata}}
 
     async def get_fs_usage(self) -> FSUsage:
-        volume_usage = await self.netapp_client.get_usage()
-        qtree_info = await self.get_default_qtree_by_volume_id(self.netapp_volume_uuid)
-        self.netapp_qtree_name = qtree_info["name"]
-        quota = await self.quota_manager.get_quota_by_qtree_name(self.netapp_qtree_name)
+        volume_usage, quota = await asyncio.gather(
+            self.netapp_client.get_usage(),
+            self._get_default_qtree_quota(),
+        )
         space = quota.get("space")
         if space and space.get("hard_limit"):
             capacity_bytes = space["hard_limit"]
@@ -153,7 +164,9 @@ class NetAppVolume(BaseVolume):
 
             await aiofile_os.rmdir(vfpath.parent.parent)
 
-        await read_progress(nfs_path)
+        with metrics.track_subprocess("xcp"):
+            await read_progress(nfs_path)
+        await self.usage_index.discard(vfid)
 
     async def clone_vfolder(
         self,
@@ -161,6 +174,8 @@ class NetAppVolume(BaseVolume):
         dst_volume: AbstractVolume,
         dst_vfid: UUID,
         options: VFolderCreationOptions = None,
+        *,
+        progress: CloneProgress = None,
     ) -> None:
         # check if there is enough space in destination
         fs_usage = await dst_volume.get_fs_usage()
@@ -221,7 +236,8 @@ class NetAppVolume(BaseVolume):
                     # TODO: line for bgtask
                     pass
 
-            await read_progress(nfs_src_path, nfs_dst_path)
+            with metrics.track_subprocess("xcp"):
+                await read_progress(nfs_src_path, nfs_dst_path)
 
         except Exception:
             await dst_volume.delete_vfolder(dst_vfid)
@@ -230,6 +246,7 @@ class NetAppVolume(BaseVolume):
     async def shutdown(self) -> None:
         await self.netapp_client.aclose()
         await self.quota_manager.aclose()
+        await super().shutdown()
 
     # ------ volume operations ------
     async def get_list_volumes(self):
@@ -277,6 +294,38 @@ class NetAppVolume(BaseVolume):
     async def set_quota(self, vfid: UUID, size_bytes: BinarySize) -> None:
         raise NotImplementedError
 
+    async def _calc_usage(
+        self,
+        target_path: Path,
+        *,
+        deadline: float,
+    ) -> Tuple[int, int]:
+        walker = TreeWalker(
+            target_path,
+            concurrency=self.scan_concurrency,
+            executor=self.walk_executor,
+            deadline=deadline,
+            follow_symlinks=True,
+        )
+        total_sizes = [0] * walker.concurrency
+        total_counts = [0] * walker.concurrency
+
+        def _calc_dir_usage(
+            worker_idx: int,
+            relpath: PurePosixPath,
+            entries: Iterator[os.DirEntry],
+        ) -> None:
+            for entry in entries:
+                if entry.is_dir():
+                    continue
+                if entry.is_file() or entry.is_symlink():
+                    stat = entry.stat(follow_symlinks=False)
+                    total_sizes[worker_idx] += stat.st_size
+                    total_counts[worker_idx] += 1
+
+        await walker.arun(_calc_dir_usage)
+        return sum(total_sizes), sum(total_counts)
+
     async def get_usage(
         self,
         vfid: UUID,
@@ -305,13 +354,14 @@ class NetAppVolume(BaseVolume):
         if self.netapp_xcp_container_name is not None:
             scan_cmd = ["docker", "exec", self.netapp_xcp_container_name] + scan_cmd
         # Measure the exact file sizes and bytes
-        proc = await asyncio.create_subprocess_exec(
-            *scan_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
-        try:
+        with metrics.track_subprocess("xcp"):
+            proc = await asyncio.create_subprocess_exec(
+                *scan_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
             stdout, stderr = await proc.communicate()
+        try:
             if b"xcp: ERROR:" in stdout:
                 # destination directory is busy for other operations
                 if b"xcp: ERROR: mnt3 MOUNT" in stdout:
@@ -356,26 +406,10 @@ class NetAppVolume(BaseVolume):
             else:
                 # if there's no scan result file, or cannot execute xcp command,
                 # then use the same way in vfs
-                def _calc_usage(target_path: os.DirEntry | Path) -> None:
-                    nonlocal total_size, total_count
-                    _timeout = 3
-                    # FIXME: Remove "type: ignore" when python/mypy#11964 is resolved.
-                    with os.scandir(target_path) as scanner:  # type: ignore
-                        for entry in scanner:
-                            if entry.is_dir():
-                                _calc_usage(entry)
-                                continue
-                            if entry.is_file() or entry.is_symlink():
-                                stat = entry.stat(follow_symlinks=False)
-                                total_size += stat.st_size
-                                total_count += 1
-                            if total_count % 1000 == 0:
-                                # Cancel if this I/O operation takes too much time.
-                                if time.monotonic() - start_time > _timeout:
-                                    raise TimeoutError
-
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(None, _calc_usage, target_path)
+                total_size, total_count = await self._calc_usage(
+                    target_path,
+                    deadline=start_time + 3,
+                )
         except StorageProxyError:
             raise ExecutionError("Storage server is busy. Please try again")
         except FileNotFoundError:
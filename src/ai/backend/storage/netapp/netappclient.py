@@ -1,10 +1,49 @@
 from __future__ import annotations
 
+import asyncio
 import json
-from typing import Any, List, Mapping
+from typing import Any, Dict, Final, List, Mapping, Optional, Tuple
 
 import aiohttp
 
+from ..utils import AsyncTTLCache
+
+# The identifiers such as the volume UUID are cached for the client lifetime,
+# while the slowly changing data such as the qtree and QoS information are
+# cached for this duration.
+DEFAULT_CACHE_TTL: Final = 60.0  # seconds
+CONNECTION_LIMIT_PER_HOST: Final = 16
+KEEPALIVE_TIMEOUT: Final = 60.0  # seconds
+QOS_FETCH_CONCURRENCY: Final = 8
+
+# endpoint -> (connector, reference count)
+_shared_connectors: Dict[str, Tuple[aiohttp.TCPConnector, int]] = {}
+
+
+def acquire_shared_connector(endpoint: str) -> aiohttp.TCPConnector:
+    """
+    Get the keep-alive connector shared by all ONTAP REST API clients of the
+    same endpoint in this process.
+    """
+    connector, refcount = _shared_connectors.get(endpoint, (None, 0))
+    if connector is None or connector.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        refcount = 0
+    _shared_connectors[endpoint] = (connector, refcount + 1)
+    return connector
+
+
+async def release_shared_connector(endpoint: str) -> None:
+    connector, refcount = _shared_connectors[endpoint]
+    if refcount > 1:
+        _shared_connectors[endpoint] = (connector, refcount - 1)
+        return
+    del _shared_connectors[endpoint]
+    await connector.close()
+
 
 class NetAppClient:
 
@@ -22,23 +61,43 @@ class NetAppClient:
         password: str,
         svm: str,
         volume_name: str,
+        *,
+        cache_ttl: float = DEFAULT_CACHE_TTL,
     ) -> None:
         self.endpoint = endpoint
         self.user = user
         self.password = password
         self.svm = svm
         self.volume_name = volume_name
-        self._session = aiohttp.ClientSession()
+        self._session = aiohttp.ClientSession(
+            connector=acquire_shared_connector(endpoint),
+            connector_owner=False,
+        )
+        self._volume_uuid: Optional[str] = None
+        self._volume_uuid_lock = asyncio.Lock()
+        self._qtree_cache: AsyncTTLCache[Tuple[str, str], Any] = AsyncTTLCache(
+            cache_ttl,
+        )
+        self._qos_cache: AsyncTTLCache[Tuple[str, str], Any] = AsyncTTLCache(
+            cache_ttl,
+        )
 
     async def aclose(self) -> None:
         await self._session.close()
+        await release_shared_connector(self.endpoint)
+
+    def invalidate_cache(self) -> None:
+        self._qtree_cache.invalidate()
+        self._qos_cache.invalidate()
 
     async def get_metadata(self) -> Mapping[str, Any]:
         volume_uuid = await self.get_volume_uuid_by_name()
-        data = await self.get_volume_info(volume_uuid)
-        qos = await self.get_qos_by_volume_id(volume_uuid)
-        qos_policies = await self.get_qos_policies()
-        qtree_metadata = await self.get_default_qtree_by_volume_id(volume_uuid)
+        data, qos, qos_policies, qtree_metadata = await asyncio.gather(
+            self.get_volume_info(volume_uuid),
+            self.get_qos_by_volume_id(volume_uuid),
+            self.get_qos_policies(),
+            self.get_default_qtree_by_volume_id(volume_uuid),
+        )
         qtree = await self.get_qtree_info(qtree_metadata.get("id"))
 
         # mapping certain data for better explanation
@@ -98,15 +157,19 @@ class NetAppClient:
         return name
 
     async def get_volume_uuid_by_name(self) -> str:
-        async with self._session.get(
-            f"{self.endpoint}/api/storage/volumes?name={self.volume_name}",
-            auth=aiohttp.BasicAuth(self.user, self.password),
-            ssl=False,
-            raise_for_status=True,
-        ) as resp:
-            data = await resp.json()
-            uuid = data["records"][0]["uuid"]
-            return uuid
+        # The UUID of a volume never changes.
+        async with self._volume_uuid_lock:
+            if self._volume_uuid is not None:
+                return self._volume_uuid
+            async with self._session.get(
+                f"{self.endpoint}/api/storage/volumes?name={self.volume_name}",
+                auth=aiohttp.BasicAuth(self.user, self.password),
+                ssl=False,
+                raise_for_status=True,
+            ) as resp:
+                data = await resp.json()
+                self._volume_uuid = data["records"][0]["uuid"]
+            return self._volume_uuid
 
     async def get_volume_info(self, volume_uuid) -> Mapping[str, Any]:
         async with self._session.get(
@@ -119,6 +182,12 @@ class NetAppClient:
         return data
 
     async def get_default_qtree_by_volume_id(self, volume_uuid) -> Mapping[str, Any]:
+        return await self._qtree_cache.get(
+            ("default", volume_uuid),
+            lambda: self._get_default_qtree_by_volume_id(volume_uuid),
+        )
+
+    async def _get_default_qtree_by_volume_id(self, volume_uuid) -> Mapping[str, Any]:
         qtrees = await self.list_qtrees_by_volume_id(volume_uuid)
         for qtree in qtrees:
             # skip the default qtree made by NetApp ONTAP internally
@@ -163,6 +232,12 @@ class NetAppClient:
         return data["records"]
 
     async def get_qtree_info(self, qtree_id) -> Mapping[str, Any]:
+        return await self._qtree_cache.get(
+            ("info", str(qtree_id)),
+            lambda: self._get_qtree_info(qtree_id),
+        )
+
+    async def _get_qtree_info(self, qtree_id) -> Mapping[str, Any]:
         uuid = await self.get_volume_uuid_by_name()
         async with self._session.get(
             f"{self.endpoint}/api/storage/qtrees/{uuid}/{qtree_id}",
@@ -174,6 +249,12 @@ class NetAppClient:
         return data
 
     async def get_qos_policies(self) -> List[Mapping[str, Any]]:
+        """
+        Return the details of all QoS policies, cached with the TTL.
+        """
+        return await self._qos_cache.get(("policies", ""), self._get_qos_policies)
+
+    async def _get_qos_policies(self) -> List[Mapping[str, Any]]:
         async with self._session.get(
             f"{self.endpoint}/api/storage/qos/policies",
             auth=aiohttp.BasicAuth(self.user, self.password),
@@ -181,14 +262,22 @@ class NetAppClient:
             raise_for_status=True,
         ) as resp:
             data = await resp.json()
-            qos_policies_metadata = data["records"]
-            qos_policies = []
-            for qos in qos_policies_metadata:
-                policy = await self.get_qos_by_uuid(qos["uuid"])
-                qos_policies.append(policy)
-        return qos_policies
+        # Fetch the details after returning the connection to the pool.
+        sema = asyncio.Semaphore(QOS_FETCH_CONCURRENCY)
+
+        async def _fetch(qos_uuid: str) -> Mapping[str, Any]:
+            async with sema:
+                return await self.get_qos_by_uuid(qos_uuid)
+
+        return await asyncio.gather(*[_fetch(qos["uuid"]) for qos in data["records"]])
 
     async def get_qos_by_uuid(self, qos_uuid) -> Mapping[str, Any]:
+        return await self._qos_cache.get(
+            ("policy", qos_uuid),
+            lambda: self._get_qos_by_uuid(qos_uuid),
+        )
+
+    async def _get_qos_by_uuid(self, qos_uuid) -> Mapping[str, Any]:
         async with self._session.get(
             f"{self.endpoint}/api/storage/qos/policies/{qos_uuid}",
             auth=aiohttp.BasicAuth(self.user, self.password),
@@ -212,6 +301,12 @@ class NetAppClient:
             return qos_policy
 
     async def get_qos_by_volume_id(self, volume_uuid) -> Mapping[str, Any]:
+        return await self._qos_cache.get(
+            ("volume", volume_uuid),
+            lambda: self._get_qos_by_volume_id(volume_uuid),
+        )
+
+    async def _get_qos_by_volume_id(self, volume_uuid) -> Mapping[str, Any]:
         async with self._session.get(
             f"{self.endpoint}/api/storage/volumes/{volume_uuid}?fields=qos",
             auth=aiohttp.BasicAuth(self.user, self.password),
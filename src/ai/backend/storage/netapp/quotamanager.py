@@ -5,6 +5,13 @@ from typing import Any, Mapping
 import aiohttp
 from aiohttp.client_reqrep import ClientResponse
 
+from ..utils import AsyncTTLCache
+from .netappclient import (
+    DEFAULT_CACHE_TTL,
+    acquire_shared_connector,
+    release_shared_connector,
+)
+
 
 class QuotaManager:
 
@@ -22,16 +29,26 @@ class QuotaManager:
         password: str,
         svm: str,
         volume_name: str,
+        *,
+        cache_ttl: float = DEFAULT_CACHE_TTL,
     ) -> None:
         self.endpoint = endpoint
         self.user = user
         self.password = password
-        self._session = aiohttp.ClientSession()
+        self._session = aiohttp.ClientSession(
+            connector=acquire_shared_connector(endpoint),
+            connector_owner=False,
+        )
         self.svm = svm
         self.volume_name = volume_name
+        # qtree name -> quota
+        self._quota_cache: AsyncTTLCache[str, Mapping[str, Any]] = AsyncTTLCache(
+            cache_ttl,
+        )
 
     async def aclose(self) -> None:
         await self._session.close()
+        await release_shared_connector(self.endpoint)
 
     async def list_quotarules(self):
         async with self._session.get(
@@ -41,7 +58,6 @@ class QuotaManager:
             raise_for_status=False,
         ) as resp:
             data = await resp.json()
-            await self._session.close()
 
         rules = [rule for rule in data["uuid"]]
         self.rules = rules
@@ -81,6 +97,12 @@ class QuotaManager:
         return quota
 
     async def get_quota_by_qtree_name(self, qtree_name) -> Mapping[str, Any]:
+        return await self._quota_cache.get(
+            qtree_name,
+            lambda: self._get_quota_by_qtree_name(qtree_name),
+        )
+
+    async def _get_quota_by_qtree_name(self, qtree_name) -> Mapping[str, Any]:
         async with self._session.get(
             f"{self.endpoint}/api/storage/quota/rules?volume={self.volume_name}&qtree={qtree_name}",
             auth=aiohttp.BasicAuth(self.user, self.password),
@@ -123,6 +145,7 @@ class QuotaManager:
         ) as resp:
 
             msg = await resp.json()
+        self._quota_cache.invalidate()
         return msg
 
     async def update_quotarule_qtree(
@@ -148,6 +171,7 @@ class QuotaManager:
             ssl=False,
             raise_for_status=True,
         ) as resp:
+            self._quota_cache.invalidate()
             return await resp.json()
 
     # For now, Only Read / Update operation for qtree is available
@@ -162,4 +186,5 @@ class QuotaManager:
             ssl=False,
             raise_for_status=True,
         ) as resp:
+            self._quota_cache.invalidate()
             return await resp.json()
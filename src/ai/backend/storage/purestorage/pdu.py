@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from pathlib import Path
+from typing import Final, List, Sequence, Tuple
+
+from .. import metrics
+
+PDU_READ_SIZE: Final = 256 * 1024
+# Parse the output in a thread once this many bytes are buffered.
+PDU_PARSE_BATCH_SIZE: Final = 4 * 1024 * 1024
+
+# A record of "pdu -0 -b" is "<bytes><whitespace><path>\0".
+_RECORD_SIZE_RE: Final = re.compile(rb"(?:\A|(?<=\0))(\d+)[ \t]")
+
+
+class PduUsageParser:
+    """
+    Accumulates the total bytes and the number of records from the
+    NUL-terminated output of ``pdu -0 -b``.
+
+    Instead of splitting and converting each record in Python, it extracts
+    the sizes of all complete records in a buffer with a single regular
+    expression scan and sums them with :func:`map()`.
+    """
+
+    def __init__(self, root: Path, *, include_root: bool = False) -> None:
+        """
+        :param include_root: Count the record of the root directory itself,
+            e.g., to take the summary produced by ``pdu -s``.
+        """
+        self.total_size = 0
+        self.total_count = 0
+        self._include_root = include_root
+        self._root_record_re = re.compile(
+            rb"(?:\A|(?<=\0))(\d+)[ \t]+" + re.escape(bytes(root)) + rb"\0",
+        )
+        self._remainder = b""
+
+    def feed(self, data: bytes) -> None:
+        data = self._remainder + data
+        end = data.rfind(b"\0") + 1
+        self._remainder = data[end:]
+        self._parse(data[:end])
+
+    def close(self) -> None:
+        if self._remainder:
+            # the last record without the terminator
+            self._parse(self._remainder + b"\0")
+            self._remainder = b""
+
+    def _parse(self, records: bytes) -> None:
+        if not records:
+            return
+        sizes = _RECORD_SIZE_RE.findall(records)
+        self.total_size += sum(map(int, sizes))
+        self.total_count += len(sizes)
+        if not self._include_root:
+            for match in self._root_record_re.finditer(records):
+                self.total_size -= int(match.group(1))
+                self.total_count -= 1
+
+
+async def run_pdu(
+    args: Sequence[bytes],
+    target_path: Path,
+    *,
+    include_root: bool = False,
+) -> Tuple[PduUsageParser, int, bytes]:
+    """
+    Run ``pdu -0 -b`` with the given extra arguments and parse its output in
+    large batches in a thread.
+
+    Returns the parser with the totals, the exit code and the stderr output.
+    """
+    loop = asyncio.get_running_loop()
+    parser = PduUsageParser(target_path, include_root=include_root)
+    with metrics.track_subprocess("pdu"):
+        proc = await asyncio.create_subprocess_exec(
+            b"pdu",
+            b"-0",
+            b"-b",
+            *args,
+            bytes(target_path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        assert proc.stdout is not None
+        assert proc.stderr is not None
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        try:
+            buf: List[bytes] = []
+            buf_size = 0
+            while True:
+                chunk = await proc.stdout.read(PDU_READ_SIZE)
+                if chunk:
+                    buf.append(chunk)
+                    buf_size += len(chunk)
+                if buf_size >= PDU_PARSE_BATCH_SIZE or (not chunk and buf):
+                    await loop.run_in_executor(None, parser.feed, b"".join(buf))
+                    buf.clear()
+                    buf_size = 0
+                if not chunk:
+                    break
+            parser.close()
+            stderr = await stderr_task
+            returncode = await proc.wait()
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if not stderr_task.done():
+                stderr_task.cancel()
+    return parser, returncode, stderr
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import json
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Final, List, Optional
+
+from .. import metrics
+from ..exception import ExecutionError
+from ..types import DirEntry, DirEntryType, Stat
+from ..utils import fstime2datetime
+
+try:
+    import orjson
+
+    _json_loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+PLS_READ_SIZE: Final = 256 * 1024
+
+# pls reports the file types and modes as octal numbers written in decimal.
+PLS_FILETYPE_DIRECTORY: Final = 40000
+PLS_FILETYPE_SYMLINK: Final = 120000
+
+
+def _to_dir_entry(item: Any) -> DirEntry:
+    item_path = Path(item["path"])
+    entry_type = DirEntryType.FILE
+    if item["filetype"] == PLS_FILETYPE_DIRECTORY:
+        entry_type = DirEntryType.DIRECTORY
+    if item["filetype"] == PLS_FILETYPE_SYMLINK:
+        entry_type = DirEntryType.SYMLINK
+    return DirEntry(
+        name=item_path.name,
+        path=item_path,
+        type=entry_type,
+        stat=Stat(
+            size=item["size"],
+            owner=str(item["uid"]),
+            # The integer represents the octal number in decimal
+            # (e.g., 644 which actually means 0o644)
+            mode=int(str(item["mode"]), 8),
+            modified=fstime2datetime(item["mtime"]),
+            created=fstime2datetime(item["ctime"]),
+        ),
+        symlink_target="",  # TODO: should be tested on PureStorage
+    )
+
+
+class PlsListingDecoder:
+    """
+    Decodes the newline-delimited JSON output of ``pls --json`` into
+    :class:`DirEntry` objects batch by batch, skipping the entries whose
+    names do not come after ``after``.
+
+    With ``limit``, only the first ``limit`` entries in the order of their
+    names are kept and returned when closed.
+    """
+
+    def __init__(
+        self,
+        *,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> None:
+        self._after = after
+        self._limit = limit
+        self._page: List[DirEntry] = []
+        self._remainder = b""
+
+    def feed(self, data: bytes) -> List[DirEntry]:
+        data = self._remainder + data
+        end = data.rfind(b"\n") + 1
+        self._remainder = data[end:]
+        return self._collect(self._decode(data[:end]))
+
+    def close(self) -> List[DirEntry]:
+        data, self._remainder = self._remainder, b""
+        entries = self._collect(self._decode(data))
+        if self._limit is not None:
+            entries, self._page = self._page, []
+        return entries
+
+    def _decode(self, data: bytes) -> List[DirEntry]:
+        entries = [
+            _to_dir_entry(_json_loads(line)) for line in data.splitlines() if line
+        ]
+        if self._after is not None:
+            entries = [entry for entry in entries if entry.name > self._after]
+        return entries
+
+    def _collect(self, entries: List[DirEntry]) -> List[DirEntry]:
+        if self._limit is None:
+            return entries
+        self._page = heapq.nsmallest(
+            self._limit,
+            itertools.chain(self._page, entries),
+            key=lambda entry: entry.name,
+        )
+        return []
+
+
+async def scan_pls(
+    target_path: Path,
+    *,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[DirEntry]:
+    """
+    List the entries of the given directory using ``pls``.
+
+    The output is decoded in batches in a thread.  The ``pls`` process is
+    killed as soon as the consumer stops iterating.
+    """
+    loop = asyncio.get_running_loop()
+    if limit == 0:
+        return
+    decoder = PlsListingDecoder(after=after, limit=limit)
+    with metrics.track_subprocess("pls"):
+        proc = await asyncio.create_subprocess_exec(
+            b"pls",
+            b"--json",
+            bytes(target_path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=PLS_READ_SIZE,
+        )
+        assert proc.stdout is not None
+        assert proc.stderr is not None
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        try:
+            while True:
+                # Each read returns what is already buffered, up to the limit,
+                # so that the entries are decoded in batches of many lines.
+                chunk = await proc.stdout.read(PLS_READ_SIZE)
+                entries = await loop.run_in_executor(None, decoder.feed, chunk)
+                if not chunk:
+                    entries.extend(decoder.close())
+                for entry in entries:
+                    yield entry
+                if not chunk:
+                    break
+            stderr = await stderr_task
+            returncode = await proc.wait()
+            if returncode != 0:
+                raise ExecutionError(f"pls command failed: {stderr.decode()}")
+        finally:
+            if proc.returncode is None:
+                # The consumer has stopped iterating.
+                proc.kill()
+                await proc.wait()
+            if not stderr_task.done():
+                stderr_task.cancel()
@@ -1,21 +1,25 @@
 from __future__ import annotations
 
-from contextvars import ContextVar, Token
-from typing import Any, AsyncGenerator, Mapping
+import asyncio
+from typing import Any, AsyncGenerator, Mapping, Optional
 
 import aiohttp
 from yarl import URL
 
 
 class PurityClient:
+    """
+    A Purity//FB REST API client shared by concurrent API handlers.
+
+    It logs in lazily on the first request and keeps the auth token for its
+    lifetime, logging in again only when the token is rejected.
+    """
 
     endpoint: URL
     api_token: str
     api_version: str
-    auth_token: ContextVar[str]
 
     _session: aiohttp.ClientSession
-    _auth_token_cvtoken: Token
 
     def __init__(
         self,
@@ -27,52 +31,65 @@ class PurityClient:
         self.endpoint = URL(endpoint)
         self.api_token = api_token
         self.api_version = api_version
-        self.auth_token = ContextVar("auth_token")
         self._session = aiohttp.ClientSession()
+        self._auth_token: Optional[str] = None
+        self._login_lock = asyncio.Lock()
 
     async def aclose(self) -> None:
         await self._session.close()
 
-    async def __aenter__(self) -> PurityClient:
-        async with self._session.post(
-            self.endpoint / "api" / "login",
-            headers={"api-token": self.api_token},
-            ssl=False,
-            raise_for_status=True,
-        ) as resp:
-            auth_token = resp.headers["x-auth-token"]
-            self._auth_token_cvtoken = self.auth_token.set(auth_token)
-            _ = await resp.json()
-        return self
+    async def _login(self, expired_token: Optional[str] = None) -> str:
+        async with self._login_lock:
+            # Another coroutine may have logged in while waiting for the lock.
+            if self._auth_token is not None and self._auth_token != expired_token:
+                return self._auth_token
+            async with self._session.post(
+                self.endpoint / "api" / "login",
+                headers={"api-token": self.api_token},
+                ssl=False,
+                raise_for_status=True,
+            ) as resp:
+                auth_token = resp.headers["x-auth-token"]
+                _ = await resp.json()
+            self._auth_token = auth_token
+            return auth_token
 
-    async def __aexit__(self, *exc_info) -> None:
-        self.auth_token.reset(self._auth_token_cvtoken)
+    async def _get(self, url: URL, params: Mapping[str, Any]) -> Any:
+        auth_token = self._auth_token
+        if auth_token is None:
+            auth_token = await self._login()
+        for retry in (True, False):
+            async with self._session.get(
+                url,
+                headers={"x-auth-token": auth_token},
+                params=params,
+                ssl=False,
+            ) as resp:
+                if resp.status == 401 and retry:
+                    auth_token = await self._login(expired_token=auth_token)
+                    continue
+                resp.raise_for_status()
+                return await resp.json()
 
     # For the concrete API reference, check out:
     # https://purity-fb.readthedocs.io/en/latest/
 
     async def get_metadata(self) -> Mapping[str, Any]:
-        if self.auth_token is None:
-            raise RuntimeError("The auth token for Purity API is not initialized.")
         items = []
         pagination_token = ""
         while True:
-            async with self._session.get(
-                (self.endpoint / "api" / self.api_version / "arrays"),
-                headers={"x-auth-token": self.auth_token.get()},
-                params={
+            data = await self._get(
+                self.endpoint / "api" / self.api_version / "arrays",
+                {
                     "items_returned": 10,
                     "token": pagination_token,
                 },
-                ssl=False,
-                raise_for_status=True,
-            ) as resp:
-                data = await resp.json()
-                for item in data["items"]:
-                    items.append(item)
-                pagination_token = data["pagination_info"]["continuation_token"]
-                if pagination_token is None:
-                    break
+            )
+            for item in data["items"]:
+                items.append(item)
+            pagination_token = data["pagination_info"]["continuation_token"]
+            if pagination_token is None:
+                break
         if not items:
             return {}
         first = items[0]
@@ -90,58 +107,44 @@ class PurityClient:
         self,
         fs_name: str,
     ) -> AsyncGenerator[Mapping[str, Any], None]:
-        if self.auth_token is None:
-            raise RuntimeError("The auth token for Purity API is not initialized.")
         pagination_token = ""
         while True:
-            async with self._session.get(
-                (
-                    self.endpoint
-                    / "api"
-                    / self.api_version
-                    / "file-systems"
-                    / "performance"
-                ),
-                headers={"x-auth-token": self.auth_token.get()},
-                params={
+            data = await self._get(
+                self.endpoint
+                / "api"
+                / self.api_version
+                / "file-systems"
+                / "performance",
+                {
                     "names": fs_name,
                     "protocol": "NFS",
                     "items_returned": 10,
                     "token": pagination_token,
                 },
-                ssl=False,
-                raise_for_status=True,
-            ) as resp:
-                data = await resp.json()
-                for item in data["items"]:
-                    yield item
-                pagination_token = data["pagination_info"]["continuation_token"]
-                if pagination_token is None:
-                    break
+            )
+            for item in data["items"]:
+                yield item
+            pagination_token = data["pagination_info"]["continuation_token"]
+            if pagination_token is None:
+                break
 
     async def get_usage(self, fs_name: str) -> Mapping[str, Any]:
-        if self.auth_token is None:
-            raise RuntimeError("The auth token for Purity API is not initialized.")
         items = []
         pagination_token = ""
         while True:
-            async with self._session.get(
-                (self.endpoint / "api" / self.api_version / "file-systems"),
-                headers={"x-auth-token": self.auth_token.get()},
-                params={
+            data = await self._get(
+                self.endpoint / "api" / self.api_version / "file-systems",
+                {
                     "names": fs_name,
                     "items_returned": 10,
                     "token": pagination_token,
                 },
-                ssl=False,
-                raise_for_status=True,
-            ) as resp:
-                data = await resp.json()
-                for item in data["items"]:
-                    items.append(item)
-                pagination_token = data["pagination_info"]["continuation_token"]
-                if pagination_token is None:
-                    break
+            )
+            for item in data["items"]:
+                items.append(item)
+            pagination_token = data["pagination_info"]["continuation_token"]
+            if pagination_token is None:
+                break
         if not items:
             return {}
         first = items[0]
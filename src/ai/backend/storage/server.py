@@ -25,6 +25,7 @@ from .api.client import init_client_app
 from .api.manager import init_manager_app
 from .config import local_config_iv
 from .context import Context
+from .janitor import UploadReaper
 
 log = BraceStyleAdapter(logging.getLogger("ai.backend.storage.server"))
 
@@ -118,13 +119,28 @@ async def server_main(
         os.setgid(gid)
         os.setuid(uid)
         log.info("Changed process uid:gid to {}:{}", uid, gid)
+    # Initialize the volumes as the service user so that the files and
+    # sessions created by the backends are owned by it.
+    await ctx.init_volumes()
+    upload_reaper = None
+    if pidx == 0:
+        # A single worker is enough to clean up the volumes of this host.
+        upload_reaper = UploadReaper(ctx)
+        upload_reaper.start()
+        ctx.metrics.add_collector(upload_reaper.collect_metrics)
+    ctx.metrics.start()
     log.info("Started service.")
     try:
         yield
     finally:
         log.info("Shutting down...")
+        if upload_reaper is not None:
+            await upload_reaper.aclose()
+        await ctx.metrics.aclose()
         await manager_api_runner.cleanup()
         await client_api_runner.cleanup()
+        await ctx.clone_tasks.aclose()
+        await ctx.shutdown_volumes()
 
 
 @click.group(invoke_without_command=True)
@@ -4,6 +4,7 @@ import enum
 from datetime import datetime
 from pathlib import Path, PurePath
 from typing import Any, Final, Mapping, Optional
+from uuid import UUID
 
 import attr
 import trafaret as t
@@ -78,6 +79,17 @@ class VFolderCreationOptions:
 class VFolderUsage:
     file_count: int
     used_bytes: int
+    # Set when the usage is answered from a cache, indicating its staleness.
+    updated_at: Optional[datetime] = None
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class VFolderUsageResult:
+    vfid: UUID
+    usage: Optional[VFolderUsage] = None
+    # None if not requested or not supported by the backend
+    quota: Optional[BinarySize] = None
+    error: Optional[str] = None
 
 
 @attr.s(auto_attribs=True, slots=True, frozen=True)
@@ -0,0 +1,413 @@
+"""
+The write path of the upload sessions.
+
+The upload session files are preallocated to the declared upload size upon
+their first write so that large uploads are laid out in a few extents,
+and the uploaded data is
+written at the file offsets from a thread with large page-aligned buffers,
+optionally bypassing the page cache with ``O_DIRECT``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+from typing import Final, List, Optional, Tuple, Union
+
+import attr
+import janus
+
+from ai.backend.common.logging import BraceStyleAdapter
+from ai.backend.common.types import Sentinel
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+DEFAULT_UPLOAD_BUFFER_SIZE: Final = 4 * 1024 * 1024
+DEFAULT_UPLOAD_INFLIGHT_BUFFERS: Final = 4
+# The alignment of the file offsets and lengths for O_DIRECT writes,
+# which covers the logical block sizes of most devices.
+DIRECT_IO_ALIGNMENT: Final = 4096
+
+# the number of upload sessions whose states are kept in memory per worker
+MAX_CACHED_UPLOAD_SESSIONS: Final = 10000
+
+# from linux/falloc.h
+FALLOC_FL_KEEP_SIZE: Final = 0x01
+
+_libc: Optional[ctypes.CDLL] = None
+if sys.platform == "linux":
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.fallocate.argtypes = [
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int64,
+        ctypes.c_int64,
+    ]
+
+
+def preallocate(path: Path, size: int) -> bool:
+    """
+    Reserve the disk blocks of the given file up to ``size`` bytes without
+    changing the file size, which is used as the upload offset.
+    Returns False if the filesystem does not support it.
+    """
+    if _libc is None or size <= 0:
+        return False
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        ret = _libc.fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size)
+        if ret != 0:
+            err = ctypes.get_errno()
+            log.debug(
+                "failed to preallocate {} bytes for {}: {}",
+                size,
+                path,
+                os.strerror(err),
+            )
+            return False
+        return True
+    finally:
+        os.close(fd)
+
+
+def release_preallocation(path: Path) -> None:
+    """
+    Release the disk blocks reserved beyond the end of the given file by
+    :func:`preallocate()`, e.g., when the data is uploaded into other files.
+    """
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        stat = os.fstat(fd)
+        if stat.st_blocks * 512 > stat.st_size:
+            # Truncating to the current size frees the blocks after the end.
+            os.ftruncate(fd, stat.st_size)
+    finally:
+        os.close(fd)
+
+
+_Item = Union[Tuple[mmap.mmap, int], Sentinel]
+
+
+class UploadFileWriter:
+    """
+    Appends the uploaded data to the given file.
+
+    The data is gathered into page-aligned buffers of ``buffer_size`` bytes,
+    which are written at the file offsets by a thread, keeping at most
+    ``max_inflight`` buffers in flight.  With ``direct_io``, the aligned
+    portions are written with ``O_DIRECT`` if the filesystem supports it.
+
+    It does not call ``fsync()``; the caller should do it once when the
+    whole upload is completed.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        buffer_size: int = DEFAULT_UPLOAD_BUFFER_SIZE,
+        max_inflight: int = DEFAULT_UPLOAD_INFLIGHT_BUFFERS,
+        direct_io: bool = False,
+    ) -> None:
+        self.path = path
+        # Keep the buffers aligned for O_DIRECT.
+        self.buffer_size = max(
+            DIRECT_IO_ALIGNMENT,
+            buffer_size - buffer_size % DIRECT_IO_ALIGNMENT,
+        )
+        self.max_inflight = max_inflight
+        self.direct_io = direct_io
+        self.offset = 0
+        self._fd = -1
+        self._direct_fd = -1
+        self._buffers: List[mmap.mmap] = []
+        self._buf: Optional[mmap.mmap] = None
+        self._buf_pos = 0
+        self._buf_limit = 0
+
+    def _open(self) -> None:
+        self._fd = os.open(self.path, os.O_WRONLY)
+        self.offset = os.fstat(self._fd).st_size
+        if self.direct_io and hasattr(os, "O_DIRECT"):
+            try:
+                self._direct_fd = os.open(self.path, os.O_WRONLY | os.O_DIRECT)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                log.debug("O_DIRECT is not supported for {}", self.path)
+
+    def _close(self) -> None:
+        for fd in (self._fd, self._direct_fd):
+            if fd >= 0:
+                os.close(fd)
+        self._fd = -1
+        self._direct_fd = -1
+
+    async def __aenter__(self) -> UploadFileWriter:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._open)
+        self._buffers = [
+            mmap.mmap(-1, self.buffer_size) for _ in range(self.max_inflight + 1)
+        ]
+        self._write_q: janus.Queue[_Item] = janus.Queue(maxsize=self.max_inflight)
+        self._free_q: janus.Queue[mmap.mmap] = janus.Queue()
+        for buf in self._buffers[1:]:
+            self._free_q.sync_q.put_nowait(buf)
+        self._buf = self._buffers[0]
+        self._buf_pos = 0
+        # Let the first buffer end at an aligned offset when resuming
+        # from an unaligned offset.
+        self._buf_limit = self.buffer_size - self.offset % DIRECT_IO_ALIGNMENT
+        self._write_fut = loop.run_in_executor(None, self._write_all, self.offset)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        try:
+            if self._buf_pos > 0 and not self._write_fut.done():
+                assert self._buf is not None
+                await self._write_q.async_q.put((self._buf, self._buf_pos))
+            await self._write_q.async_q.put(Sentinel.TOKEN)
+            await self._write_fut
+        finally:
+            self._write_q.close()
+            self._free_q.close()
+            await self._write_q.wait_closed()
+            await self._free_q.wait_closed()
+            self._close()
+            for buf in self._buffers:
+                buf.close()
+            self._buffers.clear()
+            self._buf = None
+
+    async def write(self, data: bytes) -> None:
+        with memoryview(data) as view:
+            pos = 0
+            while pos < len(view):
+                if self._write_fut.done():
+                    # Raise the error of the writer thread.
+                    await self._write_fut
+                assert self._buf is not None
+                n = min(len(view) - pos, self._buf_limit - self._buf_pos)
+                self._buf[self._buf_pos : self._buf_pos + n] = view[pos : pos + n]
+                self._buf_pos += n
+                pos += n
+                if self._buf_pos == self._buf_limit:
+                    await self._write_q.async_q.put((self._buf, self._buf_pos))
+                    self._buf = await self._free_q.async_q.get()
+                    self._buf_pos = 0
+                    self._buf_limit = self.buffer_size
+
+    def _pwrite(self, fd: int, view: memoryview, offset: int) -> None:
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], offset + written)
+
+    def _write_buffer(self, buf: mmap.mmap, length: int, offset: int) -> None:
+        with memoryview(buf) as view:
+            direct_length = 0
+            if self._direct_fd >= 0 and offset % DIRECT_IO_ALIGNMENT == 0:
+                direct_length = length - length % DIRECT_IO_ALIGNMENT
+            if direct_length > 0:
+                try:
+                    self._pwrite(self._direct_fd, view[:direct_length], offset)
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    log.debug("falling back to buffered writes for {}", self.path)
+                    os.close(self._direct_fd)
+                    self._direct_fd = -1
+                    direct_length = 0
+            if direct_length < length:
+                self._pwrite(
+                    self._fd,
+                    view[direct_length:length],
+                    offset + direct_length,
+                )
+
+    def _write_all(self, offset: int) -> None:
+        error: Optional[BaseException] = None
+        while True:
+            item = self._write_q.sync_q.get()
+            if item is Sentinel.TOKEN:
+                break
+            buf, length = item
+            if error is None:
+                try:
+                    self._write_buffer(buf, length, offset)
+                    offset += length
+                except BaseException as e:
+                    # Keep returning the buffers to let the producer finish.
+                    error = e
+            self._free_q.sync_q.put(buf)
+        self.offset = offset
+        if error is not None:
+            raise error
+
+
+# (inode, mtime) of a state file, or None if it does not exist
+_StateVersion = Optional[Tuple[int, int]]
+
+
+@attr.s(auto_attribs=True, slots=True)
+class UploadSessionState:
+    offset: int
+    length: int
+
+
+class UploadSessionStore:
+    """
+    Keeps track of the upload offsets of the upload session files in memory,
+    so that the tus requests do not need to read the session files, which is
+    a network round-trip on NFS volumes.
+
+    The states are shared with the other worker processes via small files
+    in a local state directory, keyed by the hash of the session file paths.
+    A cached state is used only while its state file has not been replaced
+    since, so the states updated by the other workers are picked up.  The
+    session files themselves remain the source of truth: the PATCH handler
+    takes the actual offset from the opened file and corrects the state
+    (responding with 409 Conflict if the client has sent an outdated offset).
+    """
+
+    def __init__(
+        self,
+        state_dir: Path,
+        max_size: int = MAX_CACHED_UPLOAD_SESSIONS,
+    ) -> None:
+        self.state_dir = state_dir
+        self.max_size = max_size
+        # the states with the versions of their state files
+        self._states: OrderedDict[
+            Path,
+            Tuple[UploadSessionState, _StateVersion],
+        ] = OrderedDict()
+
+    def get_state_path(self, path: Path) -> Path:
+        path_hash = hashlib.sha1(str(path).encode("utf-8")).hexdigest()
+        return self.state_dir / f"{path_hash}.json"
+
+    def _stat_state(self, path: Path) -> _StateVersion:
+        try:
+            st = self.get_state_path(path).stat()
+        except FileNotFoundError:
+            return None
+        # The state file is replaced by renaming a new file on each update.
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _load(
+        self,
+        path: Path,
+        length: int,
+    ) -> Tuple[Optional[UploadSessionState], _StateVersion]:
+        version = self._stat_state(path)
+        try:
+            data = json.loads(self.get_state_path(path).read_bytes())
+            state = UploadSessionState(offset=data["offset"], length=data["length"])
+            return state, version
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        # a new session or the one served before a restart
+        try:
+            return UploadSessionState(offset=path.stat().st_size, length=length), None
+        except FileNotFoundError:
+            return None, None
+
+    def _save(self, path: Path, state: UploadSessionState) -> _StateVersion:
+        state_path = self.get_state_path(path)
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = state_path.with_name(f".{state_path.name}.{os.getpid()}")
+        temp_path.write_text(json.dumps(attr.asdict(state)))
+        temp_path.rename(state_path)
+        return self._stat_state(path)
+
+    def _remember(
+        self,
+        path: Path,
+        state: UploadSessionState,
+        version: _StateVersion,
+    ) -> None:
+        self._states[path] = (state, version)
+        self._states.move_to_end(path)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+
+    async def get(self, path: Path, length: int) -> Optional[UploadSessionState]:
+        """
+        Return the state of the given session file, or None if it does not
+        exist.  ``length`` is used when the session has no state yet.
+        """
+        loop = asyncio.get_running_loop()
+        cached = self._states.get(path)
+        if cached is not None:
+            state, version = cached
+            if version is not None and version == await loop.run_in_executor(
+                None,
+                self._stat_state,
+                path,
+            ):
+                self._states.move_to_end(path)
+                return state
+        loaded_state, version = await loop.run_in_executor(
+            None,
+            self._load,
+            path,
+            length,
+        )
+        if loaded_state is None:
+            self._states.pop(path, None)
+        else:
+            self._remember(path, loaded_state, version)
+        return loaded_state
+
+    async def update(self, path: Path, offset: int, length: int) -> UploadSessionState:
+        state = UploadSessionState(offset=offset, length=length)
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(None, self._save, path, state)
+        self._remember(path, state, version)
+        return state
+
+    async def forget(self, path: Path) -> None:
+        """
+        Drop the state of the given session file, which should be removed
+        by the caller.
+        """
+        self._states.pop(path, None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._remove_state, path)
+
+    def _remove_state(self, path: Path) -> None:
+        try:
+            self.get_state_path(path).unlink()
+        except FileNotFoundError:
+            pass
+
+    def reap_states(self, expire_before: float) -> int:
+        """
+        Delete the state files which have not been updated since
+        ``expire_before``, such as the ones of the abandoned sessions.
+
+        Returns the number of deleted state files.
+        """
+        num_deleted = 0
+        try:
+            with os.scandir(self.state_dir) as scanner:
+                for entry in scanner:
+                    try:
+                        if entry.stat().st_mtime < expire_before:
+                            os.unlink(entry.path)
+                            num_deleted += 1
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+        return num_deleted
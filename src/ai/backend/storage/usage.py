@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timezone as tz
+from pathlib import Path, PurePosixPath
+from typing import Awaitable, Callable, Dict, Final, Mapping, Optional, Tuple
+from uuid import UUID
+
+import attr
+
+from ai.backend.common.logging import BraceStyleAdapter
+
+from .types import VFolderUsage
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+DEFAULT_USAGE_CACHE_TTL: Final = 60.0  # seconds
+DEFAULT_USAGE_CACHE_SIZE: Final = 4096  # vfolders
+DEFAULT_USAGE_SCAN_CONCURRENCY: Final = 4
+DEFAULT_USAGE_SYNC_TIMEOUT: Final = 3.0  # seconds
+
+# A mapping from the relative paths of directories inside a vfolder
+# to their recursive (file_count, used_bytes) totals.
+DirUsageMap = Mapping[str, Tuple[int, int]]
+
+# (st_ino, st_mtime_ns) of a shared snapshot file
+_SnapshotVersion = Tuple[int, int]
+
+
+@attr.s(auto_attribs=True, slots=True)
+class UsageIndexEntry:
+    dirs: DirUsageMap
+    generation: int
+    updated_at: float  # wall-clock timestamp
+    # the shared generation marker when the scan has started
+    shared_generation: int = 0
+    snapshot_version: Optional[_SnapshotVersion] = None
+
+
+class VFolderUsageIndex:
+    """
+    Keeps the file count and used bytes of vfolders and all their
+    subdirectories in memory so that usage queries are answered without
+    walking the directory tree on every request.
+
+    The entries are refreshed in the background when they become older than
+    the TTL or when the storage proxy itself has modified the vfolder
+    contents (see :meth:`invalidate()`), with a bounded number of concurrent
+    scans per volume.  At most ``max_entries`` vfolders are kept, evicting the
+    least recently queried ones.
+
+    If ``state_dir`` is given, the scan results are also stored there as
+    snapshot files shared by the worker processes, along with a generation
+    marker file per vfolder touched upon invalidation.  This lets a scan done
+    by one worker serve the others and makes an invalidation in one worker
+    reach all of them.  Like the other IPC states, the shared snapshots are
+    not kept across the restarts of the server.
+    """
+
+    def __init__(
+        self,
+        scan: Callable[[UUID], Awaitable[DirUsageMap]],
+        *,
+        state_dir: Path = None,
+        ttl: float = DEFAULT_USAGE_CACHE_TTL,
+        max_entries: int = DEFAULT_USAGE_CACHE_SIZE,
+        max_concurrency: int = DEFAULT_USAGE_SCAN_CONCURRENCY,
+        sync_timeout: float = DEFAULT_USAGE_SYNC_TIMEOUT,
+    ) -> None:
+        self._scan = scan
+        self._state_dir = state_dir
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._sync_timeout = sync_timeout
+        self._scan_sema = asyncio.Semaphore(max_concurrency)
+        self._entries: OrderedDict[UUID, UsageIndexEntry] = OrderedDict()
+        self._generations: Dict[UUID, int] = {}
+        self._refresh_tasks: Dict[UUID, asyncio.Task] = {}
+        self._pending_touches: Dict[UUID, asyncio.Future] = {}
+
+    async def aclose(self) -> None:
+        tasks = [*self._refresh_tasks.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*self._pending_touches.values(), return_exceptions=True)
+        self._refresh_tasks.clear()
+        self._entries.clear()
+
+    # ------ shared snapshots -------
+
+    def _get_snapshot_path(self, vfid: UUID) -> Path:
+        assert self._state_dir is not None
+        return self._state_dir / f"{vfid.hex}.json"
+
+    def _get_generation_path(self, vfid: UUID) -> Path:
+        assert self._state_dir is not None
+        return self._state_dir / f"{vfid.hex}.gen"
+
+    def _read_generation(self, vfid: UUID) -> int:
+        try:
+            return self._get_generation_path(vfid).stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _touch_generation(self, vfid: UUID) -> None:
+        generation_path = self._get_generation_path(vfid)
+        generation_path.parent.mkdir(parents=True, exist_ok=True)
+        generation_path.touch()
+
+    def _read_snapshot(
+        self,
+        vfid: UUID,
+        known_version: Optional[_SnapshotVersion],
+    ) -> Tuple[int, Optional[UsageIndexEntry]]:
+        """
+        Return the current shared generation and the shared snapshot if it
+        differs from the known version.
+        """
+        generation = self._read_generation(vfid)
+        snapshot_path = self._get_snapshot_path(vfid)
+        try:
+            stat = snapshot_path.stat()
+            version = (stat.st_ino, stat.st_mtime_ns)
+            if version == known_version:
+                return generation, None
+            data = json.loads(snapshot_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return generation, None
+        return generation, UsageIndexEntry(
+            dirs={
+                relpath: (file_count, used_bytes)
+                for relpath, (file_count, used_bytes) in data["dirs"].items()
+            },
+            generation=0,
+            updated_at=data["updated_at"],
+            shared_generation=data["generation"],
+            snapshot_version=version,
+        )
+
+    def _write_snapshot(self, vfid: UUID, entry: UsageIndexEntry) -> _SnapshotVersion:
+        snapshot_path = self._get_snapshot_path(vfid)
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = snapshot_path.with_name(f".{snapshot_path.name}.{os.getpid()}.tmp")
+        temp_path.write_text(
+            json.dumps(
+                {
+                    "updated_at": entry.updated_at,
+                    "generation": entry.shared_generation,
+                    "dirs": entry.dirs,
+                },
+            ),
+        )
+        temp_path.rename(snapshot_path)
+        stat = snapshot_path.stat()
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _remove_snapshot(self, vfid: UUID) -> None:
+        for path in (self._get_snapshot_path(vfid), self._get_generation_path(vfid)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def _sync_shared(self, vfid: UUID) -> int:
+        """
+        Adopt the snapshot scanned by the other workers if it is newer than
+        the local entry and return the current shared generation.
+        """
+        if self._state_dir is None:
+            return 0
+        touch = self._pending_touches.get(vfid)
+        if touch is not None:
+            await asyncio.shield(touch)
+        loop = asyncio.get_running_loop()
+        entry = self._entries.get(vfid)
+        shared_generation, shared_entry = await loop.run_in_executor(
+            None,
+            self._read_snapshot,
+            vfid,
+            entry.snapshot_version if entry is not None else None,
+        )
+        if shared_entry is not None and (
+            entry is None or shared_entry.updated_at > entry.updated_at
+        ):
+            # Invalidations done in this worker are reflected to the shared
+            # generation, which is compared separately in _is_stale().
+            shared_entry.generation = self._generations.get(vfid, 0)
+            self._store(vfid, shared_entry)
+        return shared_generation
+
+    # ------ local entries -------
+
+    def invalidate(self, vfid: UUID) -> None:
+        """
+        Mark the cached usage of the given vfolder as outdated in all workers.
+        The next query returns the last known usage while triggering a rescan.
+        """
+        if self._state_dir is not None:
+            # The other workers may have cached it.
+            loop = asyncio.get_running_loop()
+            touch = loop.run_in_executor(None, self._touch_generation, vfid)
+            self._pending_touches[vfid] = touch
+
+            def _done(fut: asyncio.Future) -> None:
+                if self._pending_touches.get(vfid) is fut:
+                    del self._pending_touches[vfid]
+                if not fut.cancelled() and fut.exception() is not None:
+                    log.warning(
+                        "failed to invalidate the shared usage of vfolder {}: {!r}",
+                        vfid,
+                        fut.exception(),
+                    )
+
+            touch.add_done_callback(_done)
+        if vfid not in self._entries and vfid not in self._refresh_tasks:
+            # Nothing is cached to be outdated.
+            return
+        self._generations[vfid] = self._generations.get(vfid, 0) + 1
+
+    async def discard(self, vfid: UUID) -> None:
+        """
+        Drop the usage of a deleted vfolder.
+        """
+        task = self._refresh_tasks.pop(vfid, None)
+        if task is not None:
+            task.cancel()
+        self._entries.pop(vfid, None)
+        self._generations.pop(vfid, None)
+        if self._state_dir is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._remove_snapshot, vfid)
+
+    def _store(self, vfid: UUID, entry: UsageIndexEntry) -> None:
+        self._entries[vfid] = entry
+        self._entries.move_to_end(vfid)
+        while len(self._entries) > self._max_entries:
+            evicted_vfid, _ = self._entries.popitem(last=False)
+            if evicted_vfid not in self._refresh_tasks:
+                self._generations.pop(evicted_vfid, None)
+
+    def _is_stale(
+        self,
+        vfid: UUID,
+        entry: UsageIndexEntry,
+        shared_generation: int,
+    ) -> bool:
+        if entry.generation != self._generations.get(vfid, 0):
+            return True
+        if entry.shared_generation != shared_generation:
+            return True
+        return time.time() - entry.updated_at > self._ttl
+
+    def schedule_refresh(self, vfid: UUID, *, force: bool = False) -> asyncio.Task:
+        """
+        Rescan the given vfolder in the background unless a rescan is already
+        in progress.  Without ``force``, the scan is skipped if another worker
+        has refreshed the usage meanwhile.
+        """
+        task = self._refresh_tasks.get(vfid)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh(vfid, force=force))
+            self._refresh_tasks[vfid] = task
+        return task
+
+    async def _refresh(self, vfid: UUID, *, force: bool) -> Optional[Exception]:
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._scan_sema:
+                # Another worker may have scanned it while waiting.
+                shared_generation = await self._sync_shared(vfid)
+                entry = self._entries.get(vfid)
+                if (
+                    not force
+                    and entry is not None
+                    and not self._is_stale(vfid, entry, shared_generation)
+                ):
+                    return None
+                generation = self._generations.get(vfid, 0)
+                started_at = time.time()
+                dirs = await self._scan(vfid)
+            entry = UsageIndexEntry(
+                dirs=dirs,
+                generation=generation,
+                updated_at=started_at,
+                shared_generation=shared_generation,
+            )
+            if self._state_dir is not None:
+                entry.snapshot_version = await loop.run_in_executor(
+                    None,
+                    self._write_snapshot,
+                    vfid,
+                    entry,
+                )
+            self._store(vfid, entry)
+            return None
+        except Exception as e:
+            # Not raised here since nobody may await the background refreshes.
+            log.exception("failed to scan the usage of vfolder {}", vfid)
+            return e
+        finally:
+            if self._refresh_tasks.get(vfid) is asyncio.current_task():
+                del self._refresh_tasks[vfid]
+
+    def _lookup(
+        self,
+        entry: UsageIndexEntry,
+        relpath: PurePosixPath,
+    ) -> Optional[VFolderUsage]:
+        try:
+            file_count, used_bytes = entry.dirs[str(relpath)]
+        except KeyError:
+            return None
+        return VFolderUsage(
+            file_count=file_count,
+            used_bytes=used_bytes,
+            updated_at=datetime.fromtimestamp(entry.updated_at, tz=tz.utc),
+        )
+
+    async def get(
+        self,
+        vfid: UUID,
+        relpath: PurePosixPath = PurePosixPath("."),
+    ) -> Optional[VFolderUsage]:
+        """
+        Return the usage of the given directory in the vfolder, or None if
+        the directory is not in the index, e.g., when it is not a directory or
+        it has been created or removed after the last scan.  The caller should
+        check the path by itself and call :meth:`schedule_refresh()` if
+        required.
+        """
+        shared_generation = await self._sync_shared(vfid)
+        entry = self._entries.get(vfid)
+        if entry is not None:
+            self._entries.move_to_end(vfid)
+            if self._is_stale(vfid, entry, shared_generation):
+                self.schedule_refresh(vfid)
+            return self._lookup(entry, relpath)
+        # Wait for the initial scan for a while and let it continue in the
+        # background if it takes too long.
+        task = self.schedule_refresh(vfid)
+        try:
+            error = await asyncio.wait_for(asyncio.shield(task), self._sync_timeout)
+        except asyncio.TimeoutError:
+            # -1 indicates "too many"
+            return VFolderUsage(file_count=-1, used_bytes=-1)
+        if error is not None:
+            raise error
+        entry = self._entries.get(vfid)
+        if entry is None:
+            # evicted by the scans of the other vfolders meanwhile
+            return VFolderUsage(file_count=-1, used_bytes=-1)
+        return self._lookup(entry, relpath)
@@ -1,18 +1,87 @@
+import asyncio
 import enum
 import json
 import logging
+import threading
+import time
 from contextlib import asynccontextmanager as actxmgr
 from datetime import datetime
 from datetime import timezone as tz
-from typing import Any, Optional, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Final,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
+import janus
 import trafaret as t
 from aiohttp import web
 
 from ai.backend.common.logging import BraceStyleAdapter
 
+from .types import SENTINEL, Sentinel
+
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+
+DEFAULT_INFLIGHT_BATCHES: Final = 8
+
+
+class AsyncTTLCache(Generic[K, T]):
+    """
+    Caches the results of coroutines by keys for the given seconds.
+    Concurrent lookups of a missing key share a single fetch.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        # key -> (value, expiration time based on time.monotonic())
+        self._entries: Dict[K, Tuple[T, float]] = {}
+        self._fetches: Dict[K, asyncio.Task] = {}
+
+    def invalidate(self, key: Optional[K] = None) -> None:
+        """
+        Drop the cached value of the given key, or all values if not given.
+        """
+        if key is None:
+            self._entries.clear()
+            self._fetches.clear()
+        else:
+            self._entries.pop(key, None)
+            self._fetches.pop(key, None)
+
+    async def get(self, key: K, fetch: Callable[[], Awaitable[T]]) -> T:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        task = self._fetches.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, fetch))
+            self._fetches[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: K, fetch: Callable[[], Awaitable[T]]) -> T:
+        try:
+            value = await fetch()
+            if self._fetches.get(key) is asyncio.current_task():
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+            return value
+        finally:
+            if self._fetches.get(key) is asyncio.current_task():
+                del self._fetches[key]
+
 
 class CheckParamSource(enum.Enum):
     BODY = 0
@@ -109,6 +178,13 @@ async def log_manager_api_entry(
                 params["vfid"],
                 params["relpath"],
             )
+        elif "vfids" in params:
+            log.info(
+                "ManagerAPI::{}(v:{}, f*:{} vfolders)",
+                name.upper(),
+                params["volume"],
+                len(params["vfids"]),
+            )
         elif "vfid" in params:
             log.info(
                 "ManagerAPI::{}(v:{}, f:{})",
@@ -127,3 +203,67 @@ async def log_manager_api_entry(
         "ManagerAPI::{}()",
         name.upper(),
     )
+
+
+class _ProducerStopped(Exception):
+    pass
+
+
+async def aiter_batches_from_thread(
+    producer: Callable[[Callable[[List[T]], None]], None],
+    *,
+    max_inflight_batches: int = DEFAULT_INFLIGHT_BATCHES,
+) -> AsyncIterator[List[T]]:
+    """
+    Run the blocking ``producer`` function in a thread and iterate over
+    the batches of items that it emits through the callback given as the
+    argument.
+
+    Passing batches instead of individual items amortizes the cost of
+    waking up the event loop from the thread.  Up to ``max_inflight_batches``
+    batches are kept in the queue so that the producer is throttled by a
+    slow consumer.  When the consumer stops the iteration early, the next
+    emit call raises an internal exception to stop the producer.
+    An exception raised by the producer is re-raised to the consumer after
+    the batches emitted before it.
+    """
+    loop = asyncio.get_running_loop()
+    q: janus.Queue[Union[Sentinel, List[T]]] = janus.Queue(
+        maxsize=max_inflight_batches,
+    )
+    stopped = threading.Event()
+
+    def _emit(batch: List[T]) -> None:
+        if stopped.is_set():
+            raise _ProducerStopped
+        q.sync_q.put(batch)
+
+    def _run() -> None:
+        try:
+            producer(_emit)
+        except _ProducerStopped:
+            pass
+        finally:
+            q.sync_q.put(SENTINEL)
+
+    producer_fut = loop.run_in_executor(None, _run)
+    finished = False
+    try:
+        while True:
+            batch = await q.async_q.get()
+            q.async_q.task_done()
+            if batch is SENTINEL:
+                finished = True
+                break
+            yield batch
+    finally:
+        if not finished:
+            # Unblock the producer waiting for a free slot until it stops.
+            stopped.set()
+            while (await q.async_q.get()) is not SENTINEL:
+                q.async_q.task_done()
+        try:
+            await producer_fut
+        finally:
+            q.close()
+            await q.wait_closed()
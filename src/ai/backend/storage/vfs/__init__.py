@@ -2,46 +2,82 @@ from __future__ import annotations
 
 import asyncio
 import functools
+import hashlib
+import heapq
+import itertools
 import logging
 import os
 import secrets
 import shutil
 import time
+import uuid
 import warnings
-from pathlib import Path, PurePosixPath
-from typing import AsyncIterator, FrozenSet, Sequence, Union
+from collections import Counter
+from pathlib import Path, PurePath, PurePosixPath
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Final,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from uuid import UUID
 
 import janus
+from aiotools import aclosing
 
 from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.types import BinarySize, HardwareMetadata
 
+from .. import fastcopy, metrics
 from ..abc import CAP_VFOLDER, AbstractVolume
+from ..clone import CloneCheckpoint, CloneProgress, get_clone_manifest_path
 from ..exception import ExecutionError, InvalidAPIParameters
+from ..fastcopy import CopyStrategy
 from ..types import (
-    SENTINEL,
     DirEntry,
     DirEntryType,
     FSPerfMetric,
     FSUsage,
-    Sentinel,
     Stat,
     VFolderCreationOptions,
     VFolderUsage,
 )
-from ..utils import fstime2datetime
+from ..usage import (
+    DEFAULT_USAGE_CACHE_SIZE,
+    DEFAULT_USAGE_CACHE_TTL,
+    DEFAULT_USAGE_SCAN_CONCURRENCY,
+    DEFAULT_USAGE_SYNC_TIMEOUT,
+    DirUsageMap,
+    VFolderUsageIndex,
+)
+from ..utils import aiter_batches_from_thread, fstime2datetime
+from ..walker import TreeWalker
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
+SCANDIR_BATCH_SIZE: Final = 256
+SCANDIR_BATCH_INTERVAL: Final = 0.05  # seconds
+READ_BATCH_BYTES: Final = 1024 * 1024
+
 
 async def run(cmd: Sequence[Union[str, Path]]) -> str:
-    proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    out, err = await proc.communicate()
+    with metrics.track_subprocess(metrics.get_command_name(cmd)):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate()
     if err:
         raise ExecutionError(err.decode())
     return out.decode()
@@ -49,6 +85,50 @@ async def run(cmd: Sequence[Union[str, Path]]) -> str:
 
 class BaseVolume(AbstractVolume):
 
+    usage_index: VFolderUsageIndex
+
+    def __init__(
+        self,
+        local_config: Mapping[str, Any],
+        mount_path: Path,
+        *,
+        fsprefix: PurePath = None,
+        options: Mapping[str, Any] = None,
+    ) -> None:
+        super().__init__(
+            local_config,
+            mount_path,
+            fsprefix=fsprefix,
+            options=options,
+        )
+        mount_hash = hashlib.sha1(str(mount_path).encode("utf-8")).hexdigest()[:16]
+        self.usage_index = VFolderUsageIndex(
+            self._scan_usage,
+            state_dir=Path(
+                f"/tmp/backend.ai/ipc/storage-proxy-usage-{os.getppid()}/{mount_hash}",
+            ),
+            ttl=float(self.config.get("usage_cache_ttl", DEFAULT_USAGE_CACHE_TTL)),
+            max_entries=int(
+                self.config.get("usage_cache_size", DEFAULT_USAGE_CACHE_SIZE),
+            ),
+            max_concurrency=int(
+                self.config.get(
+                    "usage_scan_concurrency",
+                    DEFAULT_USAGE_SCAN_CONCURRENCY,
+                ),
+            ),
+            sync_timeout=float(
+                self.config.get("usage_sync_timeout", DEFAULT_USAGE_SYNC_TIMEOUT),
+            ),
+        )
+
+    async def shutdown(self) -> None:
+        await self.usage_index.aclose()
+        await super().shutdown()
+
+    def invalidate_usage(self, vfid: UUID) -> None:
+        self.usage_index.invalidate(vfid)
+
     # ------ volume operations -------
 
     async def get_capabilities(self) -> FrozenSet[str]:
@@ -89,8 +169,11 @@ class BaseVolume(AbstractVolume):
                 vfpath.parent.rmdir()
             if not os.listdir(vfpath.parent.parent):
                 vfpath.parent.parent.rmdir()
+            # the checkpoint of an unfinished clone into it
+            get_clone_manifest_path(self.mount_path, vfid).unlink(missing_ok=True)
 
         await loop.run_in_executor(None, _delete_vfolder)
+        await self.usage_index.discard(vfid)
 
     async def clone_vfolder(
         self,
@@ -98,40 +181,133 @@ class BaseVolume(AbstractVolume):
         dst_volume: AbstractVolume,
         dst_vfid: UUID,
         options: VFolderCreationOptions = None,
+        *,
+        progress: CloneProgress = None,
     ) -> None:
-        # check if there is enough space in the destination
+        loop = asyncio.get_running_loop()
+        src_vfpath = self.mangle_vfpath(src_vfid)
+        dst_vfpath = dst_volume.mangle_vfpath(dst_vfid)
+
+        # check if there is enough space in the destination,
+        # excluding the files copied by a previous attempt
         fs_usage = await dst_volume.get_fs_usage()
         vfolder_usage = await self.get_usage(src_vfid)
-        if vfolder_usage.used_bytes > fs_usage.capacity_bytes - fs_usage.used_bytes:
+        required_bytes = vfolder_usage.used_bytes
+        if await loop.run_in_executor(None, dst_vfpath.is_dir):
+            required_bytes -= max(0, (await dst_volume.get_usage(dst_vfid)).used_bytes)
+        if required_bytes > fs_usage.capacity_bytes - fs_usage.used_bytes:
             raise ExecutionError("Not enough space available for clone.")
 
+        if progress is None:
+            progress = CloneProgress(task_id=uuid.uuid4())
+        if vfolder_usage.file_count >= 0:
+            progress.total_files = vfolder_usage.file_count
+            progress.total_bytes = vfolder_usage.used_bytes
+
         # create the target vfolder
-        src_vfpath = self.mangle_vfpath(src_vfid)
         await dst_volume.create_vfolder(dst_vfid, options=options, exist_ok=True)
-        dst_vfpath = dst_volume.mangle_vfpath(dst_vfid)
+        checkpoint = CloneCheckpoint(
+            get_clone_manifest_path(dst_volume.mount_path, dst_vfid),
+            progress,
+        )
+        await loop.run_in_executor(None, checkpoint.load)
 
         # perform the file-tree copy
         try:
-            await self.copy_tree(src_vfpath, dst_vfpath)
+            await self.copy_tree(src_vfpath, dst_vfpath, checkpoint=checkpoint)
         except Exception:
-            await dst_volume.delete_vfolder(dst_vfid)
+            # Keep the copied files and the manifest to resume later.
+            await loop.run_in_executor(None, checkpoint.flush)
             log.exception("clone_vfolder: error during copy_tree()")
             raise ExecutionError("Copying files from source directories failed.")
+        finally:
+            dst_volume.invalidate_usage(dst_vfid)
+        await loop.run_in_executor(None, checkpoint.remove)
 
     async def copy_tree(
         self,
         src_vfpath: Path,
         dst_vfpath: Path,
+        *,
+        checkpoint: CloneCheckpoint = None,
     ) -> None:
+        walker = TreeWalker(
+            src_vfpath,
+            concurrency=self.scan_concurrency,
+            executor=self.walk_executor,
+        )
+        copied_dirs: List[List[PurePosixPath]] = [[] for _ in range(walker.concurrency)]
+        # the copy strategies used by each worker
+        strategy_counts: List[Counter[CopyStrategy]] = [
+            Counter() for _ in range(walker.concurrency)
+        ]
+
+        def _copy_file(
+            worker_idx: int,
+            entry: os.DirEntry,
+            relpath: PurePosixPath,
+            dst_path: Path,
+        ) -> None:
+            if checkpoint is None:
+                strategy_counts[worker_idx][fastcopy.copy2(entry.path, dst_path)] += 1
+                return
+            src_stat = entry.stat(follow_symlinks=False)
+            if checkpoint.is_copied(relpath, src_stat, dst_path):
+                checkpoint.mark_copied(relpath, src_stat, skipped=True)
+                return
+            strategy = fastcopy.copy2(entry.path, dst_path)
+            strategy_counts[worker_idx][strategy] += 1
+            checkpoint.mark_copied(relpath, src_stat, strategy=strategy.value)
+
+        def _copy_dir(
+            worker_idx: int,
+            relpath: PurePosixPath,
+            entries: Iterator[os.DirEntry],
+        ) -> None:
+            dst_dirpath = dst_vfpath / relpath
+            for entry in entries:
+                dst_path = dst_dirpath / entry.name
+                if entry.is_symlink():
+                    if dst_path.is_symlink():
+                        # created by a previous attempt
+                        dst_path.unlink()
+                    os.symlink(os.readlink(entry.path), dst_path)
+                elif entry.is_dir():
+                    dst_path.mkdir(exist_ok=True)
+                    copied_dirs[worker_idx].append(relpath / entry.name)
+                else:
+                    _copy_file(worker_idx, entry, relpath / entry.name, dst_path)
+
+        def _copy_dir_stats() -> None:
+            # Copy the directory permissions and timestamps after their
+            # contents are copied, from the deepest ones.
+            relpaths = sorted(
+                itertools.chain.from_iterable(copied_dirs),
+                key=lambda p: len(p.parts),
+                reverse=True,
+            )
+            for relpath in relpaths:
+                shutil.copystat(src_vfpath / relpath, dst_vfpath / relpath)
+            shutil.copystat(src_vfpath, dst_vfpath)
+
         loop = asyncio.get_running_loop()
         await loop.run_in_executor(
             None,
-            functools.partial(
-                shutil.copytree,
-                src_vfpath,
-                dst_vfpath,
-                dirs_exist_ok=True,
-            ),
+            lambda: dst_vfpath.mkdir(parents=True, exist_ok=True),
+        )
+        try:
+            await walker.arun(_copy_dir)
+        finally:
+            if checkpoint is not None:
+                await loop.run_in_executor(None, checkpoint.flush)
+        await loop.run_in_executor(None, _copy_dir_stats)
+        total_counts: Counter[CopyStrategy] = sum(strategy_counts, Counter())
+        log.info(
+            "copied {} files from {} to {} ({})",
+            sum(total_counts.values()),
+            src_vfpath,
+            dst_vfpath,
+            ", ".join(f"{k.value}: {v}" for k, v in total_counts.most_common()) or "-",
         )
 
     async def get_vfolder_mount(self, vfid: UUID, subpath: str) -> Path:
@@ -181,102 +357,176 @@ class BaseVolume(AbstractVolume):
         relpath: PurePosixPath = PurePosixPath("."),
     ) -> VFolderUsage:
         target_path = self.sanitize_vfpath(vfid, relpath)
-        total_size = 0
-        total_count = 0
-        start_time = time.monotonic()
-
-        def _calc_usage(target_path: os.DirEntry | Path) -> None:
-            nonlocal total_size, total_count
-            _timeout = 3
-            # FIXME: Remove "type: ignore" when python/mypy#11964 is resolved.
-            with os.scandir(target_path) as scanner:  # type: ignore
-                for entry in scanner:
-                    if entry.is_dir():
-                        _calc_usage(entry)
-                        continue
-                    if entry.is_file() or entry.is_symlink():
-                        stat = entry.stat(follow_symlinks=False)
-                        total_size += stat.st_size
-                        total_count += 1
-                    if total_count % 1000 == 0:
-                        # Cancel if this I/O operation takes too much time.
-                        if time.monotonic() - start_time > _timeout:
-                            raise TimeoutError
+        usage = await self.usage_index.get(vfid, self.strip_vfpath(vfid, target_path))
+        if usage is not None:
+            return usage
+
+        def _check_dir() -> None:
+            if not target_path.is_dir():
+                # raises FileNotFoundError if it does not exist
+                target_path.stat()
+                raise NotADirectoryError(target_path)
 
         loop = asyncio.get_running_loop()
-        try:
-            await loop.run_in_executor(None, _calc_usage, target_path)
-        except TimeoutError:
-            # -1 indicates "too many"
-            total_size = -1
-            total_count = -1
-        return VFolderUsage(file_count=total_count, used_bytes=total_size)
+        await loop.run_in_executor(None, _check_dir)
+        # The directory has been created after the last scan.
+        self.usage_index.schedule_refresh(vfid, force=True)
+        return VFolderUsage(file_count=-1, used_bytes=-1)
+
+    async def _scan_usage(self, vfid: UUID) -> DirUsageMap:
+        """
+        Walk the whole vfolder and calculate the recursive file count and
+        used bytes of every directory in it.
+        """
+        vfpath = self.mangle_vfpath(vfid).resolve()
+        walker = TreeWalker(
+            vfpath,
+            concurrency=self.scan_concurrency,
+            executor=self.walk_executor,
+        )
+        # the file count and bytes directly inside each directory
+        own_usages: List[Dict[str, Tuple[int, int]]] = [
+            {} for _ in range(walker.concurrency)
+        ]
+
+        def _calc_usage(
+            worker_idx: int,
+            relpath: PurePosixPath,
+            entries: Iterator[os.DirEntry],
+        ) -> None:
+            file_count = 0
+            used_bytes = 0
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    continue
+                if entry.is_file() or entry.is_symlink():
+                    stat = entry.stat(follow_symlinks=False)
+                    used_bytes += stat.st_size
+                    file_count += 1
+            own_usages[worker_idx][str(relpath)] = (file_count, used_bytes)
+
+        def _roll_up() -> DirUsageMap:
+            # roll up the totals to the ancestor directories
+            dirs: Dict[str, Tuple[int, int]] = {}
+            for own_usage in own_usages:
+                for relpath_str, (file_count, used_bytes) in own_usage.items():
+                    relpath = PurePosixPath(relpath_str)
+                    for path in (relpath, *relpath.parents):
+                        prev_count, prev_bytes = dirs.get(str(path), (0, 0))
+                        dirs[str(path)] = (
+                            prev_count + file_count,
+                            prev_bytes + used_bytes,
+                        )
+            return dirs
+
+        await walker.arun(_calc_usage)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _roll_up)
 
     async def get_used_bytes(self, vfid: UUID) -> BinarySize:
         vfpath = self.mangle_vfpath(vfid)
-        info = await run(["du", "-hs", vfpath])
-        used_bytes, _ = info.split()
-        return BinarySize.finite_from_str(used_bytes)
+        walker = TreeWalker(
+            vfpath,
+            concurrency=self.scan_concurrency,
+            executor=self.walk_executor,
+        )
+        # Count the allocated blocks like du does, including directories
+        # and counting hard-linked files only once.
+        used_blocks = [0] * walker.concurrency
+        hardlinks: List[Dict[Tuple[int, int], int]] = [
+            {} for _ in range(walker.concurrency)
+        ]
+
+        def _calc_blocks(
+            worker_idx: int,
+            relpath: PurePosixPath,
+            entries: Iterator[os.DirEntry],
+        ) -> None:
+            for entry in entries:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_nlink > 1 and not entry.is_dir(follow_symlinks=False):
+                    hardlinks[worker_idx][(stat.st_dev, stat.st_ino)] = stat.st_blocks
+                else:
+                    used_blocks[worker_idx] += stat.st_blocks
+
+        await walker.arun(_calc_blocks)
+        loop = asyncio.get_running_loop()
+        root_stat = await loop.run_in_executor(None, os.stat, vfpath)
+        total_blocks = root_stat.st_blocks + sum(used_blocks)
+        unique_hardlinks: Dict[Tuple[int, int], int] = {}
+        for item in hardlinks:
+            unique_hardlinks.update(item)
+        total_blocks += sum(unique_hardlinks.values())
+        return BinarySize(total_blocks * 512)
 
     # ------ vfolder internal operations -------
 
-    def scandir(self, vfid: UUID, relpath: PurePosixPath) -> AsyncIterator[DirEntry]:
+    def scandir(
+        self,
+        vfid: UUID,
+        relpath: PurePosixPath,
+        *,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[DirEntry]:
         target_path = self.sanitize_vfpath(vfid, relpath)
-        q: janus.Queue[Union[Sentinel, DirEntry]] = janus.Queue()
-        loop = asyncio.get_running_loop()
 
-        def _scandir(q: janus._SyncQueueProxy[Union[Sentinel, DirEntry]]) -> None:
-            count = 0
-            limit = self.local_config["storage-proxy"]["scandir-limit"]
-            try:
-                with os.scandir(target_path) as scanner:
-                    for entry in scanner:
-                        symlink_target = ""
-                        entry_type = DirEntryType.FILE
-                        if entry.is_dir():
-                            entry_type = DirEntryType.DIRECTORY
-                        if entry.is_symlink():
-                            entry_type = DirEntryType.SYMLINK
-                            symlink_target = str(Path(entry).resolve())
-                        entry_stat = entry.stat(follow_symlinks=False)
-                        q.put(
-                            DirEntry(
-                                name=entry.name,
-                                path=Path(entry.path),
-                                type=entry_type,
-                                stat=Stat(
-                                    size=entry_stat.st_size,
-                                    owner=str(entry_stat.st_uid),
-                                    mode=entry_stat.st_mode,
-                                    modified=fstime2datetime(entry_stat.st_mtime),
-                                    created=fstime2datetime(entry_stat.st_ctime),
-                                ),
-                                symlink_target=symlink_target,
+        def _scandir(emit: Callable[[List[DirEntry]], None]) -> None:
+            batch: List[DirEntry] = []
+            last_emitted = time.monotonic()
+            with os.scandir(target_path) as scanner:
+                entries: Iterable[os.DirEntry] = scanner
+                if after is not None:
+                    entries = (entry for entry in entries if entry.name > after)
+                if limit is not None:
+                    # Only the names are compared here, keeping at most
+                    # ``limit`` entries, and only the chosen ones are stat-ed.
+                    entries = heapq.nsmallest(
+                        limit,
+                        entries,
+                        key=lambda entry: entry.name,
+                    )
+                for entry in entries:
+                    symlink_target = ""
+                    entry_type = DirEntryType.FILE
+                    if entry.is_dir():
+                        entry_type = DirEntryType.DIRECTORY
+                    if entry.is_symlink():
+                        entry_type = DirEntryType.SYMLINK
+                        symlink_target = str(Path(entry).resolve())
+                    entry_stat = entry.stat(follow_symlinks=False)
+                    batch.append(
+                        DirEntry(
+                            name=entry.name,
+                            path=Path(entry.path),
+                            type=entry_type,
+                            stat=Stat(
+                                size=entry_stat.st_size,
+                                owner=str(entry_stat.st_uid),
+                                mode=entry_stat.st_mode,
+                                modified=fstime2datetime(entry_stat.st_mtime),
+                                created=fstime2datetime(entry_stat.st_ctime),
                             ),
-                        )
-                        count += 1
-                        if limit > 0 and count == limit:
-                            break
-            finally:
-                q.put(SENTINEL)
-
-        async def _scan_task(_scandir, q) -> None:
-            await loop.run_in_executor(None, _scandir, q.sync_q)
+                            symlink_target=symlink_target,
+                        ),
+                    )
+                    # Do not hold the scanned entries too long on slow filesystems.
+                    now = time.monotonic()
+                    if (
+                        len(batch) >= SCANDIR_BATCH_SIZE
+                        or now - last_emitted >= SCANDIR_BATCH_INTERVAL
+                    ):
+                        emit(batch)
+                        batch = []
+                        last_emitted = now
+            if batch:
+                emit(batch)
 
         async def _aiter() -> AsyncIterator[DirEntry]:
-            scan_task = asyncio.create_task(_scan_task(_scandir, q))
-            await asyncio.sleep(0)
-            try:
-                while True:
-                    item = await q.async_q.get()
-                    if item is SENTINEL:
-                        break
-                    yield item
-                    q.async_q.task_done()
-            finally:
-                await scan_task
-                q.close()
-                await q.wait_closed()
+            async with aclosing(aiter_batches_from_thread(_scandir)) as batches:
+                async for batch in batches:
+                    for item in batch:
+                        yield item
 
         return _aiter()
 
@@ -294,6 +544,7 @@ class BaseVolume(AbstractVolume):
             None,
             lambda: target_path.mkdir(0o755, parents=parents, exist_ok=exist_ok),
         )
+        self.invalidate_usage(vfid)
 
     async def rmdir(
         self,
@@ -305,6 +556,7 @@ class BaseVolume(AbstractVolume):
         target_path = self.sanitize_vfpath(vfid, relpath)
         loop = asyncio.get_running_loop()
         await loop.run_in_executor(None, target_path.rmdir)
+        self.invalidate_usage(vfid)
 
     async def move_file(
         self,
@@ -319,6 +571,7 @@ class BaseVolume(AbstractVolume):
             None,
             lambda: shutil.move(str(src_path), str(dst_path)),
         )
+        self.invalidate_usage(vfid)
 
     async def move_tree(
         self,
@@ -343,6 +596,7 @@ class BaseVolume(AbstractVolume):
             None,
             lambda: shutil.move(str(src_path), str(dst_path)),
         )
+        self.invalidate_usage(vfid)
 
     async def copy_file(
         self,
@@ -359,12 +613,14 @@ class BaseVolume(AbstractVolume):
             None,
             lambda: dst_path.parent.mkdir(parents=True, exist_ok=True),
         )
-        await loop.run_in_executor(
+        strategy = await loop.run_in_executor(
             None,
-            lambda: shutil.copyfile(str(src_path), str(dst_path)),
+            lambda: fastcopy.copy_file(src_path, dst_path),
         )
+        log.debug("copied {} to {} using {}", src_path, dst_path, strategy.value)
+        self.invalidate_usage(vfid)
 
-    async def prepare_upload(self, vfid: UUID) -> str:
+    async def prepare_upload(self, vfid: UUID, size: Optional[int] = None) -> str:
         vfpath = self.mangle_vfpath(vfid)
         session_id = secrets.token_hex(16)
 
@@ -407,6 +663,7 @@ class BaseVolume(AbstractVolume):
             await q.async_q.join()
         finally:
             await write_task
+            self.invalidate_usage(vfid)
 
     def read_file(
         self,
@@ -416,24 +673,24 @@ class BaseVolume(AbstractVolume):
         chunk_size: int = 0,
     ) -> AsyncIterator[bytes]:
         target_path = self.sanitize_vfpath(vfid, relpath)
-        q: janus.Queue[Union[bytes, Exception]] = janus.Queue()
         loop = asyncio.get_running_loop()
 
-        def _read(
-            q: janus._SyncQueueProxy[Union[bytes, Exception]],
-            chunk_size: int,
-        ) -> None:
-            try:
-                with open(target_path, "rb") as f:
-                    while True:
-                        buf = f.read(chunk_size)
-                        if not buf:
-                            return
-                        q.put(buf)
-            except Exception as e:
-                q.put(e)
-            finally:
-                q.put(b"")
+        def _read(emit: Callable[[List[bytes]], None], chunk_size: int) -> None:
+            batch: List[bytes] = []
+            batch_size = 0
+            with open(target_path, "rb") as f:
+                while True:
+                    buf = f.read(chunk_size)
+                    if not buf:
+                        break
+                    batch.append(buf)
+                    batch_size += len(buf)
+                    if batch_size >= READ_BATCH_BYTES:
+                        emit(batch)
+                        batch = []
+                        batch_size = 0
+            if batch:
+                emit(batch)
 
         async def _aiter() -> AsyncIterator[bytes]:
             nonlocal chunk_size
@@ -445,22 +702,29 @@ class BaseVolume(AbstractVolume):
                     self.mount_path,
                 )
                 chunk_size = _vfs_stat.f_bsize
-            read_fut = loop.run_in_executor(None, _read, q.sync_q, chunk_size)
-            await asyncio.sleep(0)
-            try:
-                while True:
-                    buf = await q.async_q.get()
-                    if isinstance(buf, Exception):
-                        raise buf
-                    yield buf
-                    q.async_q.task_done()
-                    if not buf:
-                        return
-            finally:
-                await read_fut
+            batches = aiter_batches_from_thread(
+                functools.partial(_read, chunk_size=chunk_size),
+            )
+            async with aclosing(batches):
+                async for batch in batches:
+                    for buf in batch:
+                        yield buf
+            # an empty chunk indicates the end of file
+            yield b""
 
         return _aiter()
 
+    async def get_local_file_path(
+        self,
+        vfid: UUID,
+        relpath: PurePosixPath,
+    ) -> Optional[Path]:
+        target_path = self.sanitize_vfpath(vfid, relpath)
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, target_path.is_file):
+            return target_path
+        return None
+
     async def delete_files(
         self,
         vfid: UUID,
@@ -477,4 +741,7 @@ class BaseVolume(AbstractVolume):
                     p.unlink()
 
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _delete)
+        try:
+            await loop.run_in_executor(None, _delete)
+        finally:
+            self.invalidate_usage(vfid)
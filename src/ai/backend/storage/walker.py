@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Callable, Deque, Final, Iterator, List, Optional
+
+from ai.backend.common.logging import BraceStyleAdapter
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+DEFAULT_WALK_CONCURRENCY: Final = 8
+DEFAULT_WALK_THREADS: Final = 32
+CHECK_INTERVAL: Final = 256  # check cancellation/deadline every N entries
+
+# Invoked with the worker index, the relative path of the directory being
+# scanned and the iterator of its entries.  The callback may consume the
+# iterator partially; the walker consumes the rest to find subdirectories.
+ScanDirCallback = Callable[[int, PurePosixPath, Iterator[os.DirEntry]], None]
+
+
+class WalkCancelled(Exception):
+    pass
+
+
+class TreeWalker:
+    """
+    A multi-threaded directory tree walker.
+
+    Each worker thread keeps its own deque of directories to scan.
+    A worker takes the most recently discovered directory from its own
+    deque (depth-first, for locality) and steals the oldest one from other
+    workers' deques when it runs out of work, so that metadata requests are
+    issued in parallel even on a deep and narrow tree.
+
+    The callback is invoked from the worker threads and it is guaranteed
+    that the callback for a directory is completed before any of its
+    subdirectories is scanned.  A callback invocation for a single directory
+    always happens in a single worker thread, so callers may accumulate
+    results in per-worker containers indexed by the worker index without
+    locking.
+
+    The worker threads are taken from the given executor, which may be shared
+    by many walks to bound the total number of threads.  A worker occupies
+    its thread until the walk is done, so the walks exceeding the capacity of
+    the executor wait for the preceding ones.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        concurrency: int = DEFAULT_WALK_CONCURRENCY,
+        executor: Optional[ThreadPoolExecutor] = None,
+        deadline: Optional[float] = None,
+        follow_symlinks: bool = False,
+    ) -> None:
+        """
+        :param executor: The thread pool to run the workers.  If not given,
+            a new one is created for each walk.
+        :param deadline: The absolute time based on :func:`time.monotonic()`
+            after which the walk is aborted with :exc:`TimeoutError`.
+        :param follow_symlinks: Descend into symbolic links to directories.
+            The deadline should be set together to bound symlink loops.
+        """
+        self.root = root
+        self.concurrency = max(1, concurrency)
+        self.executor = executor
+        self.deadline = deadline
+        self.follow_symlinks = follow_symlinks
+        self._cond = threading.Condition()
+        self._queues: List[Deque[PurePosixPath]] = [
+            collections.deque() for _ in range(self.concurrency)
+        ]
+        self._pending = 0
+        self._stopped = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def cancel(self) -> None:
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _check(self) -> None:
+        if self._stopped.is_set():
+            raise WalkCancelled
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError
+
+    def _take(self, worker_idx: int) -> Optional[PurePosixPath]:
+        own_queue = self._queues[worker_idx]
+        if own_queue:
+            return own_queue.pop()
+        for offset in range(1, self.concurrency):
+            victim_queue = self._queues[(worker_idx + offset) % self.concurrency]
+            if victim_queue:
+                return victim_queue.popleft()
+        return None
+
+    def _iter_entries(
+        self,
+        scanner: Iterator[os.DirEntry],
+        relpath: PurePosixPath,
+        subdirs: List[PurePosixPath],
+    ) -> Iterator[os.DirEntry]:
+        for idx, entry in enumerate(scanner):
+            if idx % CHECK_INTERVAL == 0:
+                self._check()
+            if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                subdirs.append(relpath / entry.name)
+            yield entry
+
+    def _work(self, worker_idx: int, callback: ScanDirCallback) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped.is_set():
+                        return
+                    relpath = self._take(worker_idx)
+                    if relpath is not None:
+                        break
+                    if self._pending == 0:
+                        return
+                    self._cond.wait()
+            subdirs: List[PurePosixPath] = []
+            try:
+                self._check()
+                with os.scandir(self.root / relpath) as scanner:
+                    entries = self._iter_entries(scanner, relpath, subdirs)
+                    callback(worker_idx, relpath, entries)
+                    for _ in entries:  # find the remaining subdirectories
+                        pass
+            except WalkCancelled:
+                return
+            except BaseException as e:
+                with self._cond:
+                    if self._error is None:
+                        self._error = e
+                self.cancel()
+                return
+            with self._cond:
+                self._queues[worker_idx].extend(subdirs)
+                self._pending += len(subdirs) - 1
+                if subdirs or self._pending == 0:
+                    self._cond.notify_all()
+
+    def run(self, callback: ScanDirCallback) -> None:
+        """
+        Walk the tree, blocking the current thread until done.
+        """
+        executor = self._get_executor()
+        try:
+            futures = self._start(executor, callback)
+            for fut in futures:
+                fut.result()
+        finally:
+            if executor is not self.executor:
+                executor.shutdown()
+        self._raise_error()
+
+    async def arun(self, callback: ScanDirCallback) -> None:
+        """
+        Walk the tree without blocking the event loop.
+        Cancelling the caller stops the worker threads as well.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            futures = self._start(executor, callback)
+            await asyncio.gather(*[asyncio.wrap_future(f, loop=loop) for f in futures])
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        finally:
+            if executor is not self.executor:
+                executor.shutdown(wait=False)
+        self._raise_error()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is not None:
+            return self.executor
+        return ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix="TreeWalker",
+        )
+
+    def _start(self, executor: ThreadPoolExecutor, callback: ScanDirCallback):
+        with self._cond:
+            self._queues[0].append(PurePosixPath("."))
+            self._pending = 1
+        return [
+            executor.submit(self._work, worker_idx, callback)
+            for worker_idx in range(self.concurrency)
+        ]
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+        if self._stopped.is_set():
+            raise WalkCancelled
@@ -1,130 +1,357 @@
 import asyncio
+import copy
 import logging
 import os
+import shlex
+import subprocess
+import threading
 from pathlib import Path, PurePosixPath
 from tempfile import NamedTemporaryFile
-from typing import Dict, List
+from typing import (
+    AsyncIterator,
+    Dict,
+    Final,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
 from uuid import UUID
 
+import attr
+
 from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.types import BinarySize
 
+from .. import metrics
 from ..exception import ExecutionError, VFolderCreationError
 from ..filelock import FileLock
-from ..types import VFolderCreationOptions, VFolderUsage
+from ..types import VFolderCreationOptions, VFolderUsage, VFolderUsageResult
 from ..vfs import BaseVolume, run
+from .allocator import ProjectIdAllocator
+from .quota import (
+    DEFAULT_QUOTA_REPORT_TTL,
+    ProjectQuotaReport,
+    XfsQuotaReportCache,
+)
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
 LOCK_FILE = Path("/tmp/backendai-xfs-file-lock")
 Path(LOCK_FILE).touch()
 
+REGISTRY_LOCK_TIMEOUT: Final = 10  # seconds
+# Wait a bit before writing the registry files to let the concurrent
+# requests join the same batch.
+REGISTRY_BATCH_DELAY: Final = 0.01  # seconds
+
+
+# (inode, mtime, size) of a file, or None if it does not exist
+_FileStat = Optional[Tuple[int, int, int]]
+
+
+@attr.s(auto_attribs=True, slots=True)
+class _RegistryOp:
+    vfid: UUID
+    # None if the entry should be removed
+    vfpath: Optional[Path]
+    project_id: Optional[int]
+    future: asyncio.Future
+
 
 class XfsProjectRegistry:
+    """
+    Manages the XFS project entries in ``/etc/projects`` and ``/etc/projid``.
+
+    The project table is kept in memory and reloaded only when the files
+    have been changed by another worker process.  Concurrent additions and
+    removals are coalesced and written in a batch under the file lock,
+    replacing each file atomically with a single rename.  The updated table
+    is swapped in only after both files are written.
+    """
+
     file_projects: Path = Path("/etc/projects")
     file_projid: Path = Path("/etc/projid")
     backend: BaseVolume
-    name_id_map: Dict[UUID, int] = dict()
-    project_id_pool: List[int] = list()
+
+    def __init__(self) -> None:
+        self.name_id_map: Dict[UUID, int] = {}
+        # rebuilt lazily when the project table is reloaded
+        self._allocator: Optional[ProjectIdAllocator] = None
+        # project name -> project ID, including non-vfolder projects
+        self._projid: Dict[str, int] = {}
+        # project ID -> directory paths
+        self._projects: Dict[int, List[str]] = {}
+        # (inode, mtime, size) of the registry files when they were read last
+        self._registry_stat: Optional[Tuple[_FileStat, _FileStat]] = None
+        # serializes the reloads and updates of the table in the executor
+        self._table_lock = threading.Lock()
+        self._pending_ops: List[_RegistryOp] = []
+        self._flush_task: Optional[asyncio.Task] = None
 
     async def init(self, backend: BaseVolume) -> None:
         self.backend = backend
-
-    async def read_project_info(self):
-        def _read_projid_file():
-            return self.file_projid.read_text()
-
-        # TODO: how to handle if /etc/proj* files are deleted by external reason?
-        # TODO: do we need to use /etc/proj* files to enlist the project information?
-        if self.file_projid.is_file():
-            project_id_pool = []
-            self.name_id_map = {}
-            loop = asyncio.get_running_loop()
-            raw_projid = await loop.run_in_executor(None, _read_projid_file)
-            for line in raw_projid.splitlines():
-                proj_name, proj_id = line.split(":")[:2]
-                project_id_pool.append(int(proj_id))
-                self.name_id_map[UUID(proj_name)] = int(proj_id)
-            self.project_id_pool = sorted(project_id_pool)
-        else:
+        if not self.file_projid.is_file():
             await run(["sudo", "touch", self.file_projid])
-        if not Path(self.file_projects).is_file():
+        if not self.file_projects.is_file():
             await run(["sudo", "touch", self.file_projects])
+        await self.read_project_info()
 
-    async def add_project_entry(
+    async def aclose(self) -> None:
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+
+    @staticmethod
+    def _stat_file(path: Path) -> _FileStat:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _stat_registry(self) -> Tuple[_FileStat, _FileStat]:
+        return (self._stat_file(self.file_projid), self._stat_file(self.file_projects))
+
+    def _load(self) -> None:
+        with self._table_lock:
+            self._load_unlocked()
+
+    def _load_unlocked(self) -> None:
+        registry_stat = self._stat_registry()
+        if registry_stat == self._registry_stat:
+            return
+        projid: Dict[str, int] = {}
+        projects: Dict[int, List[str]] = {}
+        try:
+            raw_projid = self.file_projid.read_text()
+            raw_projects = self.file_projects.read_text()
+        except FileNotFoundError:
+            raw_projid = ""
+            raw_projects = ""
+        for line in raw_projid.splitlines():
+            if not line.strip() or line.startswith("#"):
+                continue
+            proj_name, proj_id = line.split(":")[:2]
+            projid[proj_name] = int(proj_id)
+        for line in raw_projects.splitlines():
+            if not line.strip() or line.startswith("#"):
+                continue
+            proj_id, proj_path = line.split(":", 1)
+            projects.setdefault(int(proj_id), []).append(proj_path)
+        self._swap(projid, projects, None, registry_stat)
+
+    def _swap(
         self,
-        *,
-        vfid: UUID,
-        quota: int,
-        project_id: int = None,
+        projid: Dict[str, int],
+        projects: Dict[int, List[str]],
+        allocator: Optional[ProjectIdAllocator],
+        registry_stat: Tuple[_FileStat, _FileStat],
     ) -> None:
-        vfpath = self.backend.mangle_vfpath(vfid)
-        if project_id is None:
-            project_id = self.get_project_id()
-
-        temp_name_projects = ""
-        temp_name_projid = ""
+        name_id_map = {}
+        for proj_name, proj_id in projid.items():
+            try:
+                name_id_map[UUID(proj_name)] = proj_id
+            except ValueError:
+                # not a vfolder
+                continue
+        # Replace the references only, so that the readers in the event loop
+        # see either the old or the new table.
+        self._projid = projid
+        self._projects = projects
+        self._allocator = allocator
+        self._registry_stat = registry_stat
+        self.name_id_map = name_id_map
 
-        def _create_temp_files():
-            nonlocal temp_name_projects, temp_name_projid
-            _tmp_projects = NamedTemporaryFile(delete=False)
-            _tmp_projid = NamedTemporaryFile(delete=False)
+    def _write(
+        self,
+        projid: Mapping[str, int],
+        projects: Mapping[int, List[str]],
+    ) -> None:
+        projid_content = "".join(
+            f"{proj_name}:{proj_id}\n" for proj_name, proj_id in projid.items()
+        )
+        projects_content = "".join(
+            f"{proj_id}:{proj_path}\n"
+            for proj_id, proj_paths in projects.items()
+            for proj_path in proj_paths
+        )
+        if os.geteuid() == 0:
+            for path, content in [
+                (self.file_projects, projects_content),
+                (self.file_projid, projid_content),
+            ]:
+                temp_path = path.with_name(f".{path.name}.tmp")
+                with open(temp_path, "w", encoding="ascii") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+        else:
+            # Copy the files next to the targets with sudo and rename them
+            # in a single subprocess.
+            commands = []
+            temp_files = []
             try:
-                _projects_content = Path(self.file_projects).read_text()
-                if _projects_content.strip() != "" and not _projects_content.endswith(
-                    "\n",
-                ):
-                    _projects_content += "\n"
-                _projects_content += f"{project_id}:{vfpath}\n"
-                _tmp_projects.write(_projects_content.encode("ascii"))
-                temp_name_projects = _tmp_projects.name
-
-                _projid_content = Path(self.file_projid).read_text()
-                if _projid_content.strip() != "" and not _projid_content.endswith("\n"):
-                    _projid_content += "\n"
-                _projid_content += f"{str(vfid)}:{project_id}\n"
-                _tmp_projid.write(_projid_content.encode("ascii"))
-                temp_name_projid = _tmp_projid.name
+                for path, content in [
+                    (self.file_projects, projects_content),
+                    (self.file_projid, projid_content),
+                ]:
+                    with NamedTemporaryFile(
+                        "w",
+                        encoding="ascii",
+                        delete=False,
+                    ) as tmp:
+                        tmp.write(content)
+                    temp_files.append(tmp.name)
+                    target_temp_path = path.with_name(f".{path.name}.tmp")
+                    commands.append(
+                        f"install -m 644 {shlex.quote(tmp.name)} "
+                        f"{shlex.quote(str(target_temp_path))} && "
+                        f"mv -f {shlex.quote(str(target_temp_path))} "
+                        f"{shlex.quote(str(path))}",
+                    )
+                with metrics.track_subprocess("sh"):
+                    subprocess.run(
+                        ["sudo", "sh", "-c", " && ".join(commands)],
+                        check=True,
+                        capture_output=True,
+                    )
+            except subprocess.CalledProcessError as e:
+                raise ExecutionError(e.stderr.decode())
             finally:
-                _tmp_projects.close()
-                _tmp_projid.close()
+                for temp_file in temp_files:
+                    os.unlink(temp_file)
 
-        def _delete_temp_files():
+    def _apply(self, ops: Sequence[_RegistryOp]) -> List[Optional[int]]:
+        """
+        Apply the given operations to a copy of the latest project table,
+        write it back, and then swap it in, returning the project ID of
+        each entry.
+        """
+        with self._table_lock:
+            self._load_unlocked()
+            projid = dict(self._projid)
+            projects = {
+                proj_id: [*proj_paths] for proj_id, proj_paths in self._projects.items()
+            }
+            allocator = copy.deepcopy(self.allocator)
+            results: List[Optional[int]] = []
+            for op in ops:
+                proj_name = str(op.vfid)
+                if op.vfpath is None:
+                    project_id = projid.pop(proj_name, None)
+                    if project_id is not None:
+                        projects.pop(project_id, None)
+                        allocator.release(project_id)
+                    results.append(project_id)
+                elif proj_name in projid:
+                    # already registered
+                    results.append(projid[proj_name])
+                else:
+                    project_id = op.project_id
+                    if project_id is not None and not allocator.reserve(project_id):
+                        log.warning(
+                            "project ID {} is already in use; "
+                            "allocating another one for vfolder {}",
+                            project_id,
+                            op.vfid,
+                        )
+                        project_id = None
+                    if project_id is None:
+                        project_id = allocator.allocate()
+                    projid[proj_name] = project_id
+                    projects.setdefault(project_id, []).append(str(op.vfpath))
+                    results.append(project_id)
             try:
-                os.unlink(temp_name_projects)
-            except FileNotFoundError:
-                pass
+                self._write(projid, projects)
+            except BaseException:
+                # The files may have been partially replaced.
+                # Force reloading them on the next access.
+                self._registry_stat = None
+                raise
+            self._swap(projid, projects, allocator, self._stat_registry())
+            return results
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        lock_timeout = float(
+            self.backend.config.get("registry_lock_timeout", REGISTRY_LOCK_TIMEOUT),
+        )
+        while self._pending_ops:
+            await asyncio.sleep(REGISTRY_BATCH_DELAY)
+            ops, self._pending_ops = self._pending_ops, []
             try:
-                os.unlink(temp_name_projid)
-            except FileNotFoundError:
-                pass
+                async with FileLock(LOCK_FILE, timeout=lock_timeout):
+                    results = await loop.run_in_executor(None, self._apply, ops)
+            except Exception as e:
+                for op in ops:
+                    if not op.future.done():
+                        op.future.set_exception(e)
+            else:
+                for op, result in zip(ops, results):
+                    if not op.future.done():
+                        op.future.set_result(result)
 
+    async def _submit(
+        self,
+        vfid: UUID,
+        vfpath: Optional[Path],
+        project_id: Optional[int] = None,
+    ) -> Optional[int]:
         loop = asyncio.get_running_loop()
-        try:
-            await loop.run_in_executor(None, _create_temp_files)
-            await run(["sudo", "cp", "-rp", temp_name_projects, self.file_projects])
-            await run(["sudo", "cp", "-rp", temp_name_projid, self.file_projid])
-        finally:
-            await loop.run_in_executor(None, _delete_temp_files)
+        op = _RegistryOp(vfid, vfpath, project_id, loop.create_future())
+        self._pending_ops.append(op)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        # Let the batch complete even if the caller is cancelled.
+        return await asyncio.shield(op.future)
+
+    async def read_project_info(self) -> None:
+        """
+        Reload the project table if the registry files have been changed.
+        As the files are replaced atomically, no lock is required.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._load)
+
+    async def add_project_entry(
+        self,
+        *,
+        vfid: UUID,
+        quota: int,
+        project_id: int = None,
+    ) -> int:
+        """
+        Register the vfolder as a project and return its project ID.
+        """
+        vfpath = self.backend.mangle_vfpath(vfid)
+        result = await self._submit(vfid, vfpath, project_id)
+        assert result is not None
+        return result
 
     async def remove_project_entry(self, vfid: UUID) -> None:
-        await run(["sudo", "sed", "-i.bak", f"/{vfid.hex[4:]}/d", self.file_projects])
-        await run(["sudo", "sed", "-i.bak", f"/{vfid}/d", self.file_projid])
+        await self._submit(vfid, None)
+
+    @property
+    def allocator(self) -> ProjectIdAllocator:
+        if self._allocator is None:
+            self._allocator = ProjectIdAllocator(
+                [
+                    *self._projid.values(),
+                    *self._projects.keys(),
+                ],
+            )
+        return self._allocator
 
     def get_project_id(self) -> int:
         """
-        Get the next project_id, which is the smallest unused integer.
+        Allocate the next project_id, which is the smallest unused integer.
+        It should be called under the registry lock after reloading the
+        project table so that it is not allocated by other workers.
         """
-        project_id = -1
-        for i in range(len(self.project_id_pool) - 1):
-            if self.project_id_pool[i] + 1 != self.project_id_pool[i + 1]:
-                project_id = self.project_id_pool[i] + 1
-                break
-        if len(self.project_id_pool) == 0:
-            project_id = 1
-        if project_id == -1:
-            project_id = self.project_id_pool[-1] + 1
-        return project_id
+        return self.allocator.allocate()
 
 
 class XfsVolume(BaseVolume):
@@ -138,12 +365,21 @@ class XfsVolume(BaseVolume):
     """
 
     registry: XfsProjectRegistry
+    quota_report: XfsQuotaReportCache
 
     async def init(self, uid: int = None, gid: int = None) -> None:
         self.uid = uid if uid is not None else os.getuid()
         self.gid = gid if gid is not None else os.getgid()
         self.registry = XfsProjectRegistry()
         await self.registry.init(self)
+        self.quota_report = XfsQuotaReportCache(
+            self.mount_path,
+            ttl=float(self.config.get("quota_report_ttl", DEFAULT_QUOTA_REPORT_TTL)),
+        )
+
+    async def shutdown(self) -> None:
+        await self.registry.aclose()
+        await super().shutdown()
 
     # ----- volume opeartions -----
     async def create_vfolder(
@@ -166,12 +402,19 @@ class XfsVolume(BaseVolume):
         # if not quota:
         #     return
         try:
-            async with FileLock(LOCK_FILE):
-                log.info("setting project quota (f:{}, q:{})", vfid, str(quota))
-                await self.registry.read_project_info()
-                await self.registry.add_project_entry(vfid=vfid, quota=quota)
-                await self.set_quota(vfid, quota)
-                await self.registry.read_project_info()
+            log.info("setting project quota (f:{}, q:{})", vfid, str(quota))
+            await self.registry.add_project_entry(vfid=vfid, quota=quota)
+            await run(
+                [
+                    "sudo",
+                    "xfs_quota",
+                    "-x",
+                    "-c",
+                    f"project -s {vfid}",
+                    self.mount_path,
+                ],
+            )
+            await self.set_quota(vfid, quota)
         except (asyncio.CancelledError, asyncio.TimeoutError) as e:
             log.exception("vfolder creation timeout", exc_info=e)
             await self.delete_vfolder(vfid)
@@ -182,50 +425,53 @@ class XfsVolume(BaseVolume):
             raise VFolderCreationError("problem in setting vfolder quota")
 
     async def delete_vfolder(self, vfid: UUID) -> None:
-        async with FileLock(LOCK_FILE):
-            await self.registry.read_project_info()
-            if vfid in self.registry.name_id_map.keys():
-                try:
-                    log.info("removing project quota (f:{})", vfid)
-                    await self.set_quota(vfid, BinarySize(0))
-                except (asyncio.CancelledError, asyncio.TimeoutError) as e:
-                    log.exception("vfolder deletion timeout", exc_info=e)
-                    pass  # Pass to delete the physical directlry anyway.
-                except Exception as e:
-                    log.exception("vfolder deletion error", exc_info=e)
-                    pass  # Pass to delete the physical directlry anyway.
-                finally:
-                    await self.registry.remove_project_entry(vfid)
-            await super().delete_vfolder(vfid)
-            await self.registry.read_project_info()
+        await self.registry.read_project_info()
+        if vfid in self.registry.name_id_map.keys():
+            try:
+                log.info("removing project quota (f:{})", vfid)
+                await self.set_quota(vfid, BinarySize(0))
+            except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+                log.exception("vfolder deletion timeout", exc_info=e)
+                pass  # Pass to delete the physical directlry anyway.
+            except Exception as e:
+                log.exception("vfolder deletion error", exc_info=e)
+                pass  # Pass to delete the physical directlry anyway.
+            finally:
+                await self.registry.remove_project_entry(vfid)
+        await super().delete_vfolder(vfid)
+
+    async def _get_quota_report(self, vfid: UUID) -> ProjectQuotaReport:
+        await self.registry.read_project_info()
+        project_id = self.registry.name_id_map.get(vfid)
+        if project_id is None:
+            raise ExecutionError(f"vfolder {vfid} is not registered as a project")
+        report = await self.quota_report.get(project_id)
+        if report is None:
+            # The cached report may be older than the project.
+            await self.quota_report.invalidate()
+            report = await self.quota_report.get(project_id)
+            if report is None:
+                raise ExecutionError(f"no xfs_quota report for vfolder {vfid}")
+        return report
+
+    async def get_quota_reports(self) -> Mapping[UUID, ProjectQuotaReport]:
+        """
+        Return the usage and quota of all vfolders in the volume from a single
+        (cached) xfs_quota report.
+        """
+        await self.registry.read_project_info()
+        reports = await self.quota_report.get_all()
+        return {
+            vfid: reports[project_id]
+            for vfid, project_id in self.registry.name_id_map.items()
+            if project_id in reports
+        }
 
     async def get_quota(self, vfid: UUID) -> BinarySize:
-        full_report = await run(
-            ["sudo", "xfs_quota", "-x", "-c", "report -h", self.mount_path],
-        )
-        for line in full_report.split("\n"):
-            if str(vfid) in line:
-                report = line
-                break
-        if len(report.split()) != 6:
-            raise ExecutionError("unexpected format for xfs_quota report")
-        proj_name, _, _, quota, _, _ = report.split()
-        if not str(vfid).startswith(proj_name):
-            raise ExecutionError("vfid and project name does not match")
-        return BinarySize.finite_from_str(quota)
+        report = await self._get_quota_report(vfid)
+        return BinarySize(report.hard_limit)
 
     async def set_quota(self, vfid: UUID, size_bytes: BinarySize) -> None:
-        if vfid not in self.registry.name_id_map.keys():
-            await run(
-                [
-                    "sudo",
-                    "xfs_quota",
-                    "-x",
-                    "-c",
-                    f"project -s {vfid}",
-                    self.mount_path,
-                ],
-            )
         await run(
             [
                 "sudo",
@@ -236,20 +482,38 @@ class XfsVolume(BaseVolume):
                 self.mount_path,
             ],
         )
+        await self.quota_report.invalidate()
+
+    async def get_usage_batch(
+        self,
+        vfids: Sequence[UUID],
+        *,
+        with_quota: bool = False,
+    ) -> AsyncIterator[VFolderUsageResult]:
+        # Answer all from a single xfs_quota report.
+        try:
+            reports = await self.get_quota_reports()
+        except ExecutionError as e:
+            for vfid in dict.fromkeys(vfids):
+                yield VFolderUsageResult(vfid, error=repr(e))
+            return
+        for vfid in dict.fromkeys(vfids):
+            report = reports.get(vfid)
+            if report is None:
+                yield VFolderUsageResult(
+                    vfid,
+                    error=f"vfolder {vfid} is not registered as a project",
+                )
+                continue
+            yield VFolderUsageResult(
+                vfid,
+                usage=VFolderUsage(
+                    file_count=report.file_count,
+                    used_bytes=report.used_bytes,
+                ),
+                quota=BinarySize(report.hard_limit) if with_quota else None,
+            )
 
     async def get_usage(self, vfid: UUID, relpath: PurePosixPath = PurePosixPath(".")):
-        full_report = await run(
-            ["sudo", "xfs_quota", "-x", "-c", "report -pbih", self.mount_path],
-        )
-        report = ""
-        for line in full_report.split("\n"):
-            if str(vfid) in line:
-                report = line
-                break
-        if len(report.split()) != 11:
-            raise ExecutionError("unexpected format for xfs_quota report")
-        proj_name, used_size, _, _, _, _, inode_used, _, _, _, _ = report.split()
-        used_bytes = int(BinarySize.finite_from_str(used_size))
-        if not str(vfid).startswith(proj_name):
-            raise ExecutionError("vfid and project name does not match")
-        return VFolderUsage(file_count=int(inode_used), used_bytes=used_bytes)
+        report = await self._get_quota_report(vfid)
+        return VFolderUsage(file_count=report.file_count, used_bytes=report.used_bytes)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import bisect
+from typing import Final, Iterable, List
+
+from ..exception import ExecutionError
+
+# The project ID 0 is the default project of all files.
+MIN_PROJECT_ID: Final = 1
+MAX_PROJECT_ID: Final = 2**32 - 1
+
+
+class ProjectIdAllocator:
+    """
+    Allocates the smallest free XFS project IDs.
+
+    The free IDs are kept as a sorted list of disjoint half-open intervals
+    so that finding, reserving and releasing an ID takes a binary search
+    instead of scanning all IDs in use.
+    """
+
+    def __init__(
+        self,
+        used_ids: Iterable[int] = (),
+        *,
+        min_id: int = MIN_PROJECT_ID,
+        max_id: int = MAX_PROJECT_ID,
+    ) -> None:
+        self.min_id = min_id
+        self.max_id = max_id
+        # the starts and (exclusive) ends of the free intervals
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        start = min_id
+        for used_id in sorted(set(used_ids)):
+            if used_id < min_id or used_id > max_id:
+                continue
+            if start < used_id:
+                self._starts.append(start)
+                self._ends.append(used_id)
+            start = used_id + 1
+        if start <= max_id:
+            self._starts.append(start)
+            self._ends.append(max_id + 1)
+
+    def _find(self, project_id: int) -> int:
+        """
+        Return the index of the free interval containing the given ID, or -1.
+        """
+        idx = bisect.bisect_right(self._starts, project_id) - 1
+        if idx >= 0 and project_id < self._ends[idx]:
+            return idx
+        return -1
+
+    def is_free(self, project_id: int) -> bool:
+        return self._find(project_id) >= 0
+
+    def allocate(self) -> int:
+        """
+        Reserve and return the smallest free ID.
+        """
+        if not self._starts:
+            raise ExecutionError("no free XFS project ID is left")
+        project_id = self._starts[0]
+        self.reserve(project_id)
+        return project_id
+
+    def reserve(self, project_id: int) -> bool:
+        """
+        Mark the given ID as used.
+        Returns False if it is already in use or out of the range.
+        """
+        idx = self._find(project_id)
+        if idx < 0:
+            return False
+        start, end = self._starts[idx], self._ends[idx]
+        if start == project_id and end == project_id + 1:
+            del self._starts[idx]
+            del self._ends[idx]
+        elif start == project_id:
+            self._starts[idx] = project_id + 1
+        elif end == project_id + 1:
+            self._ends[idx] = project_id
+        else:
+            # split the interval
+            self._ends[idx] = project_id
+            self._starts.insert(idx + 1, project_id + 1)
+            self._ends.insert(idx + 1, end)
+        return True
+
+    def release(self, project_id: int) -> None:
+        """
+        Mark the given ID as free, merging the adjacent free intervals.
+        """
+        if project_id < self.min_id or project_id > self.max_id:
+            return
+        if self.is_free(project_id):
+            return
+        idx = bisect.bisect_right(self._starts, project_id)
+        merge_prev = idx > 0 and self._ends[idx - 1] == project_id
+        merge_next = idx < len(self._starts) and self._starts[idx] == project_id + 1
+        if merge_prev and merge_next:
+            self._ends[idx - 1] = self._ends[idx]
+            del self._starts[idx]
+            del self._ends[idx]
+        elif merge_prev:
+            self._ends[idx - 1] = project_id + 1
+        elif merge_next:
+            self._starts[idx] = project_id
+        else:
+            self._starts.insert(idx, project_id)
+            self._ends.insert(idx, project_id + 1)
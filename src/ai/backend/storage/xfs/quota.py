@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Final, Mapping, Optional
+
+import attr
+
+from ai.backend.common.logging import BraceStyleAdapter
+
+from ..vfs import run
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+DEFAULT_QUOTA_REPORT_TTL: Final = 5.0  # seconds
+# xfs_quota reports the block counts in KiB unless "-h" is given.
+REPORT_BLOCK_SIZE: Final = 1024
+
+# The grace periods may contain spaces, e.g., "[7 days]".
+_REPORT_FIELD_RE: Final = re.compile(r"\[[^\]]*\]|\S+")
+
+
+@attr.s(auto_attribs=True, slots=True)
+class ProjectQuotaReport:
+    used_bytes: int
+    soft_limit: int
+    hard_limit: int
+    file_count: int
+
+
+def parse_quota_report(report: str) -> Dict[int, ProjectQuotaReport]:
+    """
+    Parse the output of ``xfs_quota -x -c "report -pbinN"`` into a mapping
+    from the project IDs to their block and inode usage and limits.
+    Malformed lines are skipped so that they do not affect the other projects.
+    """
+    result: Dict[int, ProjectQuotaReport] = {}
+    for line in report.splitlines():
+        fields = _REPORT_FIELD_RE.findall(line)
+        if not fields or not fields[0].startswith("#"):
+            continue
+        # ID, blocks (used, soft, hard, warn, grace), inodes (the same)
+        try:
+            if len(fields) != 11:
+                raise ValueError("unexpected number of fields")
+            result[int(fields[0][1:])] = ProjectQuotaReport(
+                used_bytes=int(fields[1]) * REPORT_BLOCK_SIZE,
+                soft_limit=int(fields[2]) * REPORT_BLOCK_SIZE,
+                hard_limit=int(fields[3]) * REPORT_BLOCK_SIZE,
+                file_count=int(fields[6]),
+            )
+        except ValueError:
+            log.warning("skipping an unexpected xfs_quota report line: {!r}", line)
+    return result
+
+
+class XfsQuotaReportCache:
+    """
+    Caches the parsed project quota report of an XFS volume so that the
+    usage and quota queries of many vfolders share a single ``xfs_quota``
+    invocation.
+
+    The report is also stored in a state file shared by the worker
+    processes, so that only one of them needs to refresh it in each TTL.
+    """
+
+    def __init__(
+        self,
+        mount_path: Path,
+        *,
+        ttl: float = DEFAULT_QUOTA_REPORT_TTL,
+        state_dir: Path = None,
+    ) -> None:
+        self.mount_path = mount_path
+        self.ttl = ttl
+        if state_dir is None:
+            state_dir = Path(f"/tmp/backend.ai/ipc/storage-proxy-xfs-{os.getppid()}")
+        mount_hash = hashlib.sha1(str(mount_path).encode("utf-8")).hexdigest()[:16]
+        self.state_path = state_dir / f"quota-report-{mount_hash}.json"
+        self._report: Optional[Mapping[int, ProjectQuotaReport]] = None
+        self._updated_at = 0.0  # wall-clock timestamp
+        self._generation = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _remove_state(self) -> None:
+        try:
+            self.state_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    async def invalidate(self) -> None:
+        """
+        Make the next query refresh the report, e.g., after changing quotas
+        or projects.  Usage changes are left to the TTL.
+        """
+        self._report = None
+        self._generation += 1
+        self._refresh_task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._remove_state)
+
+    def _read_state(self) -> Optional[Mapping[int, ProjectQuotaReport]]:
+        try:
+            data = json.loads(self.state_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - data["updated_at"] > self.ttl:
+            return None
+        self._updated_at = data["updated_at"]
+        return {
+            int(project_id): ProjectQuotaReport(**fields)
+            for project_id, fields in data["projects"].items()
+        }
+
+    def _write_state(self, report: Mapping[int, ProjectQuotaReport]) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.state_path.with_name(
+            f".{self.state_path.name}.{os.getpid()}.tmp",
+        )
+        temp_path.write_text(
+            json.dumps(
+                {
+                    "updated_at": self._updated_at,
+                    "projects": {
+                        str(project_id): attr.asdict(fields)
+                        for project_id, fields in report.items()
+                    },
+                },
+            ),
+        )
+        temp_path.rename(self.state_path)
+
+    async def _refresh(self) -> Mapping[int, ProjectQuotaReport]:
+        loop = asyncio.get_running_loop()
+        generation = self._generation
+        report = await loop.run_in_executor(None, self._read_state)
+        if report is None:
+            raw_report = await run(
+                ["sudo", "xfs_quota", "-x", "-c", "report -pbinN", self.mount_path],
+            )
+            report = parse_quota_report(raw_report)
+            self._updated_at = time.time()
+            if generation == self._generation:
+                await loop.run_in_executor(None, self._write_state, report)
+        if generation == self._generation:
+            self._report = report
+        return report
+
+    async def get_all(self) -> Mapping[int, ProjectQuotaReport]:
+        if self._report is not None and time.time() - self._updated_at <= self.ttl:
+            return self._report
+        # Let the concurrent queries share the same refresh.
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return await asyncio.shield(self._refresh_task)
+
+    async def get(self, project_id: int) -> Optional[ProjectQuotaReport]:
+        report = await self.get_all()
+        return report.get(project_id)
@@ -0,0 +1,221 @@
+import asyncio
+import contextlib
+import io
+import os
+import tarfile
+import uuid
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import jwt
+import pytest
+import zstandard
+from aiohttp.test_utils import TestClient, TestServer
+
+from ai.backend.storage.api import client as client_api
+from ai.backend.storage.archive import (
+    CompressionMethod,
+    TarStreamWriter,
+    TarZstdStreamWriter,
+    ZipStreamWriter,
+    crc32_combine,
+    inspect_archive_members,
+    list_archive_members,
+)
+from ai.backend.storage.vfs import BaseVolume
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    try:
+        yield executor
+    finally:
+        executor.shutdown()
+
+
+async def _build_zip(root: Path, executor, **kwargs):
+    relpaths = await list_archive_members(root)
+    members = await inspect_archive_members(root, relpaths, executor)
+    writer = ZipStreamWriter(members, executor, max_inflight_blocks=8, **kwargs)
+    buf = io.BytesIO()
+    async for chunk in writer.iter_chunks():
+        buf.write(chunk)
+    return writer, members, buf.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_list_members_with_shared_walk_executor(tmp_path):
+    for idx in range(5):
+        (tmp_path / f"dir{idx}").mkdir()
+        (tmp_path / f"dir{idx}" / "file").write_bytes(b"x")
+    # The concurrent walks exceeding the pool capacity wait for each other.
+    walk_executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        results = await asyncio.gather(
+            *[
+                list_archive_members(
+                    tmp_path,
+                    scan_concurrency=4,
+                    walk_executor=walk_executor,
+                )
+                for _ in range(3)
+            ],
+        )
+    finally:
+        walk_executor.shutdown()
+    expected = [Path(f"dir{idx}/file") for idx in range(5)]
+    assert all([Path(relpath) for relpath in result] == expected for result in results)
+
+
+def test_crc32_combine():
+    a = os.urandom(1000)
+    b = os.urandom(12345)
+    assert crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)) == zlib.crc32(a + b)
+    assert crc32_combine(zlib.crc32(a), zlib.crc32(b""), 0) == zlib.crc32(a)
+    assert crc32_combine(0, zlib.crc32(b), len(b)) == zlib.crc32(b)
+
+
+@pytest.mark.asyncio
+async def test_zip_stream(tmp_path, executor):
+    text = b"".join(b"line %d of a compressible log\n" % idx for idx in range(100000))
+    noise = os.urandom(300000)
+    (tmp_path / "inner").mkdir()
+    (tmp_path / "empty").mkdir()
+    (tmp_path / "log.txt").write_bytes(text)
+    (tmp_path / "inner" / "noise.bin").write_bytes(noise)
+    (tmp_path / "inner" / "photo.jpg").write_bytes(b"not really a jpeg" * 100)
+    (tmp_path / "inner" / "zero").write_bytes(b"")
+
+    # use a small block size to compress each file in multiple blocks
+    writer, members, data = await _build_zip(tmp_path, executor, block_size=65536)
+    methods = {str(m.relpath): m.method for m in members}
+    assert methods == {
+        "empty": CompressionMethod.STORE,
+        "inner/noise.bin": CompressionMethod.STORE,
+        "inner/photo.jpg": CompressionMethod.STORE,
+        "inner/zero": CompressionMethod.STORE,
+        "log.txt": CompressionMethod.DEFLATE,
+    }
+    assert writer.content_length is None
+    assert len(data) < len(text) + len(noise)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == [
+            "empty/",
+            "inner/noise.bin",
+            "inner/photo.jpg",
+            "inner/zero",
+            "log.txt",
+        ]
+        assert zf.getinfo("empty/").is_dir()
+        assert zf.read("log.txt") == text
+        assert zf.read("inner/noise.bin") == noise
+        assert zf.read("inner/zero") == b""
+
+
+@pytest.mark.asyncio
+async def test_zip_stream_content_length(tmp_path, executor):
+    noise = os.urandom(200000)
+    (tmp_path / "a.zip").write_bytes(noise)
+    (tmp_path / "b.png").write_bytes(noise[:1000])
+    writer, _, data = await _build_zip(tmp_path, executor, block_size=65536)
+    assert writer.content_length == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.read("a.zip") == noise
+        assert zf.read("b.png") == noise[:1000]
+
+
+@pytest.mark.asyncio
+async def test_tar_stream(tmp_path, executor):
+    (tmp_path / "inner").mkdir()
+    (tmp_path / "empty").mkdir()
+    (tmp_path / "hello.txt").write_bytes(b"hello")
+    (tmp_path / "inner" / ("long-name-" * 20)).write_bytes(b"x" * 1000)
+    relpaths = await list_archive_members(tmp_path)
+    members = await inspect_archive_members(
+        tmp_path,
+        relpaths,
+        executor,
+        compress=False,
+    )
+
+    writer = TarStreamWriter(members)
+    buf = io.BytesIO()
+    for part in writer.iter_parts():
+        if isinstance(part, bytes):
+            buf.write(part)
+        else:
+            buf.write(part.path.read_bytes())
+    data = buf.getvalue()
+    assert writer.content_length == len(data)
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        assert tf.getmember("empty").isdir()
+        assert tf.extractfile("hello.txt").read() == b"hello"
+        assert tf.extractfile("inner/" + "long-name-" * 20).read() == b"x" * 1000
+
+    zstd_writer = TarZstdStreamWriter(members, threads=2)
+    compressed = b"".join([chunk async for chunk in zstd_writer.iter_chunks()])
+    decompressed = (
+        zstandard.ZstdDecompressor().stream_reader(io.BytesIO(compressed)).read()
+    )
+    assert decompressed == data
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sendfile", [True, False])
+async def test_download_tar_archive(tmp_path, monkeypatch, sendfile):
+    volume = BaseVolume({}, tmp_path)
+    await volume.init()
+    vfid = uuid.uuid4()
+    await volume.create_vfolder(vfid)
+    root = volume.mangle_vfpath(vfid) / "dir"
+    root.mkdir()
+    files = {f"file{idx}": os.urandom(100_000 * idx + 7) for idx in range(4)}
+    for name, data in files.items():
+        (root / name).write_bytes(data)
+    if not sendfile:
+        monkeypatch.setattr(client_api, "_can_sendfile", lambda *args: False)
+
+    secret = "x" * 32
+
+    class Context:
+        local_config = {"storage-proxy": {"secret": secret, "archive-threads": 2}}
+
+        @contextlib.asynccontextmanager
+        async def get_volume(self, name):
+            yield volume
+
+    token = jwt.encode(
+        {
+            "op": "download",
+            "volume": "local",
+            "vfid": str(vfid),
+            "relpath": "dir",
+            "archive": True,
+            "unmanaged_path": None,
+        },
+        secret,
+        algorithm="HS256",
+    )
+    app = await client_api.init_client_app(Context())
+    try:
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get(
+                "/download",
+                params={"token": token, "archive": "true", "archive_format": "tar"},
+            )
+            assert response.status == 200
+            data = await response.read()
+    finally:
+        await volume.shutdown()
+    assert int(response.headers["Content-Length"]) == len(data)
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        for name, content in files.items():
+            extracted = tf.extractfile(name)
+            assert extracted is not None
+            assert extracted.read() == content
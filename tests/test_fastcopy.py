@@ -0,0 +1,76 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from ai.backend.storage import fastcopy
+from ai.backend.storage.fastcopy import CopyStrategy
+
+
+@pytest.fixture
+def src_file(tmp_path: Path) -> Path:
+    path = tmp_path / "src.bin"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 123))
+    os.chmod(path, 0o640)
+    os.utime(path, (1600000000, 1600000000))
+    return path
+
+
+def test_copy2(tmp_path: Path, src_file: Path) -> None:
+    dst_file = tmp_path / "dst.bin"
+    strategy = fastcopy.copy2(src_file, dst_file)
+    assert isinstance(strategy, CopyStrategy)
+    assert dst_file.read_bytes() == src_file.read_bytes()
+    assert dst_file.stat().st_mode & 0o777 == 0o640
+    assert dst_file.stat().st_mtime == 1600000000
+
+
+@pytest.mark.parametrize("strategy", [*CopyStrategy])
+def test_copy_file_with_strategy(
+    tmp_path: Path,
+    src_file: Path,
+    strategy: CopyStrategy,
+) -> None:
+    if strategy != CopyStrategy.BUFFERED and sys.platform != "linux":
+        pytest.skip("requires Linux")
+    dst_file = tmp_path / "dst.bin"
+    # The buffered copy is always available as the last resort.
+    used = fastcopy.copy_file(
+        src_file,
+        dst_file,
+        strategies=[strategy, CopyStrategy.BUFFERED],
+    )
+    assert used in (strategy, CopyStrategy.BUFFERED)
+    assert dst_file.read_bytes() == src_file.read_bytes()
+
+
+def test_copy_empty_file(tmp_path: Path) -> None:
+    src_file = tmp_path / "empty"
+    src_file.touch()
+    dst_file = tmp_path / "dst"
+    fastcopy.copy_file(src_file, dst_file)
+    assert dst_file.read_bytes() == b""
+
+
+@pytest.mark.parametrize("strategy", [*CopyStrategy])
+def test_concat_files(tmp_path: Path, strategy: CopyStrategy) -> None:
+    if strategy != CopyStrategy.BUFFERED and sys.platform != "linux":
+        pytest.skip("requires Linux")
+    # Mix the block-aligned and unaligned sizes.
+    sizes = [64 * 1024, 1000, 0, 2 * 1024 * 1024 + 7]
+    src_files = []
+    for idx, size in enumerate(sizes):
+        path = tmp_path / f"part{idx}"
+        path.write_bytes(os.urandom(size))
+        src_files.append(path)
+    dst_file = tmp_path / "dst.bin"
+    # The stale data beyond the concatenated contents is truncated.
+    dst_file.write_bytes(b"stale data" * 300 * 1024)
+    used = fastcopy.concat_files(
+        src_files,
+        dst_file,
+        strategies=[strategy, CopyStrategy.BUFFERED],
+    )
+    assert sum(used.values()) == len(sizes)
+    assert dst_file.read_bytes() == b"".join(p.read_bytes() for p in src_files)
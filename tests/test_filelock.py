@@ -0,0 +1,104 @@
+import asyncio
+import fcntl
+import threading
+
+import pytest
+
+from ai.backend.storage import metrics
+from ai.backend.storage.filelock import FileLock, get_lock_stats
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    path = tmp_path / "lock"
+    path.touch()
+    return path
+
+
+@pytest.mark.asyncio
+async def test_filelock_fifo(lock_path):
+    order = []
+
+    async def _hold(idx: int) -> None:
+        async with FileLock(lock_path, timeout=5):
+            order.append(idx)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[_hold(idx) for idx in range(5)])
+    assert order == [*range(5)]
+    stats = get_lock_stats()[str(lock_path)]
+    assert stats.acquired == 5
+    assert stats.timeouts == 0
+    assert stats.hold_seconds >= 0.05
+    assert stats.max_wait_seconds > 0
+
+
+@pytest.mark.asyncio
+async def test_filelock_held_by_another_process(lock_path):
+    # flock() locks held via different open files conflict with each other
+    # as if they were held by different processes.
+    with open(lock_path, "rb") as other:
+        fcntl.flock(other, fcntl.LOCK_EX)
+        with pytest.raises(TimeoutError):
+            async with FileLock(lock_path, timeout=0.2):
+                pass
+        assert get_lock_stats()[str(lock_path)].timeouts == 1
+
+        async def _release_later() -> None:
+            await asyncio.sleep(0.2)
+            fcntl.flock(other, fcntl.LOCK_UN)
+
+        release_task = asyncio.create_task(_release_later())
+        async with FileLock(lock_path, timeout=5) as lock:
+            assert lock.locked
+        await release_task
+
+
+@pytest.mark.asyncio
+async def test_filelock_cancel(lock_path):
+    async with FileLock(lock_path):
+        task = asyncio.create_task(FileLock(lock_path).__aenter__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    async with FileLock(lock_path, timeout=1):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_filelock_timeouts_reuse_waiter(lock_path):
+    def _count_waiter_threads() -> int:
+        return sum(
+            1
+            for thread in threading.enumerate()
+            if thread.name == f"FileLock({lock_path})"
+        )
+
+    with open(lock_path, "rb") as other:
+        fcntl.flock(other, fcntl.LOCK_EX)
+        for _ in range(3):
+            with pytest.raises(TimeoutError):
+                async with FileLock(lock_path, timeout=0.05):
+                    pass
+        # The blocked flock() threads do not pile up.
+        assert _count_waiter_threads() == 1
+        fcntl.flock(other, fcntl.LOCK_UN)
+        # The next acquirer takes over the abandoned waiter.
+        async with FileLock(lock_path, timeout=5) as lock:
+            assert lock.locked
+            for _ in range(100):
+                if _count_waiter_threads() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            assert _count_waiter_threads() == 0
+    timeouts = dict(
+        (tuple(key), value)
+        for key, value in metrics.file_lock_timeouts.snapshot()["samples"]
+    )
+    assert timeouts[(str(lock_path),)] == 3
+    wait_samples = dict(
+        (tuple(key), value)
+        for key, value in metrics.file_lock_wait_duration.snapshot()["samples"]
+    )
+    assert wait_samples[(str(lock_path),)][-1] == 1  # the count
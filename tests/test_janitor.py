@@ -0,0 +1,40 @@
+import os
+import time
+import uuid
+from pathlib import Path
+
+from ai.backend.storage.janitor import iter_vfolder_paths, reap_upload_sessions
+from ai.backend.storage.vfs import BaseVolume
+
+
+def test_reap_upload_sessions(tmp_path: Path) -> None:
+    volume = BaseVolume({}, tmp_path)
+    vfid = uuid.uuid4()
+    vfpath = volume.mangle_vfpath(vfid)
+    upload_base_path = vfpath / ".upload"
+    upload_base_path.mkdir(parents=True)
+    (tmp_path / "lost+found").mkdir()
+    assert [*iter_vfolder_paths(tmp_path)] == [vfpath]
+
+    old_mtime = time.time() - 7200
+    abandoned = upload_base_path / "a"
+    abandoned.write_bytes(b"x" * 10000)
+    (upload_base_path / "a.parts").mkdir()
+    (upload_base_path / "a.parts" / "0123456789abcdef-10").write_bytes(b"y" * 10)
+    for path in [
+        abandoned,
+        upload_base_path / "a.parts",
+        upload_base_path / "a.parts" / "0123456789abcdef-10",
+    ]:
+        os.utime(path, (old_mtime, old_mtime))
+    # Another session which is still being written
+    (upload_base_path / "b").write_bytes(b"z" * 10)
+
+    num_sessions, num_bytes = reap_upload_sessions(vfpath, time.time() - 3600)
+    assert num_sessions == 1
+    assert num_bytes >= 10000
+    assert sorted(os.listdir(upload_base_path)) == ["b"]
+
+    num_sessions, _ = reap_upload_sessions(vfpath, time.time() + 1)
+    assert num_sessions == 1
+    assert not upload_base_path.exists()
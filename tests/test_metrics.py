@@ -0,0 +1,129 @@
+import json
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from ai.backend.storage.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsExporter,
+    build_metrics_middleware,
+    count_prepared_response,
+    get_command_name,
+    merge_snapshots,
+    render_metrics,
+    streamed_bytes,
+)
+
+
+def test_render_merged_metrics() -> None:
+    requests = Counter("test_requests_total", "Requests.", ("route",))
+    duration = Histogram(
+        "test_duration_seconds",
+        "Latency.",
+        ("route",),
+        buckets=(0.1, 1.0),
+    )
+    requests.inc(route="/upload")
+    requests.inc(2, route='/a"b')
+    duration.observe(0.05, route="/upload")
+    duration.observe(1.0, route="/upload")
+    snapshot = {
+        requests.name: requests.snapshot(),
+        duration.name: duration.snapshot(),
+    }
+    # The snapshots of the other workers are read from JSON files.
+    other_snapshot = json.loads(json.dumps(snapshot))
+    merged = merge_snapshots([snapshot, other_snapshot])
+    assert render_metrics(merged).splitlines() == [
+        "# HELP test_duration_seconds Latency.",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{route="/upload",le="0.1"} 2',
+        'test_duration_seconds_bucket{route="/upload",le="1.0"} 4',
+        'test_duration_seconds_bucket{route="/upload",le="+Inf"} 4',
+        'test_duration_seconds_sum{route="/upload"} 2.1',
+        'test_duration_seconds_count{route="/upload"} 4',
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/a\\"b"} 4',
+        'test_requests_total{route="/upload"} 2',
+    ]
+    # merging does not modify the metrics of this worker
+    assert duration.snapshot()["samples"] == [[["/upload"], [1, 1, 0, 1.05, 2]]]
+
+
+def test_get_command_name() -> None:
+    assert get_command_name([b"sudo", b"/usr/sbin/xfs_quota", b"-x"]) == "xfs_quota"
+    assert get_command_name(["xcp", "scan"]) == "xcp"
+
+
+@pytest.mark.asyncio
+async def test_metrics_middleware_counts_streamed_bytes(tmp_path: Path) -> None:
+    file_path = tmp_path / "data"
+    file_path.write_bytes(b"x" * 3000)
+
+    async def stream(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        response.content_length = 1000
+        await response.prepare(request)
+        await response.write(b"y" * 1000)
+        return response
+
+    async def fetch(request: web.Request) -> web.StreamResponse:
+        return web.FileResponse(file_path)
+
+    app = web.Application(
+        middlewares=[
+            build_metrics_middleware(
+                "test",
+                streamed_routes={"/stream": "test-stream", "/fetch": "test-fetch"},
+            ),
+        ],
+    )
+    app.on_response_prepare.append(count_prepared_response)
+    app.router.add_route("GET", "/stream", stream)
+    app.router.add_route("GET", "/fetch", fetch)
+    async with TestClient(TestServer(app)) as client:
+        for route in ("/stream", "/fetch"):
+            response = await client.get(route)
+            await response.read()
+    samples = {key[0]: value for key, value in streamed_bytes.snapshot()["samples"]}
+    assert samples["test-stream"] == 1000
+    assert samples["test-fetch"] == 3000
+
+
+@pytest.mark.asyncio
+async def test_metrics_exporter_keeps_counters_of_terminated_workers(
+    tmp_path: Path,
+) -> None:
+    requests = Counter("test_worker_requests_total", "Requests.")
+    running = Gauge("test_worker_running", "Running.")
+    requests.inc(3)
+    running.inc(2)
+    snapshot = {
+        requests.name: requests.snapshot(),
+        running.name: running.snapshot(),
+    }
+    dead_pid = subprocess.Popen(["true"]).pid
+    os.waitpid(dead_pid, 0)
+    (tmp_path / f"metrics-{dead_pid}.json").write_text(json.dumps(snapshot))
+
+    exporter = MetricsExporter(tmp_path)
+    merged = await exporter.collect()
+    assert merged[requests.name]["samples"] == {(): 3}
+    assert running.name not in merged
+
+    exporter.start()
+    await exporter.aclose()
+    # The final snapshot of this worker is kept without the gauges.
+    assert not exporter.state_path.exists()
+    retired_paths = [*tmp_path.glob("metrics-retired-*.json")]
+    assert len(retired_paths) == 1
+    retired_snapshot = json.loads(retired_paths[0].read_text())
+    assert "backendai_storage_api_requests_total" in retired_snapshot
+    assert "backendai_storage_subprocesses_running" not in retired_snapshot
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import os
 import secrets
 import shutil
@@ -5,8 +7,13 @@ import uuid
 from pathlib import Path, PurePath, PurePosixPath
 
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
 from ai.backend.storage.purestorage import FlashBladeVolume
+from ai.backend.storage.purestorage.pdu import PduUsageParser
+from ai.backend.storage.purestorage.pls import PlsListingDecoder
+from ai.backend.storage.purestorage.purity import PurityClient
 from ai.backend.storage.types import DirEntryType
 
 
@@ -80,3 +87,105 @@ async def test_fb_scandir(fb_volume, empty_vfolder):
     assert entries[2].type == DirEntryType.FILE
     assert entries[3].name == "test2.txt"
     assert entries[3].type == DirEntryType.SYMLINK
+
+
+@pytest.mark.asyncio
+async def test_purity_client_reuses_auth_token():
+    num_logins = 0
+    valid_tokens = set()
+
+    async def _login(request: web.Request) -> web.Response:
+        nonlocal num_logins
+        num_logins += 1
+        token = f"token-{num_logins}"
+        valid_tokens.add(token)
+        return web.json_response({}, headers={"x-auth-token": token})
+
+    async def _arrays(request: web.Request) -> web.Response:
+        if request.headers.get("x-auth-token") not in valid_tokens:
+            return web.json_response({}, status=401)
+        return web.json_response(
+            {
+                "items": [
+                    {
+                        "id": "array-id",
+                        "name": "array",
+                        "os": "Purity//FB",
+                        "revision": "r1",
+                        "version": "3.0",
+                    },
+                ],
+                "pagination_info": {"continuation_token": None},
+            },
+        )
+
+    app = web.Application()
+    app.router.add_post("/api/login", _login)
+    app.router.add_get("/api/1.8/arrays", _arrays)
+    async with TestServer(app) as server:
+        client = PurityClient(str(server.make_url("/")), "api-token")
+        try:
+            results = await asyncio.gather(*[client.get_metadata() for _ in range(5)])
+            assert all(result["id"] == "array-id" for result in results)
+            assert num_logins == 1
+            # The expired token is refreshed only once for concurrent requests.
+            valid_tokens.clear()
+            await asyncio.gather(*[client.get_metadata() for _ in range(5)])
+            assert num_logins == 2
+        finally:
+            await client.aclose()
+
+
+def test_pdu_usage_parser():
+    root = Path("/mnt/vfroot/ab/cd/ef")
+    output = (
+        b"100\t/mnt/vfroot/ab/cd/ef/a\0"
+        b"23\t/mnt/vfroot/ab/cd/ef/b c\0"
+        b"7\t/mnt/vfroot/ab/cd/ef/d/e 42\0"
+        b"130\t/mnt/vfroot/ab/cd/ef\0"
+    )
+    parser = PduUsageParser(root)
+    # Split the records at arbitrary positions as the pipe reads do.
+    for pos in range(0, len(output), 5):
+        parser.feed(output[pos : pos + 5])
+    parser.close()
+    assert parser.total_size == 130
+    assert parser.total_count == 3
+
+    parser = PduUsageParser(root, include_root=True)
+    parser.feed(b"130\t/mnt/vfroot/ab/cd/ef")
+    parser.close()
+    assert parser.total_size == 130
+    assert parser.total_count == 1
+
+
+def test_pls_listing_decoder():
+    output = b"".join(
+        json.dumps(
+            {
+                "path": f"/mnt/vfroot/ab/cd/ef/file{idx}",
+                "filetype": 40000 if idx == 3 else 100000,
+                "size": idx,
+                "uid": 1000,
+                "mode": 644,
+                "mtime": 1600000000,
+                "ctime": 1600000000,
+            },
+        ).encode()
+        + b"\n"
+        for idx in reversed(range(10))
+    )
+    decoder = PlsListingDecoder(after="file1", limit=5)
+    entries = []
+    for pos in range(0, len(output), 100):
+        entries.extend(decoder.feed(output[pos : pos + 100]))
+    entries.extend(decoder.close())
+    assert [entry.name for entry in entries] == [f"file{idx}" for idx in range(2, 7)]
+    assert entries[1].type == DirEntryType.DIRECTORY
+    assert entries[0].stat.mode == 0o644
+
+    # Without the limit, the entries are returned in the listed order.
+    decoder = PlsListingDecoder(after="file6")
+    entries = decoder.feed(output)
+    entries.extend(decoder.close())
+    assert [entry.name for entry in entries] == ["file9", "file8", "file7"]
@@ -0,0 +1,81 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from ai.backend.storage.upload import (
+    UploadFileWriter,
+    UploadSessionState,
+    UploadSessionStore,
+    preallocate,
+    release_preallocation,
+)
+
+
+def test_release_preallocation(tmp_path: Path) -> None:
+    path = tmp_path / "upload"
+    path.write_bytes(b"x" * 1000)
+    if not preallocate(path, 4 * 1024 * 1024):
+        pytest.skip("fallocate() is not supported")
+    assert path.stat().st_blocks * 512 >= 4 * 1024 * 1024
+    release_preallocation(path)
+    assert path.stat().st_blocks * 512 < 4 * 1024 * 1024
+    assert path.read_bytes() == b"x" * 1000
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("direct_io", [False, True])
+async def test_upload_file_writer(tmp_path: Path, direct_io: bool) -> None:
+    data = os.urandom(3 * 1024 * 1024 + 4321)
+    path = tmp_path / "upload"
+    path.touch()
+    preallocate(path, len(data))
+    assert path.stat().st_size == 0
+    # Resume the upload from unaligned offsets as separate requests do.
+    for begin, end in [
+        (0, 1000),
+        (1000, 2 * 1024 * 1024 + 1),
+        (2 * 1024 * 1024 + 1, len(data)),
+    ]:
+        async with UploadFileWriter(
+            path,
+            buffer_size=256 * 1024,
+            max_inflight=2,
+            direct_io=direct_io,
+        ) as writer:
+            assert writer.offset == begin
+            for pos in range(begin, end, 100_000):
+                await writer.write(data[pos : min(pos + 100_000, end)])
+        assert writer.offset == end
+    assert path.read_bytes() == data
+
+
+@pytest.mark.asyncio
+async def test_upload_session_store(tmp_path: Path) -> None:
+    path = tmp_path / "session"
+    state_dir = tmp_path / "ipc"
+    store = UploadSessionStore(state_dir)
+    assert await store.get(path, 100) is None
+    path.write_bytes(b"x" * 10)
+    # Falls back to the file size without the state file.
+    assert await store.get(path, 100) == UploadSessionState(offset=10, length=100)
+    await store.update(path, 42, 100)
+    path.unlink()
+    # The states are kept out of the vfolder.
+    assert os.listdir(tmp_path) == ["ipc"]
+    # Served from memory without reading the files.
+    assert await store.get(path, 100) == UploadSessionState(offset=42, length=100)
+    # Another worker loads the state from the shared state file.
+    other_store = UploadSessionStore(state_dir)
+    assert await other_store.get(path, 0) == UploadSessionState(offset=42, length=100)
+    # The state updated by another worker is not hidden by the cached one.
+    await other_store.update(path, 50, 100)
+    assert await store.get(path, 100) == UploadSessionState(offset=50, length=100)
+    await store.forget(path)
+    assert await store.get(path, 100) is None
+    assert os.listdir(state_dir) == []
+
+    await store.update(path, 10, 100)
+    assert store.reap_states(time.time() - 3600) == 0
+    assert store.reap_states(time.time() + 1) == 1
@@ -0,0 +1,80 @@
+import asyncio
+import uuid
+from pathlib import Path, PurePosixPath
+from uuid import UUID
+
+import pytest
+
+from ai.backend.storage.usage import DirUsageMap, VFolderUsageIndex
+
+
+@pytest.mark.asyncio
+async def test_usage_index_eviction() -> None:
+    scanned = []
+
+    async def scan(vfid: UUID) -> DirUsageMap:
+        scanned.append(vfid)
+        return {".": (1, 100), "sub": (0, 0)}
+
+    index = VFolderUsageIndex(scan, max_entries=2)
+    vfids = [uuid.uuid4() for _ in range(3)]
+    try:
+        for vfid in vfids[:2]:
+            usage = await index.get(vfid)
+            assert (usage.file_count, usage.used_bytes) == (1, 100)
+        # Query the first one again to keep it while caching the third one.
+        await index.get(vfids[0], PurePosixPath("sub"))
+        await index.get(vfids[2])
+        assert scanned == vfids
+        await index.get(vfids[0])
+        assert scanned == vfids
+        await index.get(vfids[1])
+        assert scanned == [*vfids, vfids[1]]
+
+        await index.discard(vfids[1])
+        # Invalidating the uncached vfolders is no-op.
+        index.invalidate(vfids[1])
+        assert vfids[1] not in index._generations
+    finally:
+        await index.aclose()
+
+
+@pytest.mark.asyncio
+async def test_usage_index_shared_between_workers(tmp_path: Path) -> None:
+    scanned = []
+
+    async def scan(vfid: UUID) -> DirUsageMap:
+        scanned.append(vfid)
+        return {".": (len(scanned), 100)}
+
+    # Each worker process has its own index sharing the same state directory.
+    index1 = VFolderUsageIndex(scan, state_dir=tmp_path)
+    index2 = VFolderUsageIndex(scan, state_dir=tmp_path)
+    vfid = uuid.uuid4()
+    try:
+        usage = await index1.get(vfid)
+        assert usage.file_count == 1
+        # The other worker reuses the scan result.
+        usage = await index2.get(vfid)
+        assert usage.file_count == 1
+        assert scanned == [vfid]
+
+        # An invalidation in one worker makes the others rescan.
+        index1.invalidate(vfid)
+        await asyncio.gather(*index1._pending_touches.values())
+        usage = await index2.get(vfid)
+        assert usage.file_count == 1  # the last known usage
+        await index2._refresh_tasks[vfid]
+        usage = await index2.get(vfid)
+        assert usage.file_count == 2
+        # The first worker adopts the new scan result.
+        usage = await index1.get(vfid)
+        assert usage.file_count == 2
+        await asyncio.gather(*index1._refresh_tasks.values())
+        assert scanned == [vfid, vfid]
+
+        await index1.discard(vfid)
+        assert not (tmp_path / f"{vfid.hex}.json").exists()
+    finally:
+        await index1.aclose()
+        await index2.aclose()
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from ai.backend.storage.utils import AsyncTTLCache
+
+
+@pytest.mark.asyncio
+async def test_async_ttl_cache():
+    num_fetches = 0
+
+    async def _fetch() -> int:
+        nonlocal num_fetches
+        num_fetches += 1
+        await asyncio.sleep(0.05)
+        return num_fetches
+
+    cache: AsyncTTLCache[str, int] = AsyncTTLCache(0.2)
+    # concurrent lookups share a single fetch
+    results = await asyncio.gather(*[cache.get("a", _fetch) for _ in range(5)])
+    assert results == [1] * 5
+    assert await cache.get("a", _fetch) == 1
+    assert num_fetches == 1
+
+    cache.invalidate("a")
+    assert await cache.get("a", _fetch) == 2
+    await asyncio.sleep(0.25)
+    assert await cache.get("a", _fetch) == 3
+
+
+@pytest.mark.asyncio
+async def test_async_ttl_cache_error():
+    async def _fail() -> int:
+        raise ZeroDivisionError
+
+    async def _fetch() -> int:
+        return 1
+
+    cache: AsyncTTLCache[str, int] = AsyncTTLCache(10)
+    with pytest.raises(ZeroDivisionError):
+        await cache.get("a", _fail)
+    # errors are not cached
+    assert await cache.get("a", _fetch) == 1
@@ -1,8 +1,17 @@
+import asyncio
+import json
+import os
+import shutil
 import uuid
-from pathlib import Path, PurePath
+from pathlib import Path, PurePath, PurePosixPath
 
 import pytest
 
+from ai.backend.storage.clone import (
+    CloneStatus,
+    CloneTaskManager,
+    get_clone_manifest_path,
+)
 from ai.backend.storage.vfs import BaseVolume
 
 
@@ -67,6 +76,146 @@ async def test_vfs_get_usage(vfs, empty_vfolder):
     assert usage.used_bytes == 11
 
 
+@pytest.mark.asyncio
+async def test_vfs_get_usage_cached(vfs, empty_vfolder):
+    vfpath = vfs.mangle_vfpath(empty_vfolder)
+    (vfpath / "test.txt").write_bytes(b"12345")
+    (vfpath / "inner").mkdir()
+    (vfpath / "inner" / "hello.txt").write_bytes(b"678")
+    (vfpath / "inner" / "world.txt").write_bytes(b"901")
+    usage = await vfs.get_usage(empty_vfolder)
+    assert usage.file_count == 3
+    assert usage.used_bytes == 11
+    assert usage.updated_at is not None
+    usage = await vfs.get_usage(empty_vfolder, PurePosixPath("inner"))
+    assert usage.file_count == 2
+    assert usage.used_bytes == 6
+
+    # changes made by the storage proxy invalidate the cached usage
+    await vfs.delete_files(empty_vfolder, [PurePosixPath("inner/hello.txt")])
+    for _ in range(50):
+        usage = await vfs.get_usage(empty_vfolder, PurePosixPath("inner"))
+        if usage.file_count == 1:
+            break
+        await asyncio.sleep(0.05)
+    assert usage.file_count == 1
+    assert usage.used_bytes == 3
+
+    # the directories created after the scan are picked up by a rescan
+    (vfpath / "new").mkdir()
+    (vfpath / "new" / "a.txt").write_bytes(b"1")
+    usage = await vfs.get_usage(empty_vfolder, PurePosixPath("new"))
+    assert usage.file_count == -1
+    await asyncio.gather(*vfs.usage_index._refresh_tasks.values())
+    usage = await vfs.get_usage(empty_vfolder, PurePosixPath("new"))
+    assert usage.file_count == 1
+    with pytest.raises(FileNotFoundError):
+        await vfs.get_usage(empty_vfolder, PurePosixPath("missing"))
+    with pytest.raises(NotADirectoryError):
+        await vfs.get_usage(empty_vfolder, PurePosixPath("test.txt"))
+
+
+@pytest.mark.asyncio
+async def test_vfs_get_usage_batch(vfs, empty_vfolder):
+    vfpath = vfs.mangle_vfpath(empty_vfolder)
+    (vfpath / "test.txt").write_bytes(b"12345")
+    missing_vfid = uuid.uuid4()
+    results = {
+        result.vfid: result
+        async for result in vfs.get_usage_batch(
+            [empty_vfolder, missing_vfid, empty_vfolder],
+            with_quota=True,
+        )
+    }
+    assert len(results) == 2
+    assert results[empty_vfolder].usage.file_count == 1
+    assert results[empty_vfolder].usage.used_bytes == 5
+    assert results[empty_vfolder].error is None
+    assert results[missing_vfid].usage is None
+    assert results[missing_vfid].error is not None
+
+
+@pytest.mark.asyncio
+async def test_vfs_scandir_pagination(vfs, empty_vfolder):
+    vfpath = vfs.mangle_vfpath(empty_vfolder)
+    for idx in range(10):
+        (vfpath / f"file{idx}.txt").write_bytes(b"x")
+    all_names = [
+        item.name async for item in vfs.scandir(empty_vfolder, PurePosixPath("."))
+    ]
+    assert sorted(all_names) == sorted(f"file{idx}.txt" for idx in range(10))
+    pages = []
+    cursor = None
+    while True:
+        page = [
+            item.name
+            async for item in vfs.scandir(
+                empty_vfolder,
+                PurePosixPath("."),
+                after=cursor,
+                limit=4,
+            )
+        ]
+        if not page:
+            break
+        pages.append(page)
+        cursor = page[-1]
+        if len(pages) == 1:
+            # The following pages are not affected by the changes in
+            # the directory during the pagination.
+            (vfpath / "file0.txt").unlink()
+            (vfpath / "file00.txt").write_bytes(b"y")
+    assert [len(page) for page in pages] == [4, 4, 2]
+    assert [name for page in pages for name in page] == sorted(all_names)
+
+    # stopping the iteration early should not block.
+    entries = vfs.scandir(empty_vfolder, PurePosixPath("."))
+    await entries.__anext__()
+    await asyncio.wait_for(entries.aclose(), timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_vfs_read_file(vfs, empty_vfolder):
+    vfpath = vfs.mangle_vfpath(empty_vfolder)
+    data = os.urandom(16 * 1024 * 1024 + 123)
+    (vfpath / "large.bin").write_bytes(data)
+    chunks = [
+        chunk
+        async for chunk in vfs.read_file(
+            empty_vfolder,
+            PurePosixPath("large.bin"),
+            chunk_size=64 * 1024,
+        )
+    ]
+    assert chunks[-1] == b""
+    assert b"".join(chunks) == data
+
+    # stopping the iteration early should not block the reader thread
+    # waiting for the consumer.
+    chunks_aiter = vfs.read_file(
+        empty_vfolder,
+        PurePosixPath("large.bin"),
+        chunk_size=4096,
+    )
+    assert await chunks_aiter.__anext__() == data[:4096]
+    await asyncio.sleep(0.1)
+    await asyncio.wait_for(chunks_aiter.aclose(), timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_vfs_get_local_file_path(vfs, empty_vfolder):
+    vfpath = vfs.mangle_vfpath(empty_vfolder)
+    (vfpath / "inner").mkdir()
+    (vfpath / "inner" / "hello.txt").write_bytes(b"678")
+    file_path = await vfs.get_local_file_path(
+        empty_vfolder,
+        PurePosixPath("inner/hello.txt"),
+    )
+    assert file_path == (vfpath / "inner" / "hello.txt").resolve()
+    assert await vfs.get_local_file_path(empty_vfolder, PurePosixPath("inner")) is None
+    assert await vfs.get_local_file_path(empty_vfolder, PurePosixPath("x")) is None
+
+
 @pytest.mark.asyncio
 async def test_vfs_clone(vfs):
     vfid1 = uuid.uuid4()
@@ -87,6 +236,57 @@ async def test_vfs_clone(vfs):
     await vfs.delete_vfolder(vfid2)
 
 
+@pytest.mark.asyncio
+async def test_vfs_clone_resume(vfs, tmp_path):
+    vfid1 = uuid.uuid4()
+    vfid2 = uuid.uuid4()
+    await vfs.create_vfolder(vfid1)
+    vfpath1 = vfs.mangle_vfpath(vfid1)
+    vfpath2 = vfs.mangle_vfpath(vfid2)
+    (vfpath1 / "test.txt").write_bytes(b"12345")
+    (vfpath1 / "inner").mkdir()
+    (vfpath1 / "inner" / "hello.txt").write_bytes(b"678")
+
+    # simulate a previous clone which has copied only "test.txt"
+    await vfs.create_vfolder(vfid2)
+    shutil.copy2(vfpath1 / "test.txt", vfpath2 / "test.txt")
+    src_stat = (vfpath1 / "test.txt").stat()
+    # a file with the same name as the old manifest should be copied as well
+    (vfpath1 / ".clone-manifest").write_bytes(b"user data")
+    manifest_path = get_clone_manifest_path(vfs.mount_path, vfid2)
+    manifest_path.parent.mkdir(parents=True)
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "path": "test.txt",
+                "size": src_stat.st_size,
+                "mtime_ns": src_stat.st_mtime_ns,
+            },
+        )
+        + "\n",
+    )
+
+    clone_tasks = CloneTaskManager(tmp_path / "tasks")
+    progress = clone_tasks.start(
+        lambda progress: vfs.clone_vfolder(vfid1, vfs, vfid2, progress=progress),
+    )
+    for _ in range(100):
+        reported = await clone_tasks.get_progress(progress.task_id)
+        if reported is not None and reported.status != CloneStatus.RUNNING:
+            break
+        await asyncio.sleep(0.05)
+    assert reported is not None
+    assert reported.status == CloneStatus.DONE
+    assert reported.skipped_files == 1
+    assert reported.copied_files == 2
+    assert reported.copied_bytes == 12
+    assert (vfpath2 / "inner" / "hello.txt").read_bytes() == b"678"
+    assert (vfpath2 / ".clone-manifest").read_bytes() == b"user data"
+    assert not manifest_path.exists()
+    await vfs.delete_vfolder(vfid1)
+    await vfs.delete_vfolder(vfid2)
+
+
 @pytest.mark.asyncio
 async def test_vfs_operation(vfs, empty_vfolder):
     vfpath = vfs.mangle_vfpath(empty_vfolder)
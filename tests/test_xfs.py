@@ -1,3 +1,4 @@
+import asyncio
 import os
 import uuid
 from pathlib import Path, PurePath
@@ -5,8 +6,11 @@ from pathlib import Path, PurePath
 import pytest
 
 from ai.backend.common.types import BinarySize
+from ai.backend.storage.exception import ExecutionError
 from ai.backend.storage.vfs import BaseVolume, run
-from ai.backend.storage.xfs import XfsVolume
+from ai.backend.storage.xfs import XfsProjectRegistry, XfsVolume
+from ai.backend.storage.xfs.allocator import ProjectIdAllocator
+from ai.backend.storage.xfs.quota import ProjectQuotaReport, parse_quota_report
 
 
 def read_etc_projid():
@@ -20,7 +24,11 @@ def read_etc_projid():
 
 
 def read_etc_projects():
-    with open("/etc/projects") as fp:
+    return read_projects_file(Path("/etc/projects"))
+
+
+def read_projects_file(path: Path):
+    with open(path) as fp:
         content = fp.read()
     vfpath_id_dict = {}
     for line in content.splitlines():
@@ -250,3 +258,125 @@ async def test_xfs_clone_to_xfs(xfs, vfs):
 
     await xfs.delete_vfolder(vfid_src)
     await xfs.delete_vfolder(vfid_dst)
+
+
+@pytest.mark.asyncio
+async def test_xfs_registry_batched_updates(tmp_path, vfs):
+    registry = XfsProjectRegistry()
+    registry.file_projects = tmp_path / "projects"
+    registry.file_projid = tmp_path / "projid"
+    registry.file_projects.write_text("1:/srv/other\n")
+    registry.file_projid.write_text("other:1\n")
+    await registry.init(vfs)
+
+    vfids = [uuid.uuid4() for _ in range(10)]
+    project_ids = await asyncio.gather(
+        *[registry.add_project_entry(vfid=vfid, quota=0) for vfid in vfids],
+    )
+    assert sorted(project_ids) == [*range(2, 12)]
+    assert registry.name_id_map == dict(zip(vfids, project_ids))
+    await asyncio.gather(
+        *[registry.remove_project_entry(vfid) for vfid in vfids[:5]],
+    )
+
+    # Another registry (e.g., in another worker) sees the changes.
+    other_registry = XfsProjectRegistry()
+    other_registry.file_projects = registry.file_projects
+    other_registry.file_projid = registry.file_projid
+    await other_registry.init(vfs)
+    assert other_registry.name_id_map == dict(zip(vfids[5:], project_ids[5:]))
+    assert read_projects_file(registry.file_projects) == {
+        1: "/srv/other",
+        **{
+            project_id: str(vfs.mangle_vfpath(vfid))
+            for vfid, project_id in zip(vfids[5:], project_ids[5:])
+        },
+    }
+    new_vfid = uuid.uuid4()
+    new_project_id = await other_registry.add_project_entry(vfid=new_vfid, quota=0)
+    assert new_project_id == min(project_ids[:5])
+    await registry.read_project_info()
+    assert registry.name_id_map[new_vfid] == new_project_id
+    # A project ID already in use is not shared.
+    dup_vfid = uuid.uuid4()
+    dup_project_id = await registry.add_project_entry(
+        vfid=dup_vfid,
+        quota=0,
+        project_id=new_project_id,
+    )
+    assert dup_project_id not in project_ids[5:] + [1, new_project_id]
+    await registry.aclose()
+    await other_registry.aclose()
+
+
+def test_xfs_project_id_allocator():
+    allocator = ProjectIdAllocator([1, 2, 5, 7], max_id=10)
+    assert allocator.allocate() == 3
+    assert allocator.allocate() == 4
+    assert allocator.allocate() == 6
+    assert allocator.reserve(9)
+    assert not allocator.reserve(9)
+    assert allocator.allocate() == 8
+    allocator.release(4)
+    allocator.release(2)
+    assert allocator.allocate() == 2
+    assert allocator.allocate() == 4
+    assert allocator.allocate() == 10
+    with pytest.raises(ExecutionError):
+        allocator.allocate()
+    for project_id in range(1, 11):
+        allocator.release(project_id)
+    assert allocator._starts == [1]
+    assert allocator._ends == [11]
+
+
+def test_xfs_parse_quota_report():
+    raw_report = (
+        "#0              8          0          0     00 [--------]"
+        "       3          0          0     00 [--------]\n"
+        "#12          1024      10240      10240     00 [--------]"
+        "       5          0          0     00 [--------]\n"
+        "#13         10240      10240      10240     00 [7 days]"
+        "       9          0          0     00 [--------]\n"
+        "#14      garbage\n"
+        "\n"
+    )
+    report = parse_quota_report(raw_report)
+    assert report[0].used_bytes == 8 * 1024
+    assert report[12] == ProjectQuotaReport(
+        used_bytes=1024 * 1024,
+        soft_limit=10240 * 1024,
+        hard_limit=10240 * 1024,
+        file_count=5,
+    )
+    # The grace period of a vfolder at its limit contains a space.
+    assert report[13].file_count == 9
+    assert 14 not in report
+
+
+@pytest.mark.asyncio
+async def test_xfs_registry_failed_update(tmp_path, vfs, monkeypatch):
+    registry = XfsProjectRegistry()
+    registry.file_projects = tmp_path / "projects"
+    registry.file_projid = tmp_path / "projid"
+    registry.file_projects.touch()
+    registry.file_projid.touch()
+    await registry.init(vfs)
+    vfid = uuid.uuid4()
+    project_id = await registry.add_project_entry(vfid=vfid, quota=0)
+
+    def _fail_write(*args) -> None:
+        raise ExecutionError("cannot write")
+
+    monkeypatch.setattr(registry, "_write", _fail_write)
+    with pytest.raises(ExecutionError):
+        await registry.add_project_entry(vfid=uuid.uuid4(), quota=0)
+    # The failed update is not applied to the table in memory.
+    assert registry.name_id_map == {vfid: project_id}
+    monkeypatch.undo()
+
+    # Changes in either file are reloaded.
+    registry.file_projects.write_text("")
+    await registry.read_project_info()
+    assert registry._projects == {}
+    await registry.aclose()